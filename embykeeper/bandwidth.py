@@ -0,0 +1,193 @@
+import asyncio
+import time
+from typing import Dict, Optional, Set
+
+from loguru import logger
+
+from embykeeper.config import config
+
+logger = logger.bind(scheme="bandwidth")
+
+
+class TokenBucket:
+    """令牌桶限速器.
+
+    以理论到达时间 (GCRA) 实现, 预留字节时直接计算所需等待时间, 无需后台补充令牌.
+    """
+
+    def __init__(self, rate: float, burst: float = None):
+        self.rate = rate
+        self.burst = rate if burst is None else burst
+        self._tat = 0.0
+
+    def reserve(self, n: int) -> float:
+        """预留 n 字节, 返回需要等待的秒数."""
+        now = time.monotonic()
+        self._tat = max(self._tat, now) + n / self.rate
+        return max(0.0, self._tat - now - self.burst / self.rate)
+
+
+class StreamFlow:
+    """受带宽调节器管理的单个模拟播放流."""
+
+    def __init__(self, governor: "BandwidthGovernor", name: str, server: str, proxy: Optional[str]):
+        self.governor = governor
+        self.name = name
+        self.server = server
+        self.proxy = proxy
+        self.keys = [("total",), ("server", server)]
+        if proxy:
+            self.keys.append(("proxy", proxy))
+        self.received = 0
+        self.started = time.monotonic()
+        # 单个流不允许突发, 每读取一块后等待对应的时长, 以减少事件循环唤醒次数
+        self._bucket = TokenBucket(governor.session_rate, burst=0)
+        self._pending = 0
+
+    @property
+    def recv_speed(self) -> int:
+        """该流当前的公平分配速率 (字节/秒), 用于限制底层连接的接收速度."""
+        return max(1, int(self.governor.fair_rate(self)))
+
+    @property
+    def chunk_size(self) -> int:
+        return self.governor.chunk_size(self._bucket.rate)
+
+    @property
+    def throughput(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.received / elapsed if elapsed > 0 else 0.0
+
+    async def consume(self, n: int):
+        """记录已读取 n 字节, 累积到一块后按各级预算等待."""
+        self.received += n
+        self.governor.received += n
+        self._pending += n
+        if self._pending < self.chunk_size:
+            return
+        n, self._pending = self._pending, 0
+        buckets = [self._bucket, *self.governor.buckets_for(self)]
+        wait = max(b.reserve(n) for b in buckets)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def close(self):
+        self.governor.close(self)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        self.close()
+
+
+class BandwidthGovernor:
+    """进程级模拟播放带宽调节器.
+
+    所有 Emby / Subsonic 模拟播放流共享总预算, 并分别受单服务器, 单代理与单流预算限制.
+    预算单位均为 KiB/s, 未设置 (None) 时不限制.
+    """
+
+    # 每块数据对应的播放时长 (秒)
+    CHUNK_SECONDS = 4
+    MIN_CHUNK = 4 * 1024
+    MAX_CHUNK = 256 * 1024
+
+    def __init__(self):
+        self._flows: Set[StreamFlow] = set()
+        self._buckets: Dict[tuple, TokenBucket] = {}
+        self._counts: Dict[tuple, int] = {}
+        self._reporter: Optional[asyncio.Task] = None
+        self.received = 0
+        self.started = time.monotonic()
+
+    def _limit(self, name: str) -> Optional[float]:
+        try:
+            value = getattr(config.bandwidth, name)
+        except RuntimeError:
+            value = None
+        return value * 1024 if value else None
+
+    @property
+    def session_rate(self) -> float:
+        return self._limit("session") or 1024
+
+    def chunk_size(self, rate: float) -> int:
+        return int(min(self.MAX_CHUNK, max(self.MIN_CHUNK, rate * self.CHUNK_SECONDS)))
+
+    def _budget(self, key: tuple) -> Optional[float]:
+        return self._limit(key[0])
+
+    def buckets_for(self, flow: StreamFlow):
+        for key in flow.keys:
+            rate = self._budget(key)
+            if not rate:
+                continue
+            bucket = self._buckets.get(key, None)
+            if not bucket or bucket.rate != rate:
+                bucket = self._buckets[key] = TokenBucket(rate)
+            yield bucket
+
+    def fair_rate(self, flow: StreamFlow) -> float:
+        rate = self.session_rate
+        for key in flow.keys:
+            budget = self._budget(key)
+            if budget:
+                rate = min(rate, budget / max(1, self._counts.get(key, 0)))
+        return rate
+
+    def open(self, name: str, server: str, proxy: Optional[str] = None) -> StreamFlow:
+        """登记一个新的播放流."""
+        flow = StreamFlow(self, name, server, proxy)
+        self._flows.add(flow)
+        for key in flow.keys:
+            self._counts[key] = self._counts.get(key, 0) + 1
+        reporter = self._reporter
+        if not reporter or reporter.done() or reporter.get_loop() is not asyncio.get_running_loop():
+            self._reporter = asyncio.create_task(self._report_loop())
+        return flow
+
+    def close(self, flow: StreamFlow):
+        if flow not in self._flows:
+            return
+        self._flows.discard(flow)
+        for key in flow.keys:
+            self._counts[key] -= 1
+            if not self._counts[key]:
+                # 清理不再使用的预算
+                del self._counts[key]
+                self._buckets.pop(key, None)
+        logger.debug(
+            f'播放流 "{flow.name}" 结束: 共接收 {flow.received / 1024:.1f} KiB, '
+            f"平均 {flow.throughput / 1024:.2f} KiB/s."
+        )
+
+    def stats(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "received": self.received,
+            "throughput": self.received / elapsed if elapsed > 0 else 0.0,
+            "flows": {f.name: f.throughput for f in self._flows},
+        }
+
+    def report(self):
+        current = sum(f.throughput for f in self._flows)
+        logger.debug(
+            f"模拟播放带宽: {len(self._flows)} 个播放流, 当前 {current / 1024:.2f} KiB/s, "
+            f"累计接收 {self.received / 1024 / 1024:.2f} MiB."
+        )
+        for f in sorted(self._flows, key=lambda f: f.throughput, reverse=True)[:10]:
+            logger.trace(f'播放流 "{f.name}": {f.throughput / 1024:.2f} KiB/s.')
+
+    async def _report_loop(self):
+        try:
+            interval = config.bandwidth.report_interval
+        except RuntimeError:
+            interval = 600
+        while self._flows:
+            await asyncio.sleep(interval)
+            if self._flows:
+                self.report()
+
+
+governor = BandwidthGovernor()
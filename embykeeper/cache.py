@@ -1,117 +1,918 @@
+import asyncio
+import atexit
+import copy
+import functools
 import json
-from typing import Any, List
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List
 
+from cachetools import LRUCache, TTLCache
 from loguru import logger
 
+from . import var
 from .utils import CachedFuncProxy
 from .config import config
 
+_DELETED = object()
+_MISSING = object()
 
-class Cache:
-    def __init__(self):
-        self._mongo_client = None
-        if hasattr(config, "mongodb") and config.mongodb:
+# JSON 快照中保存过期时间的保留键
+_EXPIRES_KEY = "_expires"
+
+
+def _expires_at(ttl: float = None) -> float:
+    return time.time() + ttl if ttl else None
+
+
+def _synchronized(func):
+    """使用实例的 _lock 保护方法, 以便在线程池中调用."""
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kw):
+        with self._lock:
+            return func(self, *args, **kw)
+
+    return wrapper
+
+
+def _journaled(func):
+    """同 _synchronized, 并在释放锁后执行写入所触发的日志合并.
+
+    写入已记录到日志, 合并失败时仅记录警告, 并在下次写入时重试.
+    """
+
+    @functools.wraps(func)
+    def wrapper(self, *args, **kw):
+        with self._lock:
+            result = func(self, *args, **kw)
+        if self._compact_due:
             try:
-                from pymongo import MongoClient
+                self.compact()
+            except Exception as e:
+                self._compact_due = True
+                logger.warning(f"本地缓存日志合并失败, 将在下次写入时重试: {e}")
+        return result
 
-                self._mongo_client = MongoClient(config.mongodb)
-                self._db = self._mongo_client.embykeeper
-                self._collection = self._db.cache
-            except ImportError:
-                logger.warning("没有安装 pymongo 包, 将使用 JSON 存储缓存.")
-                self._setup_json_cache()
-        else:
-            self._setup_json_cache()
+    return wrapper
+
+
+async def _to_thread(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, functools.partial(func, *args))
+
+
+class _ThreadedAsyncMixin:
+    """通过线程池提供异步接口, 避免本地文件读写阻塞事件循环."""
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        return await _to_thread(self.get, key, default)
+
+    async def aset(self, key: str, value: Any, ttl: float = None) -> None:
+        await _to_thread(self.set, key, value, ttl)
+
+    async def adelete(self, key: str) -> None:
+        await _to_thread(self.delete, key)
+
+
+class JSONCacheBackend(_ThreadedAsyncMixin):
+    """基于 JSON 快照和追加日志的本地缓存.
+
+    内存中的字典始终为最新数据, 每次写入仅向日志文件追加一行, 日志过大时合并回快照.
+    合并时仅在锁内序列化数据并轮换日志, 快照文件的写入在锁外进行, 期间的读写不会被阻塞.
+    启动时读取快照并重放日志, 写入中途崩溃只会导致最后一行不完整, 重放时将被忽略.
+    设置了有效时间的键记录在快照的 "_expires" 保留键中.
+    """
 
-    def _setup_json_cache(self):
-        self._cache_file = config.basedir / "cache.json"
+    def __init__(self, path: Path, compact_min_size: int = 1024 * 1024, compact_ratio: float = 1.0):
+        """
+        Args:
+            path: 快照文件路径, 日志文件为同目录下的 "<name>.journal"
+            compact_min_size: 日志文件至少达到该大小 (字节) 后才会合并
+            compact_ratio: 日志文件大小超过快照大小的该倍数后进行合并
+        """
+        self._cache_file = Path(path)
+        self._journal_file = self._cache_file.with_name(self._cache_file.name + ".journal")
+        # 正在合并的旧日志, 快照写入完成后删除
+        self._old_journal_file = self._cache_file.with_name(self._cache_file.name + ".journal.old")
+        self._compact_min_size = compact_min_size
+        self._compact_ratio = compact_ratio
+        self._lock = threading.RLock()
         self._data = {}
+        self._expires: Dict[str, float] = {}
+        self._journal = None
+        self._journal_size = 0
+        self._snapshot_size = 0
+        self._compact_due = False
+        self._compacting = False
+        self._load()
+
+    def _load(self):
         if self._cache_file.exists():
             try:
                 with open(self._cache_file, "r", encoding="utf-8") as f:
                     self._data = json.load(f)
+                self._expires = self._data.pop(_EXPIRES_KEY, {})
+                self._snapshot_size = self._cache_file.stat().st_size
             except json.JSONDecodeError:
                 logger.warning("缓存文件损坏, 将使用全新缓存.")
+        replayed = self._replay()
+        if replayed:
+            logger.debug(f"已从缓存日志恢复 {replayed} 条写入记录.")
+            self.compact()
+        if not self._journal:
+            self._open_journal()
+
+    def _replay(self) -> int:
+        """依次重放旧日志与日志文件中的写入记录, 返回成功重放的记录数."""
+        count = 0
+        for journal in (self._old_journal_file, self._journal_file):
+            if not journal.exists():
+                continue
+            with open(journal, "r", encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        op, key, *value = json.loads(line)
+                    except (json.JSONDecodeError, ValueError):
+                        # 崩溃时写入一半的记录, 直接丢弃
+                        logger.debug("缓存日志中存在不完整的记录, 已忽略.")
+                        continue
+                    if op == "s":
+                        self._set(key, *value)
+                    elif op == "d":
+                        self._delete(key)
+                    count += 1
+        return count
+
+    def _open_journal(self):
+        self._journal = open(self._journal_file, "a", encoding="utf-8")
+        self._journal_size = self._journal.tell()
+
+    def _append(self, *records):
+        lines = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        self._journal.write(lines)
+        self._journal.flush()
+        self._journal_size += len(lines.encode("utf-8"))
+        if self._journal_size > max(self._compact_min_size, self._snapshot_size * self._compact_ratio):
+            # 由 _journaled 在释放锁后执行
+            self._compact_due = True
+
+    def _rotate_journal(self):
+        """将当前日志移为旧日志, 此后的写入记录在新的日志中."""
+        if self._journal:
+            self._journal.close()
+        if self._journal_file.exists():
+            if self._old_journal_file.exists():
+                # 上次合并未完成, 旧日志尚未写入快照, 追加到其后
+                with open(self._old_journal_file, "a", encoding="utf-8") as dst:
+                    with open(self._journal_file, "r", encoding="utf-8") as src:
+                        shutil.copyfileobj(src, dst)
+                os.remove(self._journal_file)
+            else:
+                os.replace(self._journal_file, self._old_journal_file)
+        self._open_journal()
+
+    def compact(self):
+        """将内存中的数据写入快照, 并清空日志文件."""
+        with self._lock:
+            if self._compacting:
+                return
+            self._compact_due = False
+            data = dict(self._data, **{_EXPIRES_KEY: self._expires}) if self._expires else self._data
+            text = json.dumps(data, ensure_ascii=False)
+            self._rotate_journal()
+            self._compacting = True
+        try:
+            tmp_file = self._cache_file.with_name(self._cache_file.name + ".tmp")
+            with open(tmp_file, "w", encoding="utf-8") as f:
+                f.write(text)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_file, self._cache_file)
+            # 快照已包含旧日志中的全部数据
+            if self._old_journal_file.exists():
+                os.remove(self._old_journal_file)
+            with self._lock:
+                self._snapshot_size = self._cache_file.stat().st_size
+        finally:
+            self._compacting = False
+
+    def _set(self, key: str, value: Any, expires: float = None):
+        parts = key.split(".")
+        current = self._data
+        for part in parts[:-1]:
+            current = current.setdefault(part, {})
+        current[parts[-1]] = value
+        if expires:
+            self._expires[key] = expires
+        else:
+            self._expires.pop(key, None)
+
+    def _expired(self, key: str) -> bool:
+        expires = self._expires.get(key, None)
+        return expires is not None and expires <= time.time()
 
+    @staticmethod
+    def _set_record(key: str, value: Any, expires: float = None) -> list:
+        return ["s", key, value, expires] if expires else ["s", key, value]
+
+    def _delete(self, key: str) -> bool:
+        self._expires.pop(key, None)
+        parts = key.split(".")
+        current = self._data
+        path = []
+
+        # 遍历路径, 检查每一层
+        for part in parts[:-1]:
+            if not isinstance(current, dict) or part not in current:
+                return False
+            current = current[part]
+            path.append((part, current))
+
+        # 检查并删除最后一个键
+        if isinstance(current, dict) and parts[-1] in current:
+            del current[parts[-1]]
+
+            # 清理空字典
+            parents = [self._data] + [c for _, c in path[:-1]]
+            for (part, child), parent in zip(reversed(path), reversed(parents)):
+                if not child:
+                    del parent[part]
+                else:
+                    break
+            return True
+        return False
+
+    @_synchronized
     def get(self, key: str, default: Any = None) -> Any:
-        if self._mongo_client:
-            result = self._collection.find_one({"_id": key})
-            return result["value"] if result else default
+        if self._expired(key):
+            return default
+        value = self._data
+        try:
+            for part in key.split("."):
+                value = value.get(part, {})
+            return default if value == {} else value
+        except (AttributeError, TypeError):
+            return default
+
+    @_synchronized
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values = {k: self.get(k, _MISSING) for k in keys}
+        return {k: v for k, v in values.items() if v is not _MISSING}
+
+    @_journaled
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        expires = _expires_at(ttl)
+        self._set(key, value, expires)
+        self._append(self._set_record(key, value, expires))
+
+    @_journaled
+    def delete(self, key: str) -> None:
+        if self._delete(key):
+            self._append(["d", key])
+
+    def _delete_many(self, keys: List[str]):
+        deleted = [k for k in keys if self._delete(k)]
+        # 只在有改动时写入一次文件
+        if deleted:
+            self._append(*(["d", k] for k in deleted))
+
+    @_journaled
+    def delete_many(self, keys: List[str]) -> None:
+        self._delete_many(keys)
+
+    @_journaled
+    def write_batch(self, sets: Dict[str, Any], deletes: List[str], expires: Dict[str, float] = None) -> None:
+        expires = expires or {}
+        for key, value in sets.items():
+            self._set(key, value, expires.get(key, None))
+        deleted = [k for k in deletes if self._delete(k)]
+        records = [self._set_record(k, v, expires.get(k, None)) for k, v in sets.items()]
+        records += [["d", k] for k in deleted]
+        if records:
+            self._append(*records)
+
+    @_synchronized
+    def find_by_prefix(self, prefix: str) -> List[str]:
+        def get_keys_with_prefix(d, current_path="", keys=None):
+            if keys is None:
+                keys = []
+            for k, v in d.items():
+                path = f"{current_path}.{k}" if current_path else k
+                if isinstance(v, dict):
+                    get_keys_with_prefix(v, path, keys)
+                else:
+                    if path.startswith(prefix) and not self._expired(path):
+                        keys.append(path)
+            return keys
+
+        return get_keys_with_prefix(self._data)
+
+    @_journaled
+    def expire(self) -> int:
+        """删除所有已过期的键, 返回删除的数量."""
+        now = time.time()
+        keys = [k for k, t in self._expires.items() if t <= now]
+        self._delete_many(keys)
+        return len(keys)
+
+    def size(self) -> int:
+        """快照和日志文件占用的字节数."""
+        files = (self._cache_file, self._journal_file, self._old_journal_file)
+        return sum(f.stat().st_size for f in files if f.exists())
+
+
+class SQLiteCacheBackend(_ThreadedAsyncMixin):
+    """基于 SQLite (WAL 模式) 的本地缓存, 每个键对应一行, 前缀查询使用主键范围扫描."""
+
+    # 空闲页占比超过该值时, 合并时整理数据库文件
+    VACUUM_RATIO = 0.25
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL) WITHOUT ROWID"
+        )
+        columns = [r[1] for r in self._conn.execute("PRAGMA table_info(cache)")]
+        if "expires" not in columns:
+            self._conn.execute("ALTER TABLE cache ADD COLUMN expires REAL")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_expires ON cache (expires) WHERE expires IS NOT NULL"
+        )
+
+    @staticmethod
+    def _prefix_range(prefix: str):
+        """将前缀转换为主键范围 [lower, upper)."""
+        return prefix, prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+    @_synchronized
+    def get(self, key: str, default: Any = None) -> Any:
+        row = self._conn.execute(
+            "SELECT value FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else default
+
+    @_synchronized
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        result = {}
+        keys = list(keys)
+        # 避免超出 SQLite 的参数数量限制
+        for i in range(0, len(keys), 500):
+            chunk = keys[i : i + 500]
+            rows = self._conn.execute(
+                f"SELECT key, value FROM cache WHERE key IN ({', '.join('?' * len(chunk))}) "
+                "AND (expires IS NULL OR expires > ?)",
+                (*chunk, time.time()),
+            )
+            result.update((k, json.loads(v)) for k, v in rows)
+        return result
+
+    @_synchronized
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), _expires_at(ttl)),
+        )
+
+    @_synchronized
+    def delete(self, key: str) -> None:
+        self._conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+
+    @_synchronized
+    def delete_many(self, keys: List[str]) -> None:
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", ((k,) for k in keys))
+
+    @_synchronized
+    def write_batch(self, sets: Dict[str, Any], deletes: List[str], expires: Dict[str, float] = None) -> None:
+        expires = expires or {}
+        with self._conn:
+            self._conn.execute("BEGIN")
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cache (key, value, expires) VALUES (?, ?, ?)",
+                ((k, json.dumps(v, ensure_ascii=False), expires.get(k, None)) for k, v in sets.items()),
+            )
+            self._conn.executemany("DELETE FROM cache WHERE key = ?", ((k,) for k in deletes))
+
+    @_synchronized
+    def find_by_prefix(self, prefix: str) -> List[str]:
+        if not prefix:
+            rows = self._conn.execute(
+                "SELECT key FROM cache WHERE expires IS NULL OR expires > ? ORDER BY key", (time.time(),)
+            )
         else:
-            value = self._data
-            try:
-                for part in key.split("."):
-                    value = value.get(part, {})
-                return default if value == {} else value
-            except (AttributeError, TypeError):
-                return default
-
-    def set(self, key: str, value: Any) -> None:
-        if self._mongo_client:
-            self._collection.update_one({"_id": key}, {"$set": {"value": value}}, upsert=True)
+            rows = self._conn.execute(
+                "SELECT key FROM cache WHERE key >= ? AND key < ? AND (expires IS NULL OR expires > ?) ORDER BY key",
+                (*self._prefix_range(prefix), time.time()),
+            )
+        return [r[0] for r in rows]
+
+    @_synchronized
+    def expire(self) -> int:
+        """删除所有已过期的键, 返回删除的数量."""
+        return self._conn.execute("DELETE FROM cache WHERE expires <= ?", (time.time(),)).rowcount
+
+    @_synchronized
+    def compact(self):
+        page_count = self._conn.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = self._conn.execute("PRAGMA freelist_count").fetchone()[0]
+        if page_count and freelist_count / page_count > self.VACUUM_RATIO:
+            self._conn.execute("VACUUM")
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    def size(self) -> int:
+        """数据库文件和 WAL 文件占用的字节数."""
+        files = (self._path, self._path.with_name(self._path.name + "-wal"))
+        return sum(f.stat().st_size for f in files if f.exists())
+
+
+class MongoCacheBackend:
+    """基于 MongoDB 的缓存, 每个键对应一个文档.
+
+    设置了 lru_ttl 或 watch 时, 读取优先使用进程内的 LRU 缓存, 本进程的写入会同时更新 LRU 缓存.
+    其他进程 (例如网页控制台与其启动的子进程) 同样会写入数据库, 因此未设置二者时不使用 LRU 缓存,
+    以免读取到其他进程写入前的旧值. 监听变更流可以使其他实例的写入及时失效.
+    """
+
+    # 由多个进程共同读写的键, 始终直接读写数据库
+    SHARED_KEYS = ("config",)
+
+    def __init__(self, url: str, lru_size: int = 4096, lru_ttl: float = None, watch: bool = False):
+        """
+        Args:
+            url: MongoDB 连接字符串
+            lru_size: LRU 缓存的最大键数量, 为 0 时不使用 LRU 缓存
+            lru_ttl: LRU 缓存中每个键的最长有效时间 (秒), 与 watch 均未设置时不使用 LRU 缓存
+            watch: 是否监听变更流, 需要 MongoDB 副本集
+        """
+        from pymongo import MongoClient
+
+        self._url = url
+        self._mongo_client = MongoClient(url)
+        self._db = self._mongo_client.embykeeper
+        self._collection = self._db.cache
+        self._async_collection = None
+        self._async_loop = None
+
+        # 由 MongoDB 定期删除过期文档
+        self._collection.create_index("expires_at", expireAfterSeconds=0)
+
+        self._lru = None
+        self._lru_lock = threading.Lock()
+        if lru_size and (lru_ttl or watch):
+            self._lru = TTLCache(lru_size, lru_ttl) if lru_ttl else LRUCache(lru_size)
+        self.hits = 0
+        self.misses = 0
+
+        if self._lru is not None and watch:
+            threading.Thread(target=self._watch, name="cache-watch", daemon=True).start()
+
+    def _watch(self):
+        from pymongo.errors import PyMongoError
+
+        try:
+            with self._collection.watch() as stream:
+                for change in stream:
+                    key = change.get("documentKey", {}).get("_id", None)
+                    with self._lru_lock:
+                        if key is None:
+                            self._lru.clear()
+                        else:
+                            self._lru.pop(key, None)
+        except PyMongoError as e:
+            logger.warning(f"无法监听 MongoDB 变更流, 将不再使用内存缓存: {e}")
+            self._lru = None
+
+    def _lru_get(self, key: str) -> Any:
+        lru = self._lru
+        if lru is None or key in self.SHARED_KEYS:
+            return _MISSING
+        with self._lru_lock:
+            value = lru.get(key, _MISSING)
+        if value is _MISSING:
+            self.misses += 1
         else:
-            parts = key.split(".")
-            current = self._data
-            for part in parts[:-1]:
-                current = current.setdefault(part, {})
-            current[parts[-1]] = value
-            with open(self._cache_file, "w", encoding="utf-8") as f:
-                json.dump(self._data, f, ensure_ascii=False)
+            self.hits += 1
+        return value
+
+    def _lru_put(self, key: str, value: Any, expires: float = None):
+        lru = self._lru
+        if lru is not None and key not in self.SHARED_KEYS:
+            with self._lru_lock:
+                if expires:
+                    # 设置了有效时间的键不放入内存缓存, 以免过期后仍被读取
+                    lru.pop(key, None)
+                else:
+                    lru[key] = value
+
+    @staticmethod
+    def _update(value: Any, expires: float = None) -> dict:
+        if expires:
+            return {"$set": {"value": value, "expires_at": datetime.fromtimestamp(expires, timezone.utc)}}
+        return {"$set": {"value": value}, "$unset": {"expires_at": ""}}
+
+    def _load(self, key: str, doc: dict) -> Any:
+        if not doc:
+            self._lru_put(key, _DELETED)
+            return _DELETED
+        expires_at: datetime = doc.get("expires_at", None)
+        if expires_at:
+            # TTL 索引的删除存在延迟, 读取时自行检查
+            expired = expires_at.replace(tzinfo=timezone.utc).timestamp() <= time.time()
+            return _DELETED if expired else doc["value"]
+        self._lru_put(key, doc["value"])
+        return doc["value"]
+
+    def _get_async_collection(self):
+        """获取绑定到当前事件循环的异步集合, 没有可用的异步驱动时返回 None."""
+        loop = asyncio.get_running_loop()
+        if self._async_loop is not loop:
+            try:
+                from pymongo import AsyncMongoClient
+            except ImportError:
+                try:
+                    from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+                except ImportError:
+                    AsyncMongoClient = None
+            self._async_collection = (
+                AsyncMongoClient(self._url).embykeeper.cache if AsyncMongoClient else None
+            )
+            self._async_loop = loop
+        return self._async_collection
+
+    @staticmethod
+    def _result(value: Any, default: Any) -> Any:
+        if value is _DELETED:
+            return default
+        return copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._lru_get(key)
+        if value is _MISSING:
+            value = self._load(key, self._collection.find_one({"_id": key}))
+        return self._result(value, default)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values = {k: self._lru_get(k) for k in keys}
+        missing = [k for k, v in values.items() if v is _MISSING]
+        if missing:
+            docs = {doc["_id"]: doc for doc in self._collection.find({"_id": {"$in": missing}})}
+            for key in missing:
+                values[key] = self._load(key, docs.get(key, None))
+        return {k: self._result(v, None) for k, v in values.items() if v is not _DELETED}
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        collection = self._get_async_collection()
+        if collection is None:
+            return await _to_thread(self.get, key, default)
+        value = self._lru_get(key)
+        if value is _MISSING:
+            value = self._load(key, await collection.find_one({"_id": key}))
+        return self._result(value, default)
+
+    async def aset(self, key: str, value: Any, ttl: float = None) -> None:
+        collection = self._get_async_collection()
+        if collection is None:
+            return await _to_thread(self.set, key, value, ttl)
+        expires = _expires_at(ttl)
+        await collection.update_one({"_id": key}, self._update(value, expires), upsert=True)
+        self._lru_put(key, copy.deepcopy(value), expires)
+
+    async def adelete(self, key: str) -> None:
+        collection = self._get_async_collection()
+        if collection is None:
+            return await _to_thread(self.delete, key)
+        await collection.delete_one({"_id": key})
+        self._lru_put(key, _DELETED)
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        expires = _expires_at(ttl)
+        self._collection.update_one({"_id": key}, self._update(value, expires), upsert=True)
+        self._lru_put(key, copy.deepcopy(value), expires)
 
     def delete(self, key: str) -> None:
-        if self._mongo_client:
-            self._collection.delete_one({"_id": key})
-        else:
-            parts = key.split(".")
-            current = self._data
-            path = []
-
-            # 遍历路径, 检查每一层
-            for part in parts[:-1]:
-                if not isinstance(current, dict) or part not in current:
-                    return
-                current = current[part]
-                path.append((part, current))
-
-            # 检查并删除最后一个键
-            if isinstance(current, dict) and parts[-1] in current:
-                del current[parts[-1]]
-
-                # 清理空字典
-                for part, parent in reversed(path):
-                    if isinstance(parent, dict) and part in parent and not parent[part]:
-                        del parent[part]
-                    else:
-                        break
-
-            with open(self._cache_file, "w", encoding="utf-8") as f:
-                json.dump(self._data, f, ensure_ascii=False, indent=2)
+        self._collection.delete_one({"_id": key})
+        self._lru_put(key, _DELETED)
+
+    def delete_many(self, keys: List[str]) -> None:
+        self._collection.delete_many({"_id": {"$in": keys}})
+        for key in keys:
+            self._lru_put(key, _DELETED)
+
+    def write_batch(self, sets: Dict[str, Any], deletes: List[str], expires: Dict[str, float] = None) -> None:
+        from pymongo import DeleteOne, UpdateOne
+
+        expires = expires or {}
+        ops = [
+            UpdateOne({"_id": k}, self._update(v, expires.get(k, None)), upsert=True) for k, v in sets.items()
+        ]
+        ops += [DeleteOne({"_id": k}) for k in deletes]
+        if ops:
+            self._collection.bulk_write(ops, ordered=False)
+        for key, value in sets.items():
+            self._lru_put(key, copy.deepcopy(value), expires.get(key, None))
+        for key in deletes:
+            self._lru_put(key, _DELETED)
 
     def find_by_prefix(self, prefix: str) -> List[str]:
-        if self._mongo_client:
-            return [
-                doc["_id"] for doc in self._collection.find({"_id": {"$regex": f"^{prefix}"}}, {"_id": 1})
-            ]
+        return [doc["_id"] for doc in self._collection.find({"_id": {"$regex": f"^{prefix}"}}, {"_id": 1})]
+
+    def expire(self) -> int:
+        # 过期文档由 TTL 索引删除
+        return 0
+
+    def compact(self):
+        pass
+
+    def size(self) -> int:
+        return 0
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._lru) if self._lru else 0}
+
+
+class WriteBehindBackend:
+    """写回缓冲, 合并短时间内对同一键的重复写入, 定时或达到数量阈值时批量写入底层存储.
+
+    批量写入失败时, 在事件循环中按指数退避定时重试; 不在事件循环中 (例如退出时) 则记录错误并丢弃该批写入.
+    缓冲的读写受 _lock 保护, 以便在线程池中读取 (如计划任务状态的预加载); 底层存储的读写在锁外进行.
+    """
+
+    # 批量写入失败后重试的最长间隔 (秒)
+    MAX_RETRY_DELAY = 300
+
+    def __init__(self, backend, interval: float = 5.0, max_pending: int = 500):
+        """
+        Args:
+            backend: 底层缓存存储
+            interval: 首次写入后等待多久 (秒) 进行批量写入
+            max_pending: 缓冲的键数量达到该值时立即写入
+        """
+        self._backend = backend
+        self._interval = interval
+        self._max_pending = max_pending
+        self._pending: Dict[str, Any] = {}
+        self._pending_expires: Dict[str, float] = {}
+        # 正在写入底层存储的一批写入, 写入完成前仍从此处读取
+        self._writing: Dict[str, Any] = {}
+        self._writing_expires: Dict[str, float] = {}
+        self._lock = threading.RLock()
+        # 同一时间只进行一次批量写入
+        self._flush_lock = threading.Lock()
+        self._timer: asyncio.TimerHandle = None
+        self._failures = 0
+        self.coalesced = 0
+
+    def _schedule(self):
+        if self._failures:
+            # 等待重试定时器
+            return
+        if len(self._pending) >= self._max_pending:
+            self.flush()
+            return
+        if self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                # 不在事件循环中, 无法延迟写入
+                self.flush()
+            else:
+                self._timer = loop.call_later(self._interval, self.flush)
+
+    @_synchronized
+    def _put(self, key: str, value: Any, expires: float = None):
+        if key in self._pending:
+            self.coalesced += 1
+        self._pending[key] = value
+        if expires:
+            self._pending_expires[key] = expires
+        else:
+            self._pending_expires.pop(key, None)
+
+    @_synchronized
+    def _get_pending(self, key: str) -> Any:
+        if key in self._pending:
+            value, expires = self._pending[key], self._pending_expires.get(key, None)
         else:
+            value, expires = self._writing.get(key, _MISSING), self._writing_expires.get(key, None)
+        if expires is not None and expires <= time.time():
+            return _DELETED
+        return value
 
-            def get_keys_with_prefix(d, current_path="", keys=None):
-                if keys is None:
-                    keys = []
-                for k, v in d.items():
-                    path = f"{current_path}.{k}" if current_path else k
-                    if isinstance(v, dict):
-                        get_keys_with_prefix(v, path, keys)
-                    else:
-                        if path.startswith(prefix):
-                            keys.append(path)
-                return keys
+    @_synchronized
+    def _pending_keys(self, prefix: str) -> List[str]:
+        return [k for k in (*self._pending, *self._writing) if k.startswith(prefix)]
 
-            return get_keys_with_prefix(self._data)
+    def flush(self) -> None:
+        """将缓冲中的全部写入提交到底层存储."""
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        with self._flush_lock:
+            self._flush()
 
-    def delete_by_prefix(self, prefix: str) -> None:
-        keys = self.find_by_prefix(prefix)
+    def _flush(self):
+        with self._lock:
+            if not self._pending:
+                return
+            batch, self._pending = self._pending, {}
+            expires, self._pending_expires = self._pending_expires, {}
+            self._writing, self._writing_expires = batch, expires
+        sets = {k: v for k, v in batch.items() if v is not _DELETED}
+        deletes = [k for k, v in batch.items() if v is _DELETED]
+        try:
+            self._backend.write_batch(sets, deletes, expires)
+        except Exception as e:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._failures = 0
+                logger.error(f"缓存批量写入失败, 已丢弃 {len(batch)} 项写入: {e}")
+                return
+            self._failures += 1
+            delay = min(self.MAX_RETRY_DELAY, self._interval * 2 ** (self._failures - 1))
+            logger.warning(f"缓存批量写入失败, 将在 {delay:.0f} 秒后重试: {e}")
+            # 保留失败的写入, 但不覆盖之后的新写入
+            with self._lock:
+                for key, value in batch.items():
+                    if key not in self._pending:
+                        self._put(key, value, expires.get(key, None))
+            self._timer = loop.call_later(delay, self.flush)
+        else:
+            self._failures = 0
+        finally:
+            with self._lock:
+                self._writing, self._writing_expires = {}, {}
+
+    def get(self, key: str, default: Any = None) -> Any:
+        value = self._get_pending(key)
+        if value is _DELETED:
+            return default
+        elif value is not _MISSING:
+            return value
+        return self._backend.get(key, default)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        values = {k: self._get_pending(k) for k in keys}
+        result = self._backend.get_many([k for k, v in values.items() if v is _MISSING])
+        result.update((k, v) for k, v in values.items() if v is not _MISSING and v is not _DELETED)
+        return result
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        value = self._get_pending(key)
+        if value is _DELETED:
+            return default
+        elif value is not _MISSING:
+            return value
+        return await self._backend.aget(key, default)
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        self._put(key, value, _expires_at(ttl))
+        self._schedule()
+
+    async def aset(self, key: str, value: Any, ttl: float = None) -> None:
+        self.set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self._put(key, _DELETED)
+        self._schedule()
+
+    async def adelete(self, key: str) -> None:
+        self.delete(key)
+
+    def delete_many(self, keys: List[str]) -> None:
         for key in keys:
-            self.delete(key)
+            self._put(key, _DELETED)
+        self._schedule()
+
+    def write_batch(self, sets: Dict[str, Any], deletes: List[str], expires: Dict[str, float] = None) -> None:
+        expires = expires or {}
+        for key, value in sets.items():
+            self._put(key, value, expires.get(key, None))
+        for key in deletes:
+            self._put(key, _DELETED)
+        self._schedule()
+
+    def find_by_prefix(self, prefix: str) -> List[str]:
+        keys = self._backend.find_by_prefix(prefix)
+        pending = {k: self._get_pending(k) for k in self._pending_keys(prefix)}
+        if not pending:
+            return keys
+        keys = [k for k in keys if k not in pending]
+        return keys + [k for k, v in pending.items() if v is not _DELETED]
+
+    def expire(self) -> int:
+        self.flush()
+        return self._backend.expire()
+
+    def compact(self):
+        self.flush()
+        self._backend.compact()
+
+    def size(self) -> int:
+        return self._backend.size()
+
+
+class Cache:
+    def __init__(self, backend=None):
+        if backend is None:
+            backend = self._create_backend()
+            if config.cache and config.cache.write_behind:
+                backend = WriteBehindBackend(
+                    backend,
+                    interval=config.cache.flush_interval,
+                    max_pending=config.cache.flush_size,
+                )
+                atexit.register(self.flush)
+            var.exit_handlers.append(self._exit_handler)
+        self._backend = backend
+        self._sweeper: asyncio.Task = None
+
+    @staticmethod
+    def _create_backend():
+        if hasattr(config, "mongodb") and config.mongodb:
+            try:
+                return MongoCacheBackend(
+                    config.mongodb,
+                    lru_size=config.cache.lru_size if config.cache else 4096,
+                    lru_ttl=config.cache.lru_ttl if config.cache else None,
+                    watch=config.cache.watch if config.cache else False,
+                )
+            except ImportError:
+                logger.warning("没有安装 pymongo 包, 将使用 JSON 存储缓存.")
+        elif config.cache and config.cache.backend == "sqlite":
+            return SQLiteCacheBackend(config.basedir / "cache.db")
+        return JSONCacheBackend(config.basedir / "cache.json")
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return self._backend.get(key, default)
+
+    def set(self, key: str, value: Any, ttl: float = None) -> None:
+        """写入缓存
+
+        Args:
+            key: 键
+            value: 值, 需要可以被序列化为 JSON
+            ttl: 有效时间 (秒), 为空时永不过期
+        """
+        self._backend.set(key, value, ttl)
+
+    def delete(self, key: str) -> None:
+        self._backend.delete(key)
+
+    def get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """批量读取多个键的缓存
+
+        Args:
+            keys: 要读取的键列表
+
+        Returns:
+            键到值的字典, 不包含不存在的键
+        """
+        return self._backend.get_many(keys)
+
+    def set_many(self, items: Dict[str, Any], ttl: float = None) -> None:
+        """批量写入多个键的缓存, 本地存储仅写入一次, MongoDB 使用一次批量写入
+
+        Args:
+            items: 键到值的字典
+            ttl: 有效时间 (秒), 为空时永不过期
+        """
+        if not items:
+            return
+        expires = _expires_at(ttl)
+        self._backend.write_batch(items, [], {k: expires for k in items} if expires else None)
+
+    async def aget(self, key: str, default: Any = None) -> Any:
+        """异步读取缓存, 不阻塞事件循环."""
+        return await self._backend.aget(key, default)
+
+    async def aset(self, key: str, value: Any, ttl: float = None) -> None:
+        """异步写入缓存, 不阻塞事件循环."""
+        await self._backend.aset(key, value, ttl)
+
+    async def adelete(self, key: str) -> None:
+        """异步删除缓存, 不阻塞事件循环."""
+        await self._backend.adelete(key)
+
+    def find_by_prefix(self, prefix: str) -> List[str]:
+        return self._backend.find_by_prefix(prefix)
+
+    def delete_by_prefix(self, prefix: str) -> None:
+        self.delete_many(self.find_by_prefix(prefix))
 
     def delete_many(self, keys: List[str]) -> None:
         """批量删除多个键的缓存
@@ -119,39 +920,72 @@ class Cache:
         Args:
             keys: 要删除的键列表
         """
-        if self._mongo_client:
-            self._collection.delete_many({"_id": {"$in": keys}})
-        else:
-            # 批量删除所有键, 只写入一次文件
-            changed = False
-            for key in keys:
-                parts = key.split(".")
-                current = self._data
-                path = []
-
-                # 遍历路径, 检查每一层
-                for part in parts[:-1]:
-                    if not isinstance(current, dict) or part not in current:
-                        break
-                    current = current[part]
-                    path.append((part, current))
-
-                # 检查并删除最后一个键
-                if isinstance(current, dict) and parts[-1] in current:
-                    del current[parts[-1]]
-                    changed = True
-
-                    # 清理空字典
-                    for part, parent in reversed(path):
-                        if isinstance(parent, dict) and part in parent and not parent[part]:
-                            del parent[part]
-                        else:
-                            break
+        self._backend.delete_many(keys)
+
+    def flush(self) -> None:
+        """提交写回缓冲中尚未写入的数据."""
+        if isinstance(self._backend, WriteBehindBackend):
+            self._backend.flush()
+
+    @property
+    def _storage(self):
+        """写回缓冲之下的实际存储."""
+        backend = self._backend
+        if isinstance(backend, WriteBehindBackend):
+            backend = backend._backend
+        return backend
+
+    def stats(self) -> Dict[str, int]:
+        """获取内存缓存的命中统计, 仅 MongoDB 存储可用."""
+        storage = self._storage
+        return storage.stats() if hasattr(storage, "stats") else {}
+
+    def compact(self) -> None:
+        """提交写回缓冲, 并合并本地缓存的写入日志到快照."""
+        self._backend.compact()
+
+    def _sweep_storage(self):
+        storage = self._storage
+        size = storage.size()
+        expired = storage.expire()
+        storage.compact()
+        return expired, size - storage.size()
+
+    async def sweep(self) -> int:
+        """删除过期的键并整理存储, 返回释放的字节数."""
+        self.flush()
+        expired, reclaimed = await _to_thread(self._sweep_storage)
+        reclaimed = max(reclaimed, 0)
+        logger.debug(f"缓存清理完成, 已删除 {expired} 个过期键, 释放 {reclaimed} 字节.")
+        return reclaimed
+
+    async def sweeper(self, interval: float = 3600):
+        """定期清理过期的键."""
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.warning(f"缓存清理失败: {e}")
+            await asyncio.sleep(interval)
+
+    def start_sweeper(self, interval: float = 3600) -> asyncio.Task:
+        """在后台定期清理过期的键, 退出时停止."""
+        if not self._sweeper or self._sweeper.done():
+            self._sweeper = asyncio.create_task(self.sweeper(interval))
+        return self._sweeper
+
+    async def stop_sweeper(self):
+        sweeper, self._sweeper = self._sweeper, None
+        if sweeper and not sweeper.done():
+            sweeper.cancel()
+            try:
+                await sweeper
+            except asyncio.CancelledError:
+                pass
 
-            # 只在有改动时写入一次文件
-            if changed:
-                with open(self._cache_file, "w", encoding="utf-8") as f:
-                    json.dump(self._data, f, ensure_ascii=False, indent=2)
+    async def _exit_handler(self):
+        await self.stop_sweeper()
+        self.compact()
 
 
 cache: Cache = CachedFuncProxy(lambda: Cache())
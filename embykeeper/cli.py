@@ -456,6 +456,8 @@ async def main(
 
         return await cleaner()
 
+    cache.start_sweeper(config.cache.sweep_interval)
+
     if follow:
         from .telegram.debug import follower
 
@@ -1,8 +1,17 @@
+import asyncio
+import hashlib
 import random
 import string
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlparse
+
 from loguru import logger
 
+from embykeeper.cache import cache
 from embykeeper.config import config
+from embykeeper.schema import ProxyConfig
+from embykeeper.utils import get_proxy_str
 
 logger = logger.bind(scheme="cfsolver")
 
@@ -39,3 +48,122 @@ async def get_cf_clearance(url: str, proxy: str = None):
                     wssocks.stop()
             else:
                 return None, None
+
+
+class ClearanceStore:
+    """Cloudflare 验证结果的共享存储.
+
+    结果按 主机 + 出口代理 + UA 区分并持久化到缓存中, 同一键的并发解析将被合并,
+    仍在使用的结果将在过期前主动刷新.
+    """
+
+    TTL = 3600
+    REFRESH_AHEAD = 300
+
+    def __init__(self, ttl: float = TTL, refresh_ahead: float = REFRESH_AHEAD):
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self._solving: Dict[str, asyncio.Future] = {}
+        self._refreshers: Dict[str, asyncio.TimerHandle] = {}
+        self._used: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def key(url, proxy: ProxyConfig = None, useragent: str = None):
+        host = urlparse(str(url)).hostname or str(url)
+        ident = f"{host}|{get_proxy_str(proxy) or 'direct'}|{useragent or '*'}"
+        return f"cloudflare.clearance.{hashlib.md5(ident.encode()).hexdigest()}"
+
+    async def get(self, url, proxy: ProxyConfig = None, useragent: str = None) -> Tuple[str, str]:
+        """读取已保存且未过期的验证结果, 不存在时返回 (None, None)."""
+        key = self.key(url, proxy, useragent)
+        entry = await cache.aget(key)
+        if not entry or entry.get("expires", 0) <= time.time():
+            return None, None
+        self._used[key] = time.time()
+        self._schedule_refresh(key, url, proxy, useragent, entry["expires"])
+        return entry["cf_clearance"], entry["useragent"]
+
+    async def solve(
+        self, url, proxy: ProxyConfig = None, useragent: str = None, force: bool = False
+    ) -> Tuple[str, str]:
+        """获取验证结果, 必要时请求解析; force 为 True 时忽略已保存的结果."""
+        key = self.key(url, proxy, useragent)
+        # 正在解析时已保存的结果可能已失效, 直接等待新的结果
+        if not force and key not in self._solving:
+            cf_clearance, ua = await self.get(url, proxy, useragent)
+            if cf_clearance:
+                return cf_clearance, ua
+        self._used[key] = time.time()
+        return await self._solve_shared(key, url, proxy, useragent)
+
+    async def invalidate(
+        self, url, proxy: ProxyConfig = None, useragent: str = None, cf_clearance: str = None
+    ) -> bool:
+        """删除已失效的验证结果.
+
+        指定 cf_clearance 时仅在已保存的结果与之相同时删除, 以免并发请求删除其他请求刚解析的新结果.
+        返回是否进行了删除.
+        """
+        key = self.key(url, proxy, useragent)
+        async with self._lock(key):
+            if key in self._solving:
+                return False
+            if cf_clearance:
+                entry = await cache.aget(key)
+                if not entry or entry.get("cf_clearance") != cf_clearance:
+                    return False
+            handle = self._refreshers.pop(key, None)
+            if handle:
+                handle.cancel()
+            await cache.adelete(key)
+            return True
+
+    def _lock(self, key: str) -> asyncio.Lock:
+        lock = self._locks.get(key, None)
+        if not lock:
+            lock = self._locks[key] = asyncio.Lock()
+        return lock
+
+    async def _solve_shared(self, key: str, url, proxy: ProxyConfig, useragent: str):
+        fut = self._solving.get(key)
+        if not fut:
+            fut = asyncio.ensure_future(self._solve(key, url, proxy, useragent))
+            self._solving[key] = fut
+            fut.add_done_callback(lambda _: self._solving.pop(key, None))
+        return await asyncio.shield(fut)
+
+    async def _solve(self, key: str, url, proxy: ProxyConfig, useragent: str):
+        cf_clearance, ua = await get_cf_clearance(url, proxy)
+        if not cf_clearance:
+            return None, None
+        expires = time.time() + self.ttl
+        entry = {"cf_clearance": cf_clearance, "useragent": ua, "expires": expires}
+        async with self._lock(key):
+            await cache.aset(key, entry, ttl=self.ttl)
+        self._schedule_refresh(key, url, proxy, useragent, expires)
+        return cf_clearance, ua
+
+    def _schedule_refresh(self, key: str, url, proxy: ProxyConfig, useragent: str, expires: float):
+        if key in self._refreshers:
+            return
+        delay = max(0, expires - self.refresh_ahead - time.time())
+        loop = asyncio.get_running_loop()
+        self._refreshers[key] = loop.call_later(
+            delay, lambda: asyncio.ensure_future(self._refresh(key, url, proxy, useragent))
+        )
+
+    async def _refresh(self, key: str, url, proxy: ProxyConfig, useragent: str):
+        self._refreshers.pop(key, None)
+        # 仅刷新上个有效期内被使用过的结果, 避免为闲置站点反复解析
+        if time.time() - self._used.get(key, 0) > self.ttl:
+            self._used.pop(key, None)
+            return
+        logger.debug(f"Cloudflare 验证结果即将过期, 正在主动刷新: {urlparse(str(url)).hostname}.")
+        try:
+            await self._solve_shared(key, url, proxy, useragent)
+        except Exception as e:
+            logger.debug(f"Cloudflare 验证结果主动刷新失败: {e.__class__.__name__}: {e}.")
+
+
+clearances = ClearanceStore()
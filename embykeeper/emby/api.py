@@ -1,19 +1,22 @@
 import asyncio
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import datetime, timezone
+from functools import partial
 import random
 from urllib.parse import quote
 import uuid
-from typing import Iterable, List, Union, Optional
+from typing import Dict, Iterable, List, Union, Optional
 import re
 
 from loguru import logger
 from curl_cffi.requests import AsyncSession, Response, RequestsError
 from pydantic import BaseModel, ValidationError
 
-from embykeeper import __version__
+from embykeeper import __version__, var
 from embykeeper.utils import get_proxy_str, show_exception, truncate_str
+from embykeeper.bandwidth import governor
 from embykeeper.cache import cache
+from embykeeper.cloudflare import clearances
 from embykeeper.schema import EmbyAccount
 from embykeeper.config import config
 
@@ -52,6 +55,154 @@ class EmbyEnv(BaseModel):
     useragent: str
 
 
+class EmbySessionPool:
+    """按 (服务器, 代理, 浏览器指纹, Cookies) 共享的 HTTP 会话池
+
+    访问同一服务器的所有 Emby 实例复用同一会话的连接 (支持时使用 HTTP/2), 以避免每次请求重新握手.
+    请求头由每次请求单独提供, 会话在程序退出时关闭.
+    """
+
+    # 每个会话同时进行的最大请求数
+    MAX_CLIENTS = 100
+    # 视频流请求会长时间占用连接, 使用单独的会话, 以免占满普通请求的名额
+    MAX_STREAM_CLIENTS = 1000
+    # 每个服务器同时进行的页面数据请求数, 由所有账户共享
+    MAX_PAGE_REQUESTS = 4
+
+    def __init__(self):
+        self._sessions = {}
+        self._limiters = {}
+        self._loop = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 会话绑定于事件循环, 事件循环变更时重新创建
+            self._sessions = {}
+            self._limiters = {}
+            self._loop = loop
+
+    def limiter(self, base_url: str) -> asyncio.Semaphore:
+        """获取限制对应服务器页面数据请求并发数的信号量."""
+        self._bind_loop()
+        limiter = self._limiters.get(base_url, None)
+        if not limiter:
+            limiter = self._limiters[base_url] = asyncio.Semaphore(self.MAX_PAGE_REQUESTS)
+        return limiter
+
+    def get(
+        self,
+        base_url: str,
+        proxy: str = None,
+        impersonate: str = "chrome",
+        cookies: dict = None,
+        stream: bool = False,
+    ):
+        self._bind_loop()
+        cookies = cookies or {}
+        key = (base_url, proxy, impersonate, tuple(sorted(cookies.items())), stream)
+        session = self._sessions.get(key, None)
+        if not session:
+            session = self._sessions[key] = AsyncSession(
+                verify=False,
+                cookies=cookies,
+                proxy=proxy,
+                timeout=10.0,
+                impersonate=impersonate,
+                allow_redirects=True,
+                default_headers=False,
+                max_clients=self.MAX_STREAM_CLIENTS if stream else self.MAX_CLIENTS,
+            )
+        return session
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        await asyncio.gather(*[s.close() for s in sessions.values()], return_exceptions=True)
+
+
+sessions = EmbySessionPool()
+var.exit_handlers.append(sessions.close)
+
+
+class PlaybackTicker:
+    """驱动所有播放会话进度上报的共享定时器.
+
+    各会话的上报时间对齐到 1 秒的时间槽, 并在允许的推迟范围内选择等待会话最少的时间槽, 以分散请求.
+    同一时间槽的会话由一次定时器唤醒统一放行, 同时进行的上报请求数受限.
+    """
+
+    # 时间槽长度 (秒)
+    SLOT = 1.0
+    # 上报最多推迟的时间槽数, 推迟不会累积到后续的上报
+    SPREAD = 2
+    # 同时进行的进度上报请求数
+    MAX_INFLIGHT = 32
+
+    def __init__(self):
+        self._slots: Dict[int, List[asyncio.Future]] = {}
+        self._handle: asyncio.TimerHandle = None
+        self._handle_slot: int = None
+        self._sem: asyncio.Semaphore = None
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._slots = {}
+            self._handle = None
+            self._handle_slot = None
+            self._sem = asyncio.Semaphore(self.MAX_INFLIGHT)
+            self._loop = loop
+        return loop
+
+    def __len__(self):
+        return sum(len(futs) for futs in self._slots.values())
+
+    def now(self) -> float:
+        return self._bind().time()
+
+    @property
+    def limiter(self) -> asyncio.Semaphore:
+        self._bind()
+        return self._sem
+
+    async def wait_until(self, when: float):
+        """等待到指定的事件循环时间之后的某个时间槽."""
+        loop = self._bind()
+        base = max(int(-(-when // self.SLOT)), int(loop.time() // self.SLOT) + 1)
+        slot = min(range(base, base + self.SPREAD + 1), key=lambda s: len(self._slots.get(s, ())))
+        fut = loop.create_future()
+        self._slots.setdefault(slot, []).append(fut)
+        self._rearm()
+        await fut
+
+    def _rearm(self):
+        if not self._slots:
+            return
+        slot = min(self._slots)
+        if self._handle and self._handle_slot <= slot:
+            return
+        if self._handle:
+            self._handle.cancel()
+        self._handle = self._loop.call_at(slot * self.SLOT, self._on_tick)
+        self._handle_slot = slot
+
+    def _on_tick(self):
+        due = max(self._handle_slot, int(self._loop.time() // self.SLOT))
+        self._handle = None
+        for slot in [s for s in self._slots if s <= due]:
+            for fut in self._slots.pop(slot):
+                if not fut.done():
+                    fut.set_result(None)
+        self._rearm()
+
+
+ticker = PlaybackTicker()
+
+
 @dataclass
 class PlaySessionResult:
     session_started: bool = False
@@ -68,6 +219,13 @@ class PlaySessionResult:
 class Emby:
     playing_count = 0
 
+    # 媒体库快照的有效期, 过期后重新完整加载首页
+    LIBRARY_TTL = 7 * 86400
+    # 媒体库快照保留的最多视频项目数
+    LIBRARY_LIMIT = 500
+    # 媒体库快照中保留的视频项目字段
+    LIBRARY_FIELDS = ("Id", "Name", "Type", "MediaType", "RunTimeTicks")
+
     def __init__(self, account: EmbyAccount):
         self.a = account
 
@@ -78,6 +236,8 @@ class Emby:
         self.run_id = str(uuid.uuid4()).upper()
         self.cf_clearance = None
         self.useragent = None
+        self._cf_loaded = False
+        self._cf_stored = False
         self.items = {}
 
         self.log = logger.bind(server=self.a.name or self.hostname, username=self.a.username)
@@ -242,20 +402,21 @@ class Emby:
             headers["X-Emby-Token"] = self.token
         return headers
 
-    def _get_session(self) -> AsyncSession:
+    @property
+    def base_url(self):
+        return f"{self.a.url.scheme}://{self.a.url.host}:{self.a.url.port}"
+
+    def _get_session(self, stream: bool = False) -> AsyncSession:
         cookies = {}
         if self.cf_clearance:
             cookies["cf_clearance"] = self.cf_clearance
 
-        return AsyncSession(
-            verify=False,
-            headers=self.build_headers(),
-            cookies=cookies,
+        return sessions.get(
+            self.base_url,
             proxy=get_proxy_str(self.proxy, curl=True),
-            timeout=10.0,
             impersonate="chrome",
-            allow_redirects=True,
-            default_headers=False,
+            cookies=cookies,
+            stream=stream,
         )
 
     async def _request(self, method: str, path: str, _login=False, **kw) -> Response:
@@ -263,32 +424,41 @@ class Emby:
         if path.startswith(("http://", "https://")):
             url = path
         else:
-            base_url = f"{self.a.url.scheme}://{self.a.url.host}:{self.a.url.port}"
-            url = f"{base_url}/{path.lstrip('/')}"
+            url = f"{self.base_url}/{path.lstrip('/')}"
 
+        if not self._cf_loaded:
+            await self.load_cf_clearance()
+
+        extra_headers = kw.pop("headers", None) or {}
         last_err = None
         for _ in range(3):
             try:
-                async with self._get_session() as session:
-                    resp: Response = await session.request(method, url, **kw)
-                    if resp.status_code == 401 and self.a.username and not _login:
-                        if not await self.login():
-                            raise EmbyLoginError("无法登陆到服务器")
-                        continue
-                    elif resp.status_code in (502, 503, 504):
-                        await asyncio.sleep(random.random() * 2 + 0.5)
-                        continue
-                    elif resp.status_code == 403 and (
-                        "cf-wrapper" in resp.text or "Just a moment" in resp.text
-                    ):
-                        if self.cf_clearance:
+                # 每次重试重新生成请求头, 以使用重新登录后的凭据
+                headers = self.build_headers()
+                headers.update(extra_headers)
+                session = self._get_session(stream=kw.get("stream", False))
+                resp: Response = await session.request(method, url, headers=headers, **kw)
+                if resp.status_code == 401 and self.a.username and not _login:
+                    if not await self.login():
+                        raise EmbyLoginError("无法登陆到服务器")
+                    continue
+                elif resp.status_code in (502, 503, 504):
+                    await asyncio.sleep(random.random() * 2 + 0.5)
+                    continue
+                elif resp.status_code == 403 and ("cf-wrapper" in resp.text or "Just a moment" in resp.text):
+                    if self.cf_clearance:
+                        if not self._cf_stored:
                             raise EmbyStatusError("访问失败: Cloudflare 验证码解析后依然有验证")
-                        await self.use_cfsolver()
-                        continue
-                    elif not resp.ok and not _login:
-                        raise EmbyStatusError(f"访问失败: 异常 HTTP 代码 {resp.status_code} (URL = {url})")
-                    else:
-                        return resp
+                        # 已保存的验证结果失效, 删除后重新解析
+                        await clearances.invalidate(self.a.url, self.proxy, cf_clearance=self.cf_clearance)
+                        self.cf_clearance = None
+                        self._cf_stored = False
+                    await self.use_cfsolver()
+                    continue
+                elif not resp.ok and not _login:
+                    raise EmbyStatusError(f"访问失败: 异常 HTTP 代码 {resp.status_code} (URL = {url})")
+                else:
+                    return resp
             except RequestsError as e:
                 last_err = e
                 await asyncio.sleep(random.random() + 0.5)
@@ -299,9 +469,22 @@ class Emby:
         else:
             raise EmbyConnectError(f'连接到 "{url}" 重试超限')
 
-    async def use_cfsolver(self):
-        from embykeeper.cloudflare import get_cf_clearance
+    async def load_cf_clearance(self):
+        """读取其他实例或账户已为该站点保存的 Cloudflare 验证结果."""
+        self._cf_loaded = True
+        try:
+            cf_clearance, useragent = await clearances.get(self.a.url, self.proxy)
+        except Exception as e:
+            self.log.debug(f"读取已保存的 Cloudflare 验证结果失败: {e.__class__.__name__}: {e}.")
+            return False
+        if not cf_clearance:
+            return False
+        self.cf_clearance = cf_clearance
+        self.useragent = useragent
+        self._cf_stored = True
+        return True
 
+    async def use_cfsolver(self):
         if not self.a.cf_challenge:
             if self.proxy:
                 self.log.warning(
@@ -326,7 +509,7 @@ class Emby:
                     '"use_proxy = false" 以禁用该站点的代理.'
                 )
         try:
-            cf_clearance, useragent = await get_cf_clearance(self.a.url, self.proxy)
+            cf_clearance, useragent = await clearances.solve(self.a.url, self.proxy)
             if not cf_clearance:
                 self.log.warning(f"Cloudflare 验证码解析失败.")
                 return False
@@ -374,7 +557,7 @@ class Emby:
                 "token": self.token,
                 "userid": self.user_id,
             }
-            cache.set(f"emby.credential.{self.hostname}.{self.a.username}", cache_data)
+            await cache.aset(f"emby.credential.{self.hostname}.{self.a.username}", cache_data)
             return self.token
 
     async def play(self, item: Union[dict, int], time: float = 10, total_ticks: Optional[int] = None):
@@ -607,38 +790,41 @@ class Emby:
             url = direct_stream_url or f"/Videos/{iid}/stream"
             length = 0
             last_err_time = datetime.now()
-            while True:
-                resp = await self._request(
-                    method="GET",
-                    path=url,
-                    stream=True,
-                    max_recv_speed=1024,
-                    timeout=None,
-                    headers={
-                        "Range": f"bytes={length}-",
-                        "User-Agent": "VLC/3.0.21 LibVLC/3.0.21",
-                        "X-Playback-Session-Id": play_session_id,
-                    },
-                )
-                if not stream_started:
-                    stream_started = True
-                    self.log.debug(f'已开始请求视频流: "{truncate_str(iname, 10)}".')
-                try:
-                    async for i in resp.aiter_content(chunk_size=1024):
-                        length += len(i)
-                        del i
-                        await asyncio.sleep(random.random())
-                        if random.random() < 0.01:
+            async with governor.open(
+                truncate_str(iname, 10), self.base_url, get_proxy_str(self.proxy)
+            ) as flow:
+                while True:
+                    resp = await self._request(
+                        method="GET",
+                        path=url,
+                        stream=True,
+                        max_recv_speed=flow.recv_speed,
+                        timeout=None,
+                        headers={
+                            "Range": f"bytes={length}-",
+                            "User-Agent": "VLC/3.0.21 LibVLC/3.0.21",
+                            "X-Playback-Session-Id": play_session_id,
+                        },
+                    )
+                    if not stream_started:
+                        stream_started = True
+                        self.log.debug(f'已开始请求视频流: "{truncate_str(iname, 10)}".')
+                    try:
+                        async for i in resp.aiter_content():
+                            length += len(i)
+                            await flow.consume(len(i))
+                    except RequestsError:
+                        if (datetime.now() - last_err_time).total_seconds() > 5:
+                            self.log.debug("流媒体文件访问错误, 正在重试.")
+                            last_err_time = datetime.now()
                             continue
-                except RequestsError:
-                    if (datetime.now() - last_err_time).total_seconds() > 5:
-                        self.log.debug("流媒体文件访问错误, 正在重试.")
-                        last_err_time = datetime.now()
-                        continue
-                    else:
-                        raise
-                finally:
-                    await resp.aclose()
+                        else:
+                            raise
+                    finally:
+                        # 通知底层连接中止传输, 否则关闭时将等待整个视频流传输完成
+                        if resp.quit_now:
+                            resp.quit_now.set()
+                        await resp.aclose()
 
         stream_task = asyncio.create_task(stream())
         rt = random.uniform(5, 10)
@@ -670,6 +856,7 @@ class Emby:
             report_interval = 5  # Start with 5 seconds
             report_count = 0
             max_interval = 300  # 5 minutes in seconds
+            next_report = ticker.now()
             while t > 0:
                 if progress_errors > 12:
                     raise EmbyPlayError("播放状态设定错误次数过多")
@@ -682,19 +869,22 @@ class Emby:
                         report_count = 0
                         report_interval = min(report_interval * 2, max_interval)
                 st = min(10, t)
-                await asyncio.sleep(st)
+                # 由共享定时器统一唤醒, 按原有节奏计算下一次上报时间, 不累积时间槽的推迟
+                next_report += st
+                await ticker.wait_until(next_report)
                 t -= st
                 tick = int((time - t) * 10000000)
                 payload = get_playing_data(tick, update=True)
                 try:
-                    resp = await asyncio.wait_for(
-                        self._request(
-                            method="POST",
-                            path="/Sessions/Playing/Progress",
-                            json=payload,
-                        ),
-                        10,
-                    )
+                    async with ticker.limiter:
+                        resp = await asyncio.wait_for(
+                            self._request(
+                                method="POST",
+                                path="/Sessions/Playing/Progress",
+                                json=payload,
+                            ),
+                            10,
+                        )
                     progress_updates += 1
                     last_position_tick = payload["PositionTicks"]
                     if progress_updates == 1 or progress_updates % 5 == 0:
@@ -743,6 +933,116 @@ class Emby:
         except Exception as e:
             raise EmbyPlayError(f"由于连接错误或服务器错误无法停止播放: {e}")
 
+    def _spawn_staggered(self, factories, gap=(0.1, 0.3)) -> List[asyncio.Task]:
+        """按客户端的顺序错开发起请求并并发执行, 同一服务器的并发数受限."""
+        limiter = sessions.limiter(self.base_url)
+
+        async def run(delay, factory):
+            await asyncio.sleep(delay)
+            async with limiter:
+                return await factory()
+
+        tasks = []
+        delay = 0
+        for factory in factories:
+            tasks.append(asyncio.create_task(run(delay, factory)))
+            delay += random.uniform(*gap)
+        return tasks
+
+    @classmethod
+    def project_item(cls, item: dict) -> dict:
+        """仅保留播放所需的视频项目字段, 以减少内存与快照占用."""
+        slim = {k: item[k] for k in cls.LIBRARY_FIELDS if item.get(k, None) is not None}
+        source_ids = [s["Id"] for s in item.get("MediaSources", None) or [] if s.get("Id", None)]
+        if source_ids:
+            slim["MediaSourceIds"] = source_ids
+        return slim
+
+    def _add_items(self, items: List[dict]):
+        for item in items:
+            try:
+                iid = item["Id"]
+                self.items[iid] = self.project_item(item)
+            except KeyError:
+                pass
+
+    @property
+    def library_key(self):
+        return f"emby.library.{self.hostname}.{self.a.username}"
+
+    async def load_library(self):
+        """获取可播放的视频项目, 优先使用缓存的媒体库快照并增量更新, 快照过期时重新加载首页."""
+        snapshot: dict = await cache.aget(self.library_key, None)
+        now = datetime.now().timestamp()
+        if snapshot and snapshot.get("items", None) and now - snapshot.get("updated", 0) < self.LIBRARY_TTL:
+            try:
+                if await self._refresh_library(snapshot):
+                    return
+            except EmbyError as e:
+                self.log.debug(f"媒体库快照增量更新失败, 将重新加载首页: {e}.")
+        self.items = {}
+        await self.load_main_page()
+        if not self.items:
+            return
+        try:
+            count = await self.get_library_count()
+        except EmbyError as e:
+            self.log.debug(f"获取媒体库项目数失败, 将不保存快照: {e}.")
+            return
+        await self._save_library(count, now)
+
+    async def _refresh_library(self, snapshot: dict) -> bool:
+        count = await self.get_library_count()
+        last_count = snapshot.get("count", 0)
+        if count < last_count:
+            self.log.debug(f"媒体库项目减少 ({last_count} -> {count}), 将重新加载首页.")
+            return False
+        self.items = dict(snapshot["items"])
+        now = datetime.now().timestamp()
+        if count > last_count:
+            since = datetime.fromtimestamp(snapshot["updated"], tz=timezone.utc)
+            self._add_items(await self.get_library_changes(since))
+            self.log.debug(f"媒体库快照增量更新: 新增 {count - last_count} 个项目.")
+        await self._save_library(count, now)
+        return True
+
+    async def _save_library(self, count: int, updated: float):
+        items = list(self.items.items())[-self.LIBRARY_LIMIT :]
+        self.items = dict(items)
+        snapshot = {"updated": updated, "count": count, "items": self.items}
+        await cache.aset(self.library_key, snapshot, ttl=self.LIBRARY_TTL)
+
+    async def get_library_count(self) -> int:
+        """获取媒体库中影片与剧集的总数, 仅返回计数."""
+        resp = await self._request(
+            method="GET",
+            path=f"/Users/{self.user_id}/Items",
+            params={
+                "IncludeItemTypes": "Movie,Episode",
+                "Recursive": "true",
+                "Limit": 0,
+                "EnableTotalRecordCount": "true",
+            },
+        )
+        return resp.json().get("TotalRecordCount", 0)
+
+    async def get_library_changes(self, since: datetime, limit=100) -> List[dict]:
+        """获取指定时间后新增或变更的影片与剧集."""
+        resp = await self._request(
+            method="GET",
+            path=f"/Users/{self.user_id}/Items",
+            params={
+                "IncludeItemTypes": "Movie,Episode",
+                "Recursive": "true",
+                "MinDateLastSaved": since.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                "Fields": "MediaSources",
+                "SortBy": "DateCreated",
+                "SortOrder": "Descending",
+                "Limit": limit,
+            },
+        )
+        return resp.json().get("Items", [])
+
     async def load_main_page(self):
         views = await self._request(
             method="GET",
@@ -756,48 +1056,42 @@ class Emby:
             type: str = i.get("CollectionType")
             if cid and type and type.lower() in ("movies", "tvshows"):
                 col_ids.append(cid)
-        await asyncio.sleep(random.uniform(0.1, 0.3))
 
-        user = await self._request(method="GET", path=f"/Users/{self.user_id}")
+        # 首页其余请求仅依赖于 Views, 按客户端顺序错开发起后并发等待
+        factories = [
+            lambda: self._request(method="GET", path=f"/Users/{self.user_id}"),
+            lambda: self._request(
+                method="GET",
+                path=f"/DisplayPreferences/usersettings",
+                params=dict(client="emby", userId=self.user_id),
+            ),
+            lambda: self.get_resume_items(media_types=["Video"]),
+            lambda: self.get_resume_items(media_types=["Audio"]),
+        ]
+        factories += [partial(self.get_latest_items, parent_id=cid) for cid in col_ids[:25]]
+        tasks = self._spawn_staggered(factories)
+        try:
+            user, _, _, _, *latest = await asyncio.gather(*tasks)
+        finally:
+            for t in tasks:
+                t.cancel()
         last_login_date = user.json().get("LastLoginDate", None)
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-
-        await self._request(
-            method="GET",
-            path=f"/DisplayPreferences/usersettings",
-            params=dict(client="emby", userId=self.user_id),
-        )
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-
-        await self.get_resume_items(media_types=["Video"])
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-        await self.get_resume_items(media_types=["Audio"])
-        await asyncio.sleep(random.uniform(0.1, 0.3))
-
-        for cid in col_ids[:25]:
-            items = await self.get_latest_items(parent_id=cid)
-            for item in items:
-                try:
-                    iid = item["Id"]
-                    self.items[iid] = item
-                except KeyError:
-                    pass
+        for items in latest:
+            self._add_items(items)
 
         if not self.items:
             if col_ids:
                 self.log.info("无法获取最新视频, 尝试从文件夹中读取.")
-
-                for col_id in col_ids[:3]:
-                    await asyncio.sleep(4)
-                    items = await self.get_folder_items(parent_id=col_id)
-                    for item in items:
-                        try:
-                            iid = item["Id"]
-                            self.items[iid] = item
-                        except KeyError:
-                            pass
-                    if len(self.items) >= 3:
-                        break
+                factories = [partial(self.get_folder_items, parent_id=cid) for cid in col_ids[:3]]
+                tasks = self._spawn_staggered(factories, gap=(1, 2))
+                try:
+                    for fut in asyncio.as_completed(tasks):
+                        self._add_items(await fut)
+                        if len(self.items) >= 3:
+                            break
+                finally:
+                    for t in tasks:
+                        t.cancel()
 
         return last_login_date
 
@@ -894,6 +1188,11 @@ class Emby:
         )
         return resp.json().get("Items", [])
 
+    async def get_public_info(self) -> dict:
+        """Get public server information, no authentication required."""
+        resp = await self._request("GET", "/System/Info/Public", _login=True)
+        return resp.json() if resp.ok else {}
+
     async def get_item(self, iid, **kw) -> dict:
         resp = await self._request(method="GET", path=f"/Users/{self.user_id}/Items/{iid}")
         return resp.json()
@@ -20,6 +20,46 @@ from .api import Emby, EmbyPlayError, EmbyConnectError, EmbyRequestError, EmbyEr
 logger = logger.bind(scheme="embywatcher")
 
 
+class EmbyServerGroup:
+    """同一服务器上的账户组.
+
+    会话与 Cloudflare 验证已按服务器在客户端间共享 (媒体库快照因用户权限不同仍按用户保存);
+    组内账户另外共享一次服务器信息探测, 由首个账户完成探测 (包括可能的验证码解析),
+    其余账户在此之后开始请求, 并受单服务器并发数限制.
+    """
+
+    def __init__(self, host: str, concurrency: Optional[int] = None):
+        self.host = host
+        self.accounts: List[EmbyAccount] = []
+        self.sem = asyncio.Semaphore(concurrency or 100000)
+        self._probe: Optional[asyncio.Future] = None
+
+    async def probe(self, emby: Emby) -> Optional[dict]:
+        if not self._probe:
+            self._probe = asyncio.ensure_future(self._do_probe(emby))
+        return await asyncio.shield(self._probe)
+
+    async def _do_probe(self, emby: Emby):
+        try:
+            info = await emby.get_public_info()
+        except Exception as e:
+            emby.log.debug(f"探测服务器信息失败: {e.__class__.__name__}: {e}.")
+            return None
+        if info:
+            emby.log.debug(
+                f'服务器 "{info.get("ServerName", self.host)}" 版本: {info.get("Version", "未知")}.'
+            )
+        return info
+
+    @staticmethod
+    def interleave(groups: List["EmbyServerGroup"]):
+        """轮流从各服务器组中取出账户, 以使全局并发名额在服务器间均匀分配."""
+        for i in range(max((len(g.accounts) for g in groups), default=0)):
+            for g in groups:
+                if i < len(g.accounts):
+                    yield g, g.accounts[i]
+
+
 class EmbyManager:
     def __init__(self):
         self._tasks: Dict[str, asyncio.Task] = {}  # account_spec -> task
@@ -65,7 +105,7 @@ class EmbyManager:
     def stop_account(self, account_spec: str):
         """Stop scheduling and running tasks for an independent account"""
         if account_spec in self._schedulers:
-            del self._schedulers[account_spec]
+            self._schedulers.pop(account_spec).cancel()
 
         if account_spec in self._tasks:
             self._tasks[account_spec].cancel()
@@ -76,7 +116,7 @@ class EmbyManager:
     def stop_unified_accounts(self):
         """Stop the unified scheduling task"""
         if "unified" in self._schedulers:
-            del self._schedulers["unified"]
+            self._schedulers.pop("unified").cancel()
 
         if "unified" in self._tasks:
             self._tasks["unified"].cancel()
@@ -109,6 +149,7 @@ class EmbyManager:
             on_next_time=make_on_next_time(account_spec),
             sid=f"emby.watch.{account_spec}",
             description=f"Emby 保活任务 - {account_spec}",
+            group="proxy" if config.proxy and account.use_proxy else None,
         )
         self._schedulers[account_spec] = scheduler
         return scheduler
@@ -137,6 +178,8 @@ class EmbyManager:
             on_next_time=on_next_time,
             sid="emby.watch.global",
             description="Emby 保活任务",
+            weight=min(len(unified_accounts), config.emby.concurrency or len(unified_accounts)),
+            group="proxy" if config.proxy and any(a.use_proxy for a in unified_accounts) else None,
         )
         self._schedulers["unified"] = scheduler
         self._pool.add(scheduler.schedule())
@@ -240,8 +283,9 @@ class EmbyManager:
         ctx = RunContext.prepare(description="使用全局设置的 Emby 统一保活")
         ctx.start(RunStatus.INITIALIZING)
 
-        async def watch_wrapper(account: EmbyAccount, sem):
-            async with sem:
+        async def watch_wrapper(account: EmbyAccount, group: EmbyServerGroup):
+            # 先获取单服务器名额, 避免等待中的账户占用全局名额
+            async with group.sem, sem:
                 try:
                     emby = Emby(account)
                 except Exception as e:
@@ -253,13 +297,14 @@ class EmbyManager:
                     emby.log.info(f"播放视频前随机等待 {wait:.0f} 秒.")
                     await asyncio.sleep(wait)
                 try:
+                    await group.probe(emby)
                     if not account.play_id:
                         emby.log.info(f"正在登陆并获取首页视频项目.")
                         if not emby.user_id:
                             if not await emby.login():
                                 emby.log.warning(f"保活失败: 无法登陆.")
                                 return account, False
-                        await emby.load_main_page()
+                        await emby.load_library()
                         if not emby.items:
                             emby.log.warning("保活失败: 无法获取首页中的视频项目")
                             return account, False
@@ -289,9 +334,17 @@ class EmbyManager:
                     show_exception(e, regular=False)
                     return account, False
 
+        groups: Dict[str, EmbyServerGroup] = {}
         for account in accounts:
             if account.enabled:
-                tasks.append(watch_wrapper(account, sem))
+                host = account.url.host
+                if host not in groups:
+                    groups[host] = EmbyServerGroup(host, config.emby.server_concurrency)
+                groups[host].accounts.append(account)
+        if len(groups) > 1:
+            logger.debug(f"共 {len(groups)} 个 Emby 服务器参与保活.")
+        for group, account in EmbyServerGroup.interleave(list(groups.values())):
+            tasks.append(watch_wrapper(account, group))
 
         failed_accounts = []
         successful_accounts = []
@@ -2,23 +2,89 @@ from __future__ import annotations
 
 from asyncio import Event
 import asyncio
+from collections import deque
 from datetime import datetime
 from enum import IntEnum, auto
-from typing import TYPE_CHECKING, Callable, Dict, List
+import gzip
+import heapq
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, Iterator, List, Optional, Set
 import random
 import string
 from loguru import logger
 
 from rich.text import Text
-from pydantic import BaseModel, PrivateAttr
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr, field_serializer, field_validator
 
+from . import var
 from .utils import to_iterable
 from .cache import cache
+from .config import config
 
 if TYPE_CHECKING:
     from loguru import Logger
 
 _running_runs: Dict[str, RunContext] = {}
+_saving_runs: Dict[str, RunContext] = {}
+_save_tasks: Set[asyncio.Task] = set()
+_log_sink_id: int = None
+
+
+def _log_sink(message):
+    """所有任务共用的日志处理器, 按 run_id 将日志记录到对应的运行中任务"""
+    record = message.record
+    run = _running_runs.get(record["extra"]["run_id"], None)
+    if run:
+        run.log.append(
+            LogRecord(
+                level=record["level"].name.upper(),
+                message=record["message"],
+                time=record["time"],
+            )
+        )
+
+
+def _ensure_log_sink():
+    global _log_sink_id
+    if _log_sink_id is None:
+        _log_sink_id = logger.add(_log_sink, filter=lambda record: "run_id" in record["extra"])
+        _purge_log_files()
+
+
+def _retention() -> float:
+    """任务运行信息在缓存中的保留时间 (秒)"""
+    try:
+        days = config.cache.runinfo_retention
+    except RuntimeError:
+        days = 7
+    return days * 86400
+
+
+def _log_dir() -> Path:
+    """溢出的任务日志的存放目录"""
+    try:
+        basedir = config.basedir
+    except RuntimeError:
+        basedir = Path(tempfile.gettempdir()) / "embykeeper"
+    return basedir / "runlogs"
+
+
+def _purge_log_files():
+    """删除超过保留时间的溢出日志文件"""
+    log_dir = _log_dir()
+    if not log_dir.is_dir():
+        return
+    deadline = time.time() - _retention()
+    for f in log_dir.glob("*.jsonl.gz"):
+        try:
+            if f.stat().st_mtime < deadline:
+                f.unlink()
+        except OSError:
+            pass
 
 
 class RunStatus(IntEnum):
@@ -36,29 +102,123 @@ class RunStatus(IntEnum):
     RESCHEDULE = auto()
 
 
-class LogRecord(BaseModel):
-    level: str
-    message: str
-    time: datetime
+class LogRecord:
+    """单条任务日志"""
+
+    __slots__ = ("level", "message", "time")
+
+    def __init__(self, level: str, message: str, time: datetime):
+        self.level = level
+        self.message = message
+        self.time = time
+
+    def to_list(self) -> list:
+        return [self.level, self.message, self.time.isoformat()]
+
+    @classmethod
+    def from_list(cls, data: list) -> LogRecord:
+        level, message, time = data
+        return cls(level, message, datetime.fromisoformat(time))
+
+
+class RunLog:
+    """固定容量的任务日志环形缓冲
+
+    缓冲已满时, 较早的一半日志以 gzip 压缩的 JSONL 追加写入到该任务的日志文件中.
+    迭代时先读取日志文件, 再读取缓冲中的日志.
+    """
+
+    CAPACITY = 200
+
+    def __init__(self, records: Iterable[LogRecord] = (), file: str = None, spilled: int = 0):
+        self._buffer = deque(records)
+        self._file = Path(file) if file else None
+        self._spilled = spilled
+
+    def append(self, record: LogRecord):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.CAPACITY:
+            self._spill(self.CAPACITY // 2)
+
+    def _spill(self, count: int):
+        records = [self._buffer.popleft() for _ in range(count)]
+        if not self._file:
+            log_dir = _log_dir()
+            log_dir.mkdir(parents=True, exist_ok=True)
+            fd, file = tempfile.mkstemp(suffix=".jsonl.gz", dir=log_dir)
+            os.close(fd)
+            self._file = Path(file)
+        try:
+            # 每次写入一个 gzip 成员, 读取时会自动拼接
+            with gzip.open(self._file, "at", encoding="utf-8") as f:
+                f.writelines(json.dumps(r.to_list(), ensure_ascii=False) + "\n" for r in records)
+        except OSError as e:
+            logger.debug(f"写入任务日志文件失败, 较早的日志将被丢弃: {e}")
+        self._spilled += count
+
+    def _read_file(self) -> Iterator[LogRecord]:
+        if not self._file:
+            return
+        try:
+            with gzip.open(self._file, "rt", encoding="utf-8") as f:
+                for line in f:
+                    yield LogRecord.from_list(json.loads(line))
+        except (OSError, EOFError, ValueError):
+            return
+
+    def __iter__(self) -> Iterator[LogRecord]:
+        yield from self._read_file()
+        yield from list(self._buffer)
+
+    def __len__(self):
+        return self._spilled + len(self._buffer)
+
+    def dump(self) -> dict:
+        return {
+            "records": [r.to_list() for r in self._buffer],
+            "file": str(self._file) if self._file else None,
+            "spilled": self._spilled,
+        }
+
+    @classmethod
+    def load(cls, data) -> RunLog:
+        if isinstance(data, list):
+            # 旧版本缓存中的日志列表
+            return cls(LogRecord(r["level"], r["message"], datetime.fromisoformat(r["time"])) for r in data)
+        return cls(
+            (LogRecord.from_list(r) for r in data.get("records", [])),
+            file=data.get("file", None),
+            spilled=data.get("spilled", 0),
+        )
 
 
 class RunContext(BaseModel):
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
     _finished: Event = PrivateAttr(default_factory=Event)
     _started: Event = PrivateAttr(default_factory=Event)
     _cancel: Callable = PrivateAttr(default=None)
-    _handler_id: int = PrivateAttr(default=None)
 
     id: str
     parent_ids: List[str] = []
-    description: str = None
+    description: Optional[str] = None
     status: RunStatus = RunStatus.PENDING
-    status_info: str = None
-    log: List[LogRecord] = []
-    duration: float = None
-    start_time: datetime = None
-    end_time: datetime = None
-    next_time: datetime = None
-    reschedule: int = None
+    status_info: Optional[str] = None
+    log: RunLog = Field(default_factory=RunLog)
+    duration: Optional[float] = None
+    start_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    next_time: Optional[datetime] = None
+    reschedule: Optional[int] = None
+
+    @field_serializer("log")
+    def _dump_log(self, log: RunLog):
+        return log.dump()
+
+    @field_validator("log", mode="before")
+    @classmethod
+    def _load_log(cls, value):
+        return value if isinstance(value, RunLog) else RunLog.load(value)
 
     def start(self, status: RunStatus = RunStatus.RUNNING):
         """开始任务, 设置开始时间和状态"""
@@ -72,7 +232,11 @@ class RunContext(BaseModel):
         if status:
             self.status = status
             self.log.append(
-                LogRecord(level="DEBUG", message=f"任务状态已设置为 {status.name}", time=datetime.now())
+                LogRecord(
+                    level="DEBUG",
+                    message=f"任务状态已设置为 {status.name}",
+                    time=datetime.now().astimezone(),
+                )
             )
 
     def finish(self, status: RunStatus = None, status_info: str = None):
@@ -95,21 +259,38 @@ class RunContext(BaseModel):
         # 设置完成事件
         self._finished.set()
 
-        # 移除logger handler
-        if self._handler_id is not None:
-            try:
-                logger.remove(self._handler_id)
-            except ValueError:
-                pass
-
         # 保存到缓存
         self.save()
 
         return self
 
     def save(self):
-        """保存当前任务到缓存"""
-        cache.set(f"runinfo.{self.id}", self.model_dump_json())
+        """保存当前任务到缓存, 在事件循环中时异步写入"""
+        data = self.model_dump_json()
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            cache.set(f"runinfo.{self.id}", data, ttl=_retention())
+            return
+        _saving_runs[self.id] = self
+        task = asyncio.create_task(self._asave(data))
+        _save_tasks.add(task)
+        task.add_done_callback(_save_tasks.discard)
+
+    async def _asave(self, data: str):
+        try:
+            await cache.aset(f"runinfo.{self.id}", data, ttl=_retention())
+        except Exception as e:
+            logger.warning(f"保存任务运行信息失败: {e}")
+        finally:
+            if _saving_runs.get(self.id) is self:
+                del _saving_runs[self.id]
+
+    @staticmethod
+    async def flush_saves():
+        """等待所有正在进行的异步保存完成"""
+        if _save_tasks:
+            await asyncio.gather(*_save_tasks, return_exceptions=True)
 
     @classmethod
     def cancel_all(cls):
@@ -134,18 +315,7 @@ class RunContext(BaseModel):
         run.description = description
 
         # 设置对 loguru 的监控
-        def log_sink(message):
-            record = message.record
-            if record["extra"].get("run_id") == run_id:
-                log_record = LogRecord(
-                    level=record["level"].name.upper(),
-                    message=record["message"],
-                    time=record["time"],
-                )
-                run.log.append(log_record)
-
-        # 添加日志处理器
-        run._handler_id = logger.add(log_sink, filter=lambda record: "run_id" in record["extra"])
+        _ensure_log_sink()
 
         # 添加到运行中任务列表
         _running_runs[run_id] = run
@@ -156,7 +326,7 @@ class RunContext(BaseModel):
                 children = cache.get(f"runinfo.children.{parent_id}", [])
                 if run_id not in children:
                     children.append(run_id)
-                    cache.set(f"runinfo.children.{parent_id}", children)
+                    cache.set(f"runinfo.children.{parent_id}", children, ttl=_retention())
 
         return run
 
@@ -165,6 +335,8 @@ class RunContext(BaseModel):
         # 优先从运行中任务获取
         if run_id in _running_runs:
             return _running_runs[run_id]
+        if run_id in _saving_runs:
+            return _saving_runs[run_id]
 
         # 从缓存加载
         run_json = cache.get(f"runinfo.{run_id}")
@@ -185,27 +357,28 @@ class RunContext(BaseModel):
         """获取所有子任务"""
         children = []
         child_ids = cache.get(f"runinfo.children.{self.id}", [])
+        stored = cache.get_many(
+            [f"runinfo.{i}" for i in child_ids if i not in _running_runs and i not in _saving_runs]
+        )
         for child_id in child_ids:
-            child = RunContext.get(child_id)
+            child = _running_runs.get(child_id, None) or _saving_runs.get(child_id, None)
+            if not child:
+                run_json = stored.get(f"runinfo.{child_id}", None)
+                child = RunContext.model_validate_json(run_json) if run_json else None
             if child:
                 children.append(child)
         return children
 
     def yield_logs(self, reverse: bool = False, include_children: bool = False):
-        """按时间顺序产出日志记录"""
-        logs = self.log.copy()
-
+        """按时间顺序产出日志记录, 包括已写入日志文件的较早日志"""
+        sources = [self.log]
         if include_children:
-            for child in self.get_children():
-                logs.extend(child.log)
+            sources.extend(child.log for child in self.get_children())
 
-        # 确保所有日志都有时间戳
-        for log in logs:
-            if log.time is None:
-                log.time = datetime.now()
-
-        # 按时间排序
-        logs.sort(key=lambda x: x.time, reverse=reverse)
+        # 各任务的日志已按时间排列, 合并即可
+        logs = heapq.merge(*sources, key=lambda x: x.time)
+        if reverse:
+            logs = reversed(list(logs))
         yield from logs
 
     def log_sink(self, message):
@@ -276,3 +449,6 @@ class RunContext(BaseModel):
         if status:
             ctx.set(status)
         return ctx
+
+
+var.exit_handlers.append(RunContext.flush_saves)
@@ -1,13 +1,17 @@
 import asyncio
 from datetime import datetime, time, timedelta
 from dateutil import parser
+import heapq
+import itertools
 import re
-from typing import Callable, Union
+from typing import Callable, Dict, List, Set, Union
 import json
 import hashlib
+import time as _time
 
 from loguru import logger
 
+from . import var
 from .config import config
 from .runinfo import RunContext, RunStatus
 from .utils import next_random_datetime
@@ -67,6 +71,9 @@ class Scheduler:
         sid: str = None,
         description: str = None,
         on_next_time: Callable[[datetime], None] = None,
+        weight: int = 1,
+        duration: float = 600,
+        group: str = None,
     ):
         """
         Args:
@@ -77,6 +84,9 @@ class Scheduler:
             sid: 调度器ID, 用于缓存下次执行时间
             description: 调度器描述
             on_next_time: 回调函数, 在计算出下一次执行时间时调用
+            weight: 每次执行占用的并发数, 用于错开各任务的执行时间, 为空时视为不限并发
+            duration: 每次执行的预计时长 (秒)
+            group: 分组 (如使用的代理), 同一分组的任务有单独的并发限制
         """
         self.func = func
         if config.debug_cron:
@@ -92,9 +102,14 @@ class Scheduler:
         self.sid = sid
         self.description = description
         self.on_next_time = on_next_time
+        self.weight = weight
+        self.duration = duration
+        self.group = group
         self._cache_key = f"scheduler.{sid}" if sid else None
         self._next_time = None
         self._ctx: RunContext = None
+        self._done: asyncio.Future = None
+        self._config_hash: str = None
 
     def _parse_time(self, t):
         if isinstance(t, str):
@@ -103,6 +118,8 @@ class Scheduler:
 
     def _get_scheduler_config(self):
         """获取调度器配置的哈希值"""
+        if self._config_hash:
+            return self._config_hash
         config = {
             "days": self.days,
             "start_time": self.start_time.isoformat() if self.start_time else None,
@@ -110,7 +127,8 @@ class Scheduler:
         }
         # Convert config to a stable string representation and hash it
         config_str = json.dumps(config, sort_keys=True)
-        return hashlib.md5(config_str.encode()).hexdigest()
+        self._config_hash = hashlib.md5(config_str.encode()).hexdigest()
+        return self._config_hash
 
     @property
     def next_time(self) -> datetime:
@@ -121,97 +139,498 @@ class Scheduler:
 
     def _get_next_time(self) -> datetime:
         """计算或获取缓存的下一次执行时间"""
-        from .cache import cache
-
-        now = datetime.now()
-        next_time = None
-
-        # Try to get cached next execution time
         if self._cache_key:
-            cached = cache.get(self._cache_key)
-            if cached:
-                cached_config_hash = cached.get("config_hash")
-                cached_time = cached.get("next_time")
-
-                # Check if config hash matches and time hasn't passed
-                if (
-                    cached_config_hash == self._get_scheduler_config()
-                    and cached_time
-                    and parser.parse(cached_time) > now
-                ):
-                    next_time = parser.parse(cached_time)
-
-        # Calculate new next_time if needed
-        if not next_time:
-            # Calculate interval days
-            if isinstance(self.days, (list, tuple)):
-                interval = self.days[0] + (self.days[1] - self.days[0])
-            else:
-                interval = self.days
+            states.load()
+        return self._resolve_next_time()
 
-            next_time = next_random_datetime(
-                start_time=self.start_time, end_time=self.end_time, interval_days=interval
-            )
+    async def _aget_next_time(self) -> datetime:
+        """计算或获取缓存的下一次执行时间, 首次读取缓存时不阻塞事件循环"""
+        if self._cache_key:
+            await states.aload()
+        return self._resolve_next_time()
 
-            # Cache the next execution time with config hash
+    def _resolve_next_time(self) -> datetime:
+        cached = states.get(self._cache_key) if self._cache_key else None
+        next_time = self._parse_cached_next_time(cached)
+        if next_time:
+            planner.book(self, next_time)
+        else:
+            next_time = planner.plan(self)
             if self._cache_key:
-                cache.set(
-                    self._cache_key,
-                    {
-                        "config_hash": self._get_scheduler_config(),
-                        "next_time": next_time.isoformat(),
-                        "description": self.description,
-                    },
-                )
-
+                states.set(self._cache_key, self._cache_value(next_time))
         return next_time
 
+    def _parse_cached_next_time(self, cached: dict) -> datetime:
+        """检查缓存的下一次执行时间, 配置已变更或时间已过时返回 None"""
+        if not cached:
+            return None
+        cached_config_hash = cached.get("config_hash")
+        cached_time = cached.get("next_time")
+
+        # Check if config hash matches and time hasn't passed
+        if (
+            cached_config_hash == self._get_scheduler_config()
+            and cached_time
+            and parser.parse(cached_time) > datetime.now()
+        ):
+            return parser.parse(cached_time)
+        return None
+
+    def _calculate_next_time(self) -> datetime:
+        """随机计算新的下一次执行时间"""
+        # Calculate interval days
+        if isinstance(self.days, (list, tuple)):
+            interval = self.days[0] + (self.days[1] - self.days[0])
+        else:
+            interval = self.days
+
+        return next_random_datetime(
+            start_time=self.start_time, end_time=self.end_time, interval_days=interval
+        )
+
+    def _cache_value(self, next_time: datetime) -> dict:
+        # Cache the next execution time with config hash
+        return {
+            "config_hash": self._get_scheduler_config(),
+            "next_time": next_time.isoformat(),
+            "description": self.description,
+        }
+
     async def schedule(self):
-        """等待到指定时间范围内执行函数"""
-        from .cache import cache
+        """等待到指定时间范围内执行函数, 由全局定时服务统一计时"""
+        self._done = asyncio.get_running_loop().create_future()
+        try:
+            await self._arm()
+            await self._done
+        except asyncio.CancelledError:
+            self.cancel()
+            raise
 
-        while True:
-            now = datetime.now()
-            self._next_time = self._get_next_time()
+    async def _arm(self):
+        """计算下一次执行时间并加入定时服务"""
+        self._next_time = await self._aget_next_time()
 
-            # Call the hook function if provided
-            if self.on_next_time:
-                self._ctx = self.on_next_time(self._next_time)
+        # Call the hook function if provided
+        if self.on_next_time:
+            self._ctx = self.on_next_time(self._next_time)
 
-            # Wait until the scheduled time
-            wait_seconds = (self._next_time - now).total_seconds()
-            if wait_seconds > 0:
-                await asyncio.sleep(wait_seconds)
+        timer.add(self, self._next_time)
 
-            # Execute the function
+    async def _fire(self):
+        """由定时服务在到达执行时间时调用"""
+        # Execute the function
+        try:
             try:
-                try:
-                    # Shield the function execution to distinguish cancellation source
-                    await asyncio.shield(self.func(self._ctx))
-                except asyncio.CancelledError:
-                    # This is a cancellation from within self.func
-                    if self._ctx:
-                        self._ctx.finish(RunStatus.ERROR, "任务在运行时被取消")
-                    raise  # Re-raise to be caught by outer try block
+                # Shield the function execution to distinguish cancellation source
+                await asyncio.shield(self.func(self._ctx))
             except asyncio.CancelledError:
-                # This is a cancellation from outside schedule()
+                # This is a cancellation from within self.func
                 if self._ctx:
-                    self._ctx.finish(RunStatus.CANCELLED, "任务被取消")
-                raise  # Re-raise to propagate cancellation
-            except Exception:
-                if self._ctx:
-                    self._ctx.finish(RunStatus.ERROR, f"任务发生错误")
-                if not config.nofail:
-                    raise
+                    self._ctx.finish(RunStatus.ERROR, "任务在运行时被取消")
+                raise  # Re-raise to be caught by outer try block
+        except asyncio.CancelledError:
+            # This is a cancellation from outside schedule()
+            if self._ctx:
+                self._ctx.finish(RunStatus.CANCELLED, "任务被取消")
+            self._resolve()
+            return
+        except Exception as e:
+            if self._ctx:
+                self._ctx.finish(RunStatus.ERROR, f"任务发生错误")
+            if not config.nofail:
+                self._resolve(e)
+                return
 
-            if self._cache_key:
-                try:
-                    cache.delete(self._cache_key)
-                except KeyError:
-                    pass
+        if self._cache_key:
+            states.delete(self._cache_key)
+        self._ctx = None
+        self._next_time = None
+
+        # If days is 0, stop after one execution
+        if isinstance(self.days, (list, tuple)) and self.days[0] == 0:
+            self._resolve()
+            return
+
+        try:
+            await self._arm()
+        except Exception as e:
+            self._resolve(e)
+
+    def _resolve(self, exc: Exception = None):
+        if self._done and not self._done.done():
+            if exc:
+                self._done.set_exception(exc)
+            else:
+                self._done.set_result(None)
+
+    def reschedule(self, next_time: datetime):
+        """修改下一次执行时间"""
+        self._next_time = next_time
+        planner.book(self, next_time)
+        timer.reschedule(self, next_time)
+        if self._cache_key:
+            states.load()
+            states.set(self._cache_key, self._cache_value(next_time))
+
+    def cancel(self):
+        """取消该计划任务, 包括正在执行的任务, schedule() 将正常返回"""
+        if self._done and self._done.done():
+            return
+        running = timer.cancel(self)
+        planner.release(self)
+        if not running and self._ctx:
+            self._ctx.finish(RunStatus.CANCELLED, "任务被取消")
             self._ctx = None
-            self._next_time = None
+        self._resolve()
+
+
+class SchedulePlanner:
+    """根据各计划任务的预计负载错开执行时间
+
+    为新的执行时间随机抽取多个候选时间, 选择与已安排的任务重叠负载最小的一个,
+    因此仍保留随机性, 但同一时间范围内的任务会尽量分散. 负载按全局并发预算和
+    各分组 (如代理) 的并发限制进行归一化, 并以分钟为单位累计.
+    """
+
+    SLOT = 60
+    # 默认全局并发预算, 与各模块默认并发数之和相当; 每个分组 (如同一代理) 的并发限制更低
+    MAX_CONCURRENCY = 8
+    GROUP_LIMIT = 4
+
+    def __init__(self, max_concurrency: int = None, group_limit: int = None, candidates: int = 8):
+        """
+        Args:
+            max_concurrency: 全局并发预算, 默认为 MAX_CONCURRENCY
+            group_limit: 每个分组的并发限制, 默认为 GROUP_LIMIT
+            candidates: 每次安排时抽取的候选时间数量
+        """
+        self.max_concurrency = max_concurrency or self.MAX_CONCURRENCY
+        self.group_limit = group_limit or self.GROUP_LIMIT
+        self.candidates = candidates
+        # 调度器 -> (时间窗口, 开始时间戳, 结束时间戳, 负载, 分组)
+        self._bookings: Dict[Scheduler, tuple] = {}
+        self._load: Dict[int, int] = {}
+        self._group_load: Dict[tuple, int] = {}
+        self._peaks: Dict[str, int] = {}
+        self._pruned = 0
+        self._report_handle: asyncio.TimerHandle = None
+
+    @staticmethod
+    def _window(scheduler: Scheduler, t: datetime) -> str:
+        start = scheduler.start_time.strftime("%H:%M") if scheduler.start_time else "00:00"
+        end = scheduler.end_time.strftime("%H:%M") if scheduler.end_time else "23:59"
+        return f"{t.strftime('%m-%d')} {start}-{end}"
+
+    def _weight(self, scheduler: Scheduler) -> int:
+        # 不限并发的任务按最大负载 (全局并发预算) 计算
+        if not scheduler.weight:
+            return self.max_concurrency
+        return min(scheduler.weight, self.max_concurrency)
+
+    def _slots(self, start: float, end: float):
+        return range(int(start // self.SLOT), int(max(end - 1, start) // self.SLOT) + 1)
+
+    def _add(self, booking: tuple, sign: int):
+        _, start, end, weight, group = booking
+        for slot in self._slots(start, end):
+            self._load[slot] = self._load.get(slot, 0) + sign * weight
+            if group is not None:
+                key = (group, slot)
+                self._group_load[key] = self._group_load.get(key, 0) + sign * weight
+
+    def _prune(self):
+        now = _time.time()
+        if now - self._pruned < self.SLOT:
+            return
+        self._pruned = now
+        for scheduler, booking in list(self._bookings.items()):
+            if booking[2] < now:
+                self.release(scheduler)
+        current = int(now // self.SLOT)
+        self._load = {k: v for k, v in self._load.items() if k >= current and v}
+        self._group_load = {k: v for k, v in self._group_load.items() if k[1] >= current and v}
+
+    def _score(self, scheduler: Scheduler, t: datetime) -> float:
+        start = t.timestamp()
+        slots = self._slots(start, start + scheduler.duration)
+        weight = self._weight(scheduler)
+        total = max(self._load.get(s, 0) for s in slots)
+        score = (total + weight) / self.max_concurrency
+        if scheduler.group is not None:
+            grouped = max(self._group_load.get((scheduler.group, s), 0) for s in slots)
+            score += (grouped + weight) / self.group_limit
+        return score
+
+    def plan(self, scheduler: Scheduler) -> datetime:
+        """为计划任务随机选择负载最低的下一次执行时间, 并记录该安排"""
+        self.release(scheduler)
+        if config.debug_cron:
+            next_time = scheduler._calculate_next_time()
+        else:
+            self._prune()
+            candidates = [scheduler._calculate_next_time() for _ in range(max(self.candidates, 1))]
+            next_time = min(candidates, key=lambda t: self._score(scheduler, t))
+        self.book(scheduler, next_time)
+        self._schedule_report()
+        return next_time
+
+    def _schedule_report(self):
+        # 一批计划任务安排完成后再报告
+        if self._report_handle:
+            self._report_handle.cancel()
+        try:
+            self._report_handle = asyncio.get_running_loop().call_later(1, self.report)
+        except RuntimeError:
+            self._report_handle = None
+
+    def book(self, scheduler: Scheduler, t: datetime):
+        """记录计划任务的执行时间"""
+        self.release(scheduler)
+        start = t.timestamp()
+        window = self._window(scheduler, t)
+        booking = (window, start, start + scheduler.duration, self._weight(scheduler), scheduler.group)
+        self._bookings[scheduler] = booking
+        self._add(booking, 1)
+
+        peak = max(self._load[s] for s in self._slots(booking[1], booking[2]))
+        if peak > self._peaks.get(window, 0):
+            self._peaks[window] = peak
+            if peak > self.max_concurrency:
+                logger.debug(
+                    f"计划任务时间窗口 {window} 的预计最大并发数为 {peak}, 超出预算 ({self.max_concurrency})."
+                )
+
+    def release(self, scheduler: Scheduler):
+        """移除计划任务的执行时间安排"""
+        booking = self._bookings.pop(scheduler, None)
+        if booking:
+            self._add(booking, -1)
+
+    def report(self) -> Dict[str, int]:
+        """各时间窗口的预计最大并发数"""
+        self._report_handle = None
+        peaks = {}
+        for window, start, end, _, _ in self._bookings.values():
+            peak = max(self._load.get(s, 0) for s in self._slots(start, end))
+            peaks[window] = max(peaks.get(window, 0), peak)
+        for window, peak in sorted(peaks.items()):
+            logger.debug(f"计划任务时间窗口 {window} 的预计最大并发数为 {peak}.")
+        return peaks
+
+
+planner = SchedulePlanner()
+
+
+class SchedulerStates:
+    """计划任务状态 (下一次执行时间) 的缓存
+
+    首次使用时通过一次前缀查询读取全部 "scheduler.*" 键, 此后在内存中读写,
+    修改在短时间内合并为一次批量写入.
+    """
+
+    PREFIX = "scheduler."
+
+    def __init__(self, flush_delay: float = 1.0):
+        """
+        Args:
+            flush_delay: 首次修改后等待多久 (秒) 进行批量写入
+        """
+        self.flush_delay = flush_delay
+        self._states: Dict[str, dict] = None
+        self._loading: asyncio.Future = None
+        self._dirty: Dict[str, dict] = {}
+        self._deleted: Set[str] = set()
+        self._handle: asyncio.TimerHandle = None
+
+    def load(self):
+        """读取全部计划任务状态, 已读取时忽略"""
+        from .cache import cache
+
+        if self._states is None:
+            # 本地 JSON 存储按 "." 嵌套保存, 前缀查询只返回 "scheduler.<sid>.next_time" 这样的叶子路径,
+            # 因此同时按其上一级的完整键读取, 并只保留完整的状态记录.
+            keys = set(cache.find_by_prefix(self.PREFIX))
+            keys |= {k.rsplit(".", 1)[0] for k in keys if k.endswith(".next_time")}
+            values = cache.get_many(list(keys))
+            self._states = {k: v for k, v in values.items() if isinstance(v, dict) and "next_time" in v}
+            logger.debug(f"已读取 {len(self._states)} 个计划任务的缓存状态.")
+
+    async def aload(self):
+        """在线程池中读取全部计划任务状态, 多个协程同时调用时仅读取一次"""
+        if self._states is not None:
+            return
+        if not self._loading:
+            self._loading = asyncio.ensure_future(asyncio.get_running_loop().run_in_executor(None, self.load))
+        loading = self._loading
+        try:
+            await asyncio.shield(loading)
+        finally:
+            if loading.done() and self._loading is loading:
+                self._loading = None
+
+    def get(self, key: str) -> dict:
+        return self._states.get(key, None)
+
+    def set(self, key: str, value: dict):
+        self._states[key] = value
+        self._dirty[key] = value
+        self._deleted.discard(key)
+        self._schedule_flush()
+
+    def delete(self, key: str):
+        self._states.pop(key, None)
+        self._dirty.pop(key, None)
+        self._deleted.add(key)
+        self._schedule_flush()
+
+    def _schedule_flush(self):
+        if self._handle:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.flush()
+        else:
+            self._handle = loop.call_later(self.flush_delay, self.flush)
+
+    def flush(self):
+        """将修改批量写入缓存"""
+        from .cache import cache
+
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+        dirty, self._dirty = self._dirty, {}
+        deleted, self._deleted = self._deleted, set()
+        try:
+            if dirty:
+                cache.set_many(dirty)
+            if deleted:
+                cache.delete_many(list(deleted))
+        except Exception as e:
+            logger.warning(f"计划任务状态写入缓存失败: {e}")
+
+    async def _exit_handler(self):
+        self.flush()
+
+
+states = SchedulerStates()
+var.exit_handlers.append(states._exit_handler)
+
+
+class TimerService:
+    """全局定时服务
+
+    使用最小堆保存所有计划任务的下一次执行时间, 仅保留一个事件循环定时器指向最早的任务.
+    到期的任务在并发数有限的工作池中执行. 添加, 取消和修改时间的复杂度均为 O(log n).
+    """
+
+    # 单次等待的最长时间 (秒), 用于应对系统时间的跳变
+    MAX_SLEEP = 60
+
+    def __init__(self, max_workers: int = 64):
+        """
+        Args:
+            max_workers: 同时执行的计划任务的最大数量
+        """
+        self.max_workers = max_workers
+        self._heap: List[list] = []
+        self._entries: Dict[Scheduler, list] = {}
+        self._running: Dict[Scheduler, asyncio.Task] = {}
+        self._counter = itertools.count()
+        self._cancelled = 0
+        self._handle: asyncio.TimerHandle = None
+        self._handle_when: float = None
+        self._sem: asyncio.Semaphore = None
+        self._loop: asyncio.AbstractEventLoop = None
+
+    def _bind(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 事件循环变更 (如测试中多次运行), 重新初始化
+            self._heap.clear()
+            self._entries.clear()
+            self._running.clear()
+            self._cancelled = 0
+            self._handle = None
+            self._handle_when = None
+            self._sem = asyncio.Semaphore(self.max_workers)
+            self._loop = loop
+        return loop
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, scheduler: Scheduler, when: datetime):
+        """加入一个计划任务, 已存在时修改其执行时间"""
+        self._bind()
+        self._remove(scheduler)
+        entry = [when.timestamp(), next(self._counter), scheduler]
+        self._entries[scheduler] = entry
+        heapq.heappush(self._heap, entry)
+        self._rearm()
+
+    def reschedule(self, scheduler: Scheduler, when: datetime):
+        """修改计划任务的执行时间, 任务不在等待中时忽略"""
+        if scheduler in self._entries:
+            self.add(scheduler, when)
+
+    def cancel(self, scheduler: Scheduler) -> bool:
+        """移除计划任务, 并取消其正在执行的任务, 返回任务是否正在执行"""
+        self._remove(scheduler)
+        task = self._running.pop(scheduler, None)
+        if task:
+            task.cancel()
+            return True
+        return False
+
+    def _remove(self, scheduler: Scheduler):
+        entry = self._entries.pop(scheduler, None)
+        if entry:
+            # 延迟删除, 出堆时跳过
+            entry[-1] = None
+            self._cancelled += 1
+            if self._cancelled > len(self._heap) // 2:
+                self._heap = [e for e in self._heap if e[-1] is not None]
+                heapq.heapify(self._heap)
+                self._cancelled = 0
+
+    def _rearm(self):
+        while self._heap and self._heap[0][-1] is None:
+            heapq.heappop(self._heap)
+            self._cancelled -= 1
+        if not self._heap:
+            return
+        when = self._heap[0][0]
+        if self._handle and self._handle_when <= when:
+            return
+        if self._handle:
+            self._handle.cancel()
+        delay = min(max(when - _time.time(), 0), self.MAX_SLEEP)
+        self._handle = self._loop.call_later(delay, self._on_timer)
+        self._handle_when = when
+
+    def _on_timer(self):
+        self._handle = None
+        now = _time.time()
+        while self._heap and (self._heap[0][-1] is None or self._heap[0][0] <= now):
+            _, _, scheduler = heapq.heappop(self._heap)
+            if scheduler is None:
+                self._cancelled -= 1
+                continue
+            del self._entries[scheduler]
+            self._running[scheduler] = self._loop.create_task(self._run(scheduler))
+        self._rearm()
+
+    async def _run(self, scheduler: Scheduler):
+        try:
+            async with self._sem:
+                await scheduler._fire()
+        except asyncio.CancelledError:
+            scheduler._resolve()
+        finally:
+            if self._running.get(scheduler, None) is asyncio.current_task():
+                del self._running[scheduler]
+
 
-            # If days is 0, break the loop after one execution
-            if isinstance(self.days, (list, tuple)) and self.days[0] == 0:
-                break
+timer = TimerService()
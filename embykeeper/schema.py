@@ -153,6 +153,7 @@ class EmbyAccount(ConfigModel):
 
 
 class EmbyConfig(MediaServerBaseConfig):
+    server_concurrency: Optional[int] = 2
     account: Optional[List[EmbyAccount]] = []
 
 
@@ -244,6 +245,26 @@ class LLMConfig(ConfigModel):
     auth_services: Optional[List[str]] = None
 
 
+class CacheConfig(ConfigModel):
+    backend: Optional[str] = Field("json", pattern="^(json|sqlite)$")
+    write_behind: Optional[bool] = False
+    flush_interval: Optional[float] = Field(5.0, gt=0)
+    flush_size: Optional[int] = Field(500, gt=0)
+    lru_size: Optional[int] = Field(4096, ge=0)
+    lru_ttl: Optional[float] = Field(None, gt=0)
+    watch: Optional[bool] = False
+    runinfo_retention: Optional[float] = Field(7, gt=0)
+    sweep_interval: Optional[float] = Field(3600, gt=0)
+
+
+class BandwidthConfig(ConfigModel):
+    total: Optional[float] = Field(None, gt=0)
+    server: Optional[float] = Field(None, gt=0)
+    proxy: Optional[float] = Field(None, gt=0)
+    session: Optional[float] = Field(1, gt=0)
+    report_interval: Optional[float] = Field(600, gt=0)
+
+
 class Config(ConfigModel):
     alias_map: ClassVar[Dict[str, str]] = {
         "emby.time_range": "watchtime",
@@ -261,6 +282,8 @@ class Config(ConfigModel):
     }
 
     mongodb: Optional[str] = None
+    cache: Optional[CacheConfig] = CacheConfig()
+    bandwidth: Optional[BandwidthConfig] = BandwidthConfig()
     basedir: Optional[str] = None
     nofail: Optional[bool] = True
     noexit: Optional[bool] = False
@@ -4,12 +4,14 @@ import hashlib
 import re
 import time
 from typing import Optional, List, Dict, Any
-from urllib.parse import urljoin
+from urllib.parse import urljoin, urlsplit
 import random
 
 from curl_cffi.requests import AsyncSession, RequestsError, Response
 from loguru import logger
 
+from embykeeper import var
+from embykeeper.bandwidth import governor
 from embykeeper.utils import get_proxy_str
 
 logger = logger.bind(scheme="subsonic")
@@ -50,6 +52,127 @@ class ServerPingInfo:
     error_message: str = None
 
 
+@dataclass
+class ServerHealth:
+    failures: int = 0
+    down_until: float = 0.0
+
+
+class SubsonicSessionPool:
+    """按 (服务器, 代理) 共享的 HTTP 会话池
+
+    访问同一服务器的所有账户复用同一会话的连接, 会话在多次保活运行之间保持, 在程序退出时关闭.
+    请求头由每次请求单独提供. 同时记录各服务器的连接状况, 连续无法连接的服务器在一段时间内直接失败.
+    """
+
+    # 每个会话同时进行的最大请求数, 同时也限制了到该服务器的最大连接数
+    MAX_CLIENTS = 16
+    # 音频流请求会长时间占用连接, 使用单独的会话, 以免占满普通请求的名额
+    MAX_STREAM_CLIENTS = 1000
+    # 连续连接失败达到该次数后, 服务器被标记为不可用
+    FAIL_THRESHOLD = 3
+    # 标记为不可用的初始时长与最大时长 (秒), 每次再次失败时加倍
+    BACKOFF = 30
+    MAX_BACKOFF = 600
+
+    def __init__(self):
+        self._sessions: Dict[tuple, AsyncSession] = {}
+        self._warmups: Dict[tuple, asyncio.Lock] = {}
+        self._warm = set()
+        self._health: Dict[str, ServerHealth] = {}
+        self._loop = None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def _bind_loop(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # 会话绑定于事件循环, 事件循环变更时重新创建
+            self._sessions = {}
+            self._warmups = {}
+            self._warm = set()
+            self._loop = loop
+
+    @staticmethod
+    def server_of(url: str) -> str:
+        parts = urlsplit(url)
+        return f"{parts.scheme}://{parts.netloc}"
+
+    def get(self, server: str, proxy: str = None, stream: bool = False) -> AsyncSession:
+        self._bind_loop()
+        key = (server, proxy, stream)
+        session = self._sessions.get(key, None)
+        if not session or session._closed:
+            session = self._sessions[key] = AsyncSession(
+                verify=False,
+                timeout=10.0,
+                proxy=proxy,
+                impersonate="chrome",
+                allow_redirects=True,
+                default_headers=False,
+                max_clients=self.MAX_STREAM_CLIENTS if stream else self.MAX_CLIENTS,
+            )
+        return session
+
+    def warmup(self, server: str, proxy: str = None) -> Optional[asyncio.Lock]:
+        """返回会话的预热锁, 已预热时返回 None.
+
+        会话的首个请求持有该锁建立连接, 其余请求等待后复用该连接, 以免大量账户同时握手.
+        """
+        self._bind_loop()
+        key = (server, proxy)
+        if key in self._warm:
+            return None
+        lock = self._warmups.get(key, None)
+        if not lock:
+            lock = self._warmups[key] = asyncio.Lock()
+        return lock
+
+    def mark_warm(self, server: str, proxy: str = None):
+        self._warm.add((server, proxy))
+        self._warmups.pop((server, proxy), None)
+
+    def health(self, server: str) -> ServerHealth:
+        health = self._health.get(server, None)
+        if not health:
+            health = self._health[server] = ServerHealth()
+        return health
+
+    def unavailable_for(self, server: str) -> float:
+        """返回服务器仍被标记为不可用的剩余秒数, 可用时返回 0."""
+        health = self._health.get(server, None)
+        if not health:
+            return 0.0
+        return max(0.0, health.down_until - time.monotonic())
+
+    def record_success(self, server: str):
+        health = self._health.get(server, None)
+        if health and (health.failures or health.down_until):
+            if health.failures >= self.FAIL_THRESHOLD:
+                logger.info(f"服务器 {server} 已恢复连接.")
+            health.failures = 0
+            health.down_until = 0.0
+
+    def record_failure(self, server: str):
+        health = self.health(server)
+        health.failures += 1
+        if health.failures >= self.FAIL_THRESHOLD:
+            n = health.failures - self.FAIL_THRESHOLD
+            backoff = min(self.MAX_BACKOFF, self.BACKOFF * 2 ** min(n, 10))
+            health.down_until = time.monotonic() + backoff
+            logger.warning(f"服务器 {server} 连续 {health.failures} 次无法连接, 将在 {backoff} 秒内跳过.")
+
+    async def close(self):
+        sessions, self._sessions = self._sessions, {}
+        self._warm = set()
+        await asyncio.gather(*[s.close() for s in sessions.values()], return_exceptions=True)
+
+
+sessions = SubsonicSessionPool()
+var.exit_handlers.append(sessions.close)
+
+
 class Subsonic:
     """
     An async client for interacting with Subsonic API.
@@ -75,8 +198,8 @@ class Subsonic:
         self.client = client or "Stream Music"
         self.useragent = useragent or "Dart/3.4 (dart:io)"
 
-        self._session = None
-        self._session_lock = asyncio.Lock()
+        self._base = sessions.server_of(server)
+        self._proxy = get_proxy_str(proxy, curl=True)
 
     def _generate_salt(self, length: int = 6) -> str:
         """Generate a random salt for authentication"""
@@ -86,21 +209,28 @@ class Subsonic:
         """Generate authentication token using password and salt"""
         return hashlib.md5(f"{self.password}{self.salt}".encode()).hexdigest()
 
-    async def _get_session(self) -> AsyncSession:
-        """Get or create an HTTP session"""
-        async with self._session_lock:
-            if not self._session or self._session._closed:
-                headers = {"User-Agent": self.useragent}
-                self._session = AsyncSession(
-                    verify=False,
-                    timeout=10.0,
-                    proxy=get_proxy_str(self.proxy, curl=True),
-                    headers=headers,
-                    impersonate="chrome",
-                    allow_redirects=True,
-                    default_headers=False,
-                )
-            return self._session
+    def _get_session(self, stream: bool = False) -> AsyncSession:
+        """Get the shared HTTP session for this server and proxy"""
+        return sessions.get(self._base, self._proxy, stream=stream)
+
+    def _check_health(self):
+        down = sessions.unavailable_for(self._base)
+        if down:
+            raise SubsonicConnectError(f"服务器近期连续无法连接, 将在 {down:.0f} 秒后重试")
+
+    async def _get(self, url: str, **kw) -> Response:
+        session = self._get_session()
+        kw.setdefault("headers", {"User-Agent": self.useragent})
+        lock = sessions.warmup(self._base, self._proxy)
+        if not lock:
+            return await session.get(url, **kw)
+        async with lock:
+            self._check_health()
+            if sessions.warmup(self._base, self._proxy):
+                response = await session.get(url, **kw)
+                sessions.mark_warm(self._base, self._proxy)
+                return response
+        return await session.get(url, **kw)
 
     async def _request(self, path: str, params: Optional[Dict[str, Any]] = None) -> dict:
         """
@@ -120,11 +250,13 @@ class Subsonic:
 
         url = urljoin(self.server, f"rest/{path}")
 
+        self._check_health()
+
         last_err = None
         for _ in range(3):
             try:
-                session = await self._get_session()
-                response: Response = await session.get(url, params=base_params)
+                response: Response = await self._get(url, params=base_params)
+                sessions.record_success(self._base)
                 if response.status_code == 401:
                     raise SubsonicLoginError("用户名密码错误或无权访问")
                 response.raise_for_status()
@@ -136,6 +268,7 @@ class Subsonic:
                 last_err = e
                 await asyncio.sleep(random.random() + 0.5)
 
+        sessions.record_failure(self._base)
         error_msg = re.sub(r"\s+See\s+.*?\s+first for more details\.\.?", "", str(last_err))
         raise SubsonicConnectError(f"{last_err.__class__.__name__}: {error_msg}")
 
@@ -200,6 +333,17 @@ class Subsonic:
         response = await self._request("getRandomSongs", params)
         return response.get("randomSongs", {}).get("song", [])
 
+    async def get_album_list2(
+        self, type: str = "random", size: int = 10, offset: int = 0, folder_id: Optional[str] = None
+    ) -> List[Dict]:
+        """Get a page of albums organized by ID3 tags"""
+        params = {"type": type, "size": size, "offset": offset}
+        if folder_id:
+            params["musicFolderId"] = folder_id
+
+        response = await self._request("getAlbumList2", params)
+        return response.get("albumList2", {}).get("album", [])
+
     async def scrobble(self, song_id: str, submission: bool = True, time: Optional[int] = None) -> None:
         """
         Submit listening data to the server
@@ -213,9 +357,8 @@ class Subsonic:
         await self._request("scrobble", params)
 
     async def close(self):
-        """Close the client and cleanup resources"""
-        if self._session:
-            await self._session.close()
+        """Release the client; the shared session stays open for other accounts"""
+        pass
 
     async def stream_noreturn(self, song_id: str) -> None:
         """Stream a song very slowly to simulate playback"""
@@ -230,19 +373,23 @@ class Subsonic:
             }
             url = urljoin(self.server, "rest/stream")
 
-            session = await self._get_session()
-            resp: Response = await session.get(
-                url,
-                params=params,
-                timeout=None,
-                max_recv_speed=1024,
-                stream=True,
-            )
-            try:
-                resp.raise_for_status()
-                async for _ in resp.aiter_content(chunk_size=1024):
-                    await asyncio.sleep(random.random())
-            finally:
-                resp.close()
+            session = self._get_session(stream=True)
+            async with governor.open(song_id, self.server, get_proxy_str(self.proxy)) as flow:
+                resp: Response = await session.get(
+                    url,
+                    params=params,
+                    headers={"User-Agent": self.useragent},
+                    timeout=None,
+                    max_recv_speed=flow.recv_speed,
+                    stream=True,
+                )
+                try:
+                    resp.raise_for_status()
+                    async for chunk in resp.aiter_content():
+                        await flow.consume(len(chunk))
+                finally:
+                    if resp.quit_now:
+                        resp.quit_now.set()
+                    await resp.aclose()
         except asyncio.CancelledError:
             pass
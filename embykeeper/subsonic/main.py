@@ -110,6 +110,8 @@ class SubsonicManager:
                 on_next_time=on_next_time,
                 sid="subsonic.watch.global",
                 description="Subsonic 保活任务",
+                weight=min(len(unified_accounts), config.subsonic.concurrency or len(unified_accounts)),
+                group="proxy" if config.proxy and any(a.use_proxy for a in unified_accounts) else None,
             )
             tasks.append(scheduler.schedule())
 
@@ -132,6 +134,7 @@ class SubsonicManager:
                 on_next_time=make_on_next_time(account_spec),  # 使用工厂函数创建回调
                 sid=f"subsonic.watch.{account_spec}",
                 description=f"Subsonic 保活任务 - {account_spec}",
+                group="proxy" if config.proxy and account.use_proxy else None,
             )
             tasks.append(scheduler.schedule())
 
@@ -1,6 +1,7 @@
 import asyncio
+from collections import deque
 import random
-from typing import Iterable
+from typing import Deque, Dict, Iterable, List, Optional
 from loguru import logger
 
 from embykeeper.config import config
@@ -12,6 +13,105 @@ from .api import Subsonic, SubsonicConnectError, SubsonicRequestError
 logger = logger.bind(scheme="subsonic")
 
 
+class SongPool:
+    """同一服务器上所有账户共享的随机歌曲池.
+
+    歌曲不足时在后台通过 getRandomSongs 补充, 服务器返回的随机歌曲过少时再以 getAlbumList2 的随机专辑补充.
+    播放出错时清空, 以便重新获取; 清空前已开始的补充结果将被丢弃.
+    """
+
+    # 歌曲池最多保存的歌曲数
+    MAX_SIZE = 200
+    # 歌曲数低于该值时开始后台补充
+    LOW_WATER = 20
+    # 每次获取的随机歌曲数
+    RANDOM_SIZE = 50
+    # 随机歌曲不足时, 每次获取的随机专辑数
+    ALBUM_PAGE = 3
+
+    _pools: Dict[str, "SongPool"] = {}
+
+    def __init__(self, server: str):
+        self.server = server
+        self.songs: Deque[dict] = deque(maxlen=self.MAX_SIZE)
+        self.requests = 0
+        # 每次清空时递增, 用于丢弃清空前开始的补充结果
+        self._generation = 0
+        self._refill: Optional[asyncio.Task] = None
+
+    @classmethod
+    def of(cls, server: str) -> "SongPool":
+        pool = cls._pools.get(server, None)
+        if pool is None:
+            pool = cls._pools[server] = cls(server)
+        return pool
+
+    def __len__(self):
+        return len(self.songs)
+
+    @staticmethod
+    def _slim(song: dict) -> Optional[dict]:
+        if not song.get("id", None):
+            return None
+        return {
+            "id": song["id"],
+            "title": song.get("title", "未知歌曲"),
+            "duration": song.get("duration", 60),
+        }
+
+    def _start_refill(self, client: Subsonic) -> asyncio.Task:
+        task = self._refill
+        if not task or task.done() or task.get_loop() is not asyncio.get_running_loop():
+            task = self._refill = asyncio.create_task(self._fill(client, self._generation))
+            task.add_done_callback(self._on_filled)
+        return task
+
+    def _on_filled(self, task: asyncio.Task):
+        if not task.cancelled() and task.exception():
+            e = task.exception()
+            logger.debug(f"为服务器 {self.server} 补充歌曲失败: {e.__class__.__name__}: {e}.")
+
+    async def _fill(self, client: Subsonic, generation: int) -> bool:
+        songs: List[dict] = await client.get_random_songs(size=self.RANDOM_SIZE)
+        self.requests += 1
+        if len(songs) < self.LOW_WATER:
+            albums = await client.get_album_list2(type="random", size=self.ALBUM_PAGE)
+            self.requests += 1
+            for album in albums:
+                if album.get("id", None):
+                    songs += (await client.get_album(album["id"])).get("song", [])
+                    self.requests += 1
+        if generation != self._generation:
+            logger.debug(f"服务器 {self.server} 的歌曲池已清空, 丢弃过期的补充结果.")
+            return False
+        known = {s["id"] for s in self.songs}
+        fresh = [s for s in map(self._slim, songs) if s and s["id"] not in known]
+        random.shuffle(fresh)
+        self.songs.extend(fresh)
+        logger.debug(f"已为服务器 {self.server} 补充 {len(fresh)} 首歌曲 (共 {len(self.songs)} 首).")
+        return True
+
+    async def take(self, client: Subsonic) -> Optional[dict]:
+        """取出一首歌曲, 歌曲池为空时等待补充完成."""
+        if len(self.songs) <= self.LOW_WATER:
+            task = self._start_refill(client)
+            # 等待期间歌曲池被清空时, 等待新的补充
+            while not self.songs and not await asyncio.shield(task):
+                task = self._start_refill(client)
+        if not self.songs:
+            return None
+        return self.songs.popleft()
+
+    def invalidate(self):
+        """清空歌曲池, 下次取出时重新获取.
+
+        不取消正在进行的补充, 其他账户可能正在等待; 其结果将被丢弃.
+        """
+        self.songs.clear()
+        self._generation += 1
+        self._refill = None
+
+
 class SubsonicPlayer:
     def __init__(self, account: SubsonicAccount):
         self.a = account
@@ -70,18 +170,15 @@ class SubsonicPlayer:
 
         played_time = 0
         retry = 0
+        pool = SongPool.of(str(self.a.url))
 
         while played_time < req_time:
             try:
-                songs = await client.get_random_songs()
-                if not songs:
+                song = await pool.take(client)
+                if not song:
                     self.log.warning("未能获取到任何歌曲.")
                     return False
-                song = random.choice(songs)
-                song_id = song.get("id", None)
-                if not song_id:
-                    self.log.warning("获取到歌曲信息不完整, 正在重试.")
-                    continue
+                song_id = song["id"]
 
                 song_title = song.get("title", "未知歌曲")
                 song_duration = float(song.get("duration", 60))
@@ -106,6 +203,7 @@ class SubsonicPlayer:
                         self.log.info(f'完成播放 "{song_title}", 已播放 {played_time:.0f} 秒.')
                         break
                     except Exception as e:
+                        pool.invalidate()
                         retry += 1
                         if retry >= config.subsonic.retries:
                             self.log.error(f"播放出错且达到最大重试次数, 停止播放.")
@@ -116,6 +214,7 @@ class SubsonicPlayer:
                         await asyncio.sleep(1)
                         continue
             except Exception as e:
+                pool.invalidate()
                 retry += 1
                 if retry >= config.subsonic.retries:
                     self.log.error(f"播放出错且达到最大重试次数, 停止播放.")
@@ -75,7 +75,7 @@ class CheckinerManager:
 
         # Cancel main account scheduler
         if phone in self._schedulers:
-            del self._schedulers[phone]
+            self._schedulers.pop(phone).cancel()
 
         # Cancel all independent site schedulers for this account
         keys_to_remove = []
@@ -84,7 +84,7 @@ class CheckinerManager:
                 keys_to_remove.append(key)
 
         for key in keys_to_remove:
-            del self._schedulers[key]
+            self._schedulers.pop(key).cancel()
 
     def _has_independent_time_range(self, site_name: str, config_to_use) -> bool:
         """Check if a site has independent time_range configuration"""
@@ -187,6 +187,8 @@ class CheckinerManager:
             on_next_time=on_next_time,
             description=f"{account.phone} 每日签到定时任务",
             sid=f"checkiner.{account.phone}",
+            weight=config_to_use.concurrency,
+            group="proxy" if config.proxy and account.use_proxy else None,
         )
         self._schedulers[account.phone] = scheduler
         return scheduler
@@ -69,6 +69,7 @@ class _PornfansAnswerAnswerMonitor(Monitor):
             finished = True
             m: Message
             for g in to_iterable(self.history_chat_name):
+                answers = {}
                 async for m in self.client.search_messages(g, limit=100, offset=count, query="答案为"):
                     if m.date < to_date:
                         break
@@ -77,7 +78,9 @@ class _PornfansAnswerAnswerMonitor(Monitor):
                     if m.text:
                         for key in _PornfansAnswerResultMonitor.keys(_PornfansAnswerResultMonitor, m):
                             qs += 1
-                            cache.set(f"{QA_CACHE_KEY}.data.{key[0]}", key[5])
+                            answers[f"{QA_CACHE_KEY}.data.{key[0]}"] = key[5]
+                # 每页仅写入一次缓存
+                cache.set_many(answers)
             if count and (finished or count % 500 == 0):
                 self.log.info(f"读取问题答案历史: 已读取 {qs} 问题 / {count} 信息.")
                 await asyncio.sleep(2)
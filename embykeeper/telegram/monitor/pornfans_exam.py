@@ -9,6 +9,7 @@ from pyrogram.errors import MessageIdInvalid
 from PIL import Image
 import numpy as np
 
+from embykeeper.cloudflare import clearances
 from embykeeper.config import config
 from embykeeper.utils import show_exception, get_proxy_str
 
@@ -45,8 +46,6 @@ class _PornfansExamAnswerMonitor(Monitor):
     }
 
     async def use_cfsolver(self):
-        from embykeeper.cloudflare import get_cf_clearance
-
         if self.proxy:
             if self.proxy.scheme != "socks5":
                 self.log.warning(f"站点验证解析仅支持 SOCKS5 代理, 由于当前代理协议不支持, 将尝试不使用代理.")
@@ -57,7 +56,7 @@ class _PornfansExamAnswerMonitor(Monitor):
                     '"use_proxy = false" 以禁用该站点的代理.'
                 )
         try:
-            cf_clearance, useragent = await get_cf_clearance(JAVDATABASE_URL, self.proxy)
+            cf_clearance, useragent = await clearances.solve(JAVDATABASE_URL, self.proxy)
             if not cf_clearance:
                 self.log.warning(f"Cloudflare 验证码解析失败.")
                 return False
@@ -70,35 +69,41 @@ class _PornfansExamAnswerMonitor(Monitor):
             show_exception(e, regular=False)
             return False
 
+    def _session_kw(self):
+        return {
+            "headers": {"User-Agent": self.useragent} if self.useragent else None,
+            "cookies": {"cf_clearance": self.cf_clearance} if self.cf_clearance else None,
+        }
+
     async def init(self):
         self.proxy = config.proxy
-        self.useragent = None
-        self.cf_clearance = None
+        # 优先使用其他实例已保存的验证结果
+        self.cf_clearance, self.useragent = await clearances.get(JAVDATABASE_URL, self.proxy)
+        cf_stored = bool(self.cf_clearance)
         for _ in range(3):
             try:
-                if self.useragent:
-                    headers = {"User-Agent": self.useragent}
-                else:
-                    headers = None
-                if self.cf_clearance:
-                    cookies = {"cf_clearance": self.cf_clearance}
-                else:
-                    cookies = None
                 async with AsyncSession(
                     proxy=get_proxy_str(self.proxy, curl=True),
                     impersonate="chrome",
                     timeout=10.0,
                     allow_redirects=True,
-                    headers=headers,
-                    cookies=cookies,
+                    **self._session_kw(),
                 ) as session:
                     resp: Response = await session.get(JAVDATABASE_URL)
                     if resp.status_code == 403 and (
                         "cf-wrapper" in resp.text or "Just a moment" in resp.text
                     ):
                         if self.cf_clearance:
-                            self.log.warning("初始化失败: Javdatabase 在 Cloudflare 验证码解析后依然有验证")
-                            return False
+                            if not cf_stored:
+                                self.log.warning(
+                                    "初始化失败: Javdatabase 在 Cloudflare 验证码解析后依然有验证"
+                                )
+                                return False
+                            await clearances.invalidate(
+                                JAVDATABASE_URL, self.proxy, cf_clearance=self.cf_clearance
+                            )
+                            self.cf_clearance = self.useragent = None
+                            cf_stored = False
                         self.log.info("Javdatabase 存在 Cloudflare 保护, 正在尝试解析.")
                         await self.use_cfsolver()
                         continue
@@ -124,6 +129,7 @@ class _PornfansExamAnswerMonitor(Monitor):
                     impersonate="chrome",
                     timeout=10.0,
                     allow_redirects=True,
+                    **self._session_kw(),
                 ) as session:
                     detail_url = f"{JAVDATABASE_URL}/movies/{code.lower()}/"
                     resp: Response = await session.get(detail_url)
@@ -6,18 +6,20 @@ from contextlib import asynccontextmanager
 from datetime import datetime
 import asyncio
 import inspect
+import itertools
 import os
 from pathlib import Path
 import sqlite3
 import struct
 import tempfile
-from typing import Union
+import time
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 
 from rich.prompt import Prompt
 from loguru import logger
 import pyrogram
-from pyrogram import raw, types, filters, dispatcher
+from pyrogram import raw, types, filters, dispatcher, utils
 from pyrogram.enums import SentCodeType
 from pyrogram.errors import (
     BadRequest,
@@ -67,12 +69,172 @@ for h in pyrogram_session_logger.handlers[:]:
 pyrogram_session_logger.addHandler(LogRedirector())
 
 
+def chat_scope(flt) -> Optional[frozenset]:
+    """返回过滤器所限定的会话 (ID 或小写用户名), 不限定会话时返回 None."""
+    if isinstance(flt, filters.chat):
+        # "me" 匹配发送者而非会话, 无法建立索引
+        return None if "me" in flt else frozenset(flt)
+    elif isinstance(flt, filters.AndFilter):
+        scopes = [s for s in (chat_scope(flt.base), chat_scope(flt.other)) if s is not None]
+        return min(scopes, key=len) if scopes else None
+    elif isinstance(flt, filters.OrFilter):
+        base, other = chat_scope(flt.base), chat_scope(flt.other)
+        return base | other if base is not None and other is not None else None
+    else:
+        return None
+
+
+class HandlerIndex:
+    """更新处理器表的不可变快照及其路由索引.
+
+    按处理器类型与会话对各组的处理器建立索引, 使消息仅需检查限定了该会话的处理器以及未限定会话的处理器.
+    索引在注册处理器时根据其过滤器建立, 注册后再修改过滤器中的会话不会生效.
+    快照创建后不再修改 (仅按需缓存路由), 处理器变更时整体替换, 因此读取时无需加锁或复制.
+    """
+
+    # 更新为消息对象, 可以按会话路由的处理器类型
+    SCOPED = (MessageHandler, EditedMessageHandler)
+
+    def __init__(self, groups: Dict[int, Tuple[Handler, ...]]):
+        self.groups = [tuple(g) for g in groups.values()]
+        self.scopes = {h: chat_scope(h.filters) for g in self.groups for h in g if isinstance(h, self.SCOPED)}
+        self._routes: Dict[type, list] = {}
+
+    def _build(self, handler_type: type):
+        routes = []
+        for handlers in self.groups:
+            scoped: Dict[Union[int, str], List[int]] = {}
+            fallback: List[int] = []
+            for i, h in enumerate(handlers):
+                if isinstance(h, handler_type):
+                    scope = self.scopes.get(h, None)
+                    if scope is None:
+                        fallback.append(i)
+                    else:
+                        for key in scope:
+                            scoped.setdefault(key, []).append(i)
+                elif isinstance(h, RawUpdateHandler):
+                    fallback.append(i)
+            if scoped or fallback:
+                routes.append((handlers, scoped, fallback))
+        return routes
+
+    def candidates(self, handler_type: type, update) -> List[Tuple[Handler, ...]]:
+        """按组的顺序返回各组中需要检查的处理器."""
+        routes = self._routes.get(handler_type, None)
+        if routes is None:
+            routes = self._routes[handler_type] = self._build(handler_type)
+        keys = []
+        if issubclass(handler_type, self.SCOPED):
+            chat = getattr(update, "chat", None)
+            if chat:
+                keys.append(chat.id)
+                if chat.username:
+                    keys.append(chat.username.lower())
+        result = []
+        for handlers, scoped, fallback in routes:
+            hits = [scoped[k] for k in keys if k in scoped]
+            if not hits:
+                if fallback:
+                    result.append([handlers[i] for i in fallback])
+                continue
+            positions = sorted(set(fallback).union(*hits))
+            result.append([handlers[i] for i in positions])
+        return result
+
+
+def update_chat_id(update) -> Optional[int]:
+    """从原始更新中获取其所属会话的 ID, 无法确定时返回 None."""
+    message = getattr(update, "message", None)
+    peer = getattr(message, "peer_id", None) or getattr(update, "peer", None)
+    if peer is not None:
+        return utils.get_peer_id(peer)
+    channel_id = getattr(update, "channel_id", None)
+    if channel_id:
+        return utils.get_channel_id(channel_id)
+    return None
+
+
+class UpdateShard(asyncio.Queue):
+    """更新队列的一个分片, 记录排队深度与等待时间."""
+
+    def __init__(self):
+        super().__init__()
+        self.peak = 0
+        self.processed = 0
+        self.waited = 0.0
+        self.max_wait = 0.0
+
+    def put_nowait(self, packet):
+        super().put_nowait((time.monotonic(), packet))
+        self.peak = max(self.peak, self.qsize())
+
+    def record(self, enqueued: float):
+        wait = time.monotonic() - enqueued
+        self.processed += 1
+        self.waited += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def oldest(self) -> float:
+        """返回队列中最早的更新已等待的秒数."""
+        return time.monotonic() - self._queue[0][0] if self._queue else 0.0
+
+    def stats(self) -> dict:
+        return {
+            "depth": self.qsize(),
+            "peak": self.peak,
+            "processed": self.processed,
+            "wait_avg": self.waited / self.processed if self.processed else 0.0,
+            "wait_max": self.max_wait,
+            "oldest": self.oldest(),
+        }
+
+
+class ShardedUpdateQueue:
+    """按会话分片的更新队列.
+
+    同一会话的更新总是进入同一分片并按顺序处理, 不同会话的更新可在各分片中并行处理.
+    无法确定会话的更新轮流分配到各分片.
+    """
+
+    def __init__(self, shards: int):
+        self.shards = [UpdateShard() for _ in range(shards)]
+        self._next = itertools.cycle(range(shards))
+
+    def shard_of(self, packet) -> int:
+        chat_id = update_chat_id(packet[0])
+        if chat_id is None:
+            return next(self._next)
+        return hash(chat_id) % len(self.shards)
+
+    def put_nowait(self, packet):
+        self.shards[self.shard_of(packet)].put_nowait(packet)
+
+    def close(self):
+        for shard in self.shards:
+            shard.put_nowait(None)
+
+    def qsize(self) -> int:
+        return sum(s.qsize() for s in self.shards)
+
+    def oldest(self) -> float:
+        return max((s.oldest() for s in self.shards), default=0.0)
+
+    def stats(self) -> List[dict]:
+        return [s.stats() for s in self.shards]
+
+
 class Dispatcher(dispatcher.Dispatcher):
     updates_count = 0
 
+    # 回调函数运行超过该时长 (秒) 后转入后台执行, 以免阻塞同一分片中的后续更新
+    HANDOFF_AFTER = 2
+
     def __init__(self, client: Client):
         super().__init__(client)
-        self.mutex = asyncio.Lock()
+        self.index = HandlerIndex(self.groups)
+        self.updates_queue = ShardedUpdateQueue(client.workers)
+        self.handoff_tasks = set()
 
     async def start(self):
         phone_masked = TelegramAccount.get_phone_masked(self.client.phone_number)
@@ -86,8 +248,8 @@ class Dispatcher(dispatcher.Dispatcher):
                 logger.error("Telegram 更新分配器启动错误.")
 
         if not self.client.no_updates:
-            for _ in range(self.client.workers):
-                self.handler_worker_tasks.append(self.client.loop.create_task(self.handler_worker()))
+            for shard in self.updates_queue.shards:
+                self.handler_worker_tasks.append(self.client.loop.create_task(self.handler_worker(shard)))
 
             if not self.client.skip_updates:
                 await self.client.recover_gaps()
@@ -106,10 +268,9 @@ class Dispatcher(dispatcher.Dispatcher):
                 logger.error("Telegram 更新分配器停止错误.")
 
         if not self.client.no_updates:
-            for i in range(self.client.workers):
-                self.updates_queue.put_nowait(None)
+            self.updates_queue.close()
 
-            for i in self.handler_worker_tasks:
+            for i in [*self.handler_worker_tasks, *self.handoff_tasks]:
                 i.cancel()
                 try:
                     await i
@@ -117,39 +278,93 @@ class Dispatcher(dispatcher.Dispatcher):
                     pass
             if clear_handlers:
                 self.handler_worker_tasks.clear()
-                self.groups.clear()
+                self._replace(OrderedDict())
 
         logger.debug(f'Telegram 更新分配器已停止: "{phone_masked}".')
 
-    def add_handler(self, handler, group: int):
-        async def fn():
-            async with self.mutex:
-                if group not in self.groups:
-                    self.groups[group] = []
-                    self.groups = OrderedDict(sorted(self.groups.items()))
-                self.groups[group].append(handler)
-                # logger.debug(f"增加了 Telegram 更新处理器: {handler.__class__.__name__}.")
+    def _replace(self, groups: OrderedDict):
+        """以新的处理器表替换当前快照, 工作协程此后读取的均为新快照."""
+        self.groups = groups
+        self.index = HandlerIndex(groups)
+
+    def _done(self, exc: Exception = None) -> asyncio.Future:
+        future = self.client.loop.create_future()
+        if exc:
+            future.set_exception(exc)
+        else:
+            future.set_result(None)
+        return future
 
-        return self.client.loop.create_task(fn())
+    def add_handler(self, handler, group: int):
+        groups = OrderedDict(self.groups)
+        groups[group] = (*groups.get(group, ()), handler)
+        self._replace(OrderedDict(sorted(groups.items())))
+        # logger.debug(f"增加了 Telegram 更新处理器: {handler.__class__.__name__}.")
+        return self._done()
 
     def remove_handler(self, handler, group: int):
-        async def fn():
-            async with self.mutex:
-                if group not in self.groups:
-                    raise ValueError(f"Group {group} does not exist. Handler was not removed.")
-                self.groups[group].remove(handler)
-                # logger.debug(f"移除了 Telegram 更新处理器: {handler.__class__.__name__}.")
+        if group not in self.groups:
+            return self._done(ValueError(f"Group {group} does not exist. Handler was not removed."))
+        handlers = list(self.groups[group])
+        try:
+            handlers.remove(handler)
+        except ValueError as e:
+            return self._done(e)
+        groups = OrderedDict(self.groups)
+        groups[group] = tuple(handlers)
+        self._replace(groups)
+        # logger.debug(f"移除了 Telegram 更新处理器: {handler.__class__.__name__}.")
+        return self._done()
+
+    def stats(self) -> dict:
+        """返回各分片的队列深度与等待时间, 以及正在后台执行的回调数."""
+        return {"shards": self.updates_queue.stats(), "handoff": len(self.handoff_tasks)}
+
+    def _handoff(self, future: asyncio.Future):
+        def done(f: asyncio.Future):
+            self.handoff_tasks.discard(f)
+            if f.cancelled():
+                return
+            e = f.exception()
+            if e and not isinstance(e, (pyrogram.StopPropagation, pyrogram.ContinuePropagation)):
+                logger.error(f"更新回调函数内发生错误.")
+                show_exception(e, regular=False)
+
+        self.handoff_tasks.add(future)
+        future.add_done_callback(done)
 
-        return self.client.loop.create_task(fn())
+    async def _invoke(self, handler: Handler, args: tuple):
+        """执行回调函数.
 
-    async def handler_worker(self):
+        运行超过 HANDOFF_AFTER 秒的回调函数 (例如识别验证码或调用语言模型) 将转入后台继续执行, 分片开始处理后续更新.
+        此时视为该更新已被处理, 不再传递给后续分组. 同一会话的顺序仅保证到转入后台为止: 回调函数可能正在等待
+        同一会话的后续消息 (如等待回复或键盘), 因此后续更新不会等待其完成.
+        """
+        if inspect.iscoroutinefunction(handler.callback):
+            future = asyncio.ensure_future(handler.callback(self.client, *args))
+        else:
+            future = self.client.loop.run_in_executor(
+                self.client.executor, handler.callback, self.client, *args
+            )
+        try:
+            done, _ = await asyncio.wait({future}, timeout=self.HANDOFF_AFTER)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        if done:
+            return future.result()
+        self._handoff(future)
+
+    async def handler_worker(self, shard: UpdateShard):
         while True:
-            packet = await self.updates_queue.get()
+            enqueued, packet = await shard.get()
             Dispatcher.updates_count += 1
 
             if packet is None:
                 break
 
+            shard.record(enqueued)
+
             try:
                 update, users, chats = packet
                 parser = self.update_parsers.get(type(update), None)
@@ -163,10 +378,7 @@ class Dispatcher(dispatcher.Dispatcher):
                     show_exception(e, regular=False)
                     continue
 
-                async with self.mutex:
-                    groups = {i: g[:] for i, g in self.groups.items()}
-
-                for group in groups.values():
+                for group in self.index.candidates(handler_type, parsed_update):
                     for handler in group:
                         args = None
 
@@ -192,12 +404,7 @@ class Dispatcher(dispatcher.Dispatcher):
                             continue
 
                         try:
-                            if inspect.iscoroutinefunction(handler.callback):
-                                await handler.callback(self.client, *args)
-                            else:
-                                await self.client.loop.run_in_executor(
-                                    self.client.executor, handler.callback, self.client, *args
-                                )
+                            await self._invoke(handler, args)
                         except pyrogram.StopPropagation:
                             raise
                         except pyrogram.ContinuePropagation:
@@ -321,14 +321,14 @@ class ClientsSession:
                     session_str_src = "session"
                 else:
                     session_str_key = f"telegram.session_str.{account.get_config_key()}"
-                    session_str = cache.get(session_str_key)
+                    session_str = await cache.aget(session_str_key)
                     if session_str:
                         session_str_src = "cache"
                 old_login_file = config.basedir / f"{account.phone}.login"
                 if not session_str and old_login_file.exists():
                     try:
                         session_str = old_login_file.read_text().strip()
-                        cache.set(session_str_key, session_str)
+                        await cache.aset(session_str_key, session_str)
                         old_login_file.unlink()
                         session_str_src = "cache"
                         logger.info(f'从旧版本登录文件迁移账号 "{phone_masked}" 的登录凭据至缓存.')
@@ -400,7 +400,7 @@ class ClientsSession:
                     else:
                         session_str = await client.export_session_string()
                         session_str_key = f"telegram.session_str.{account.get_config_key()}"
-                        cache.set(session_str_key, session_str)
+                        await cache.aset(session_str_key, session_str)
                         client.disconnect_handler = self._disconnect_handler
                         client.connect_handler = self._connect_handler
                         client._skip_auth = getattr(account, "skip_auth", False)
@@ -423,7 +423,7 @@ class ClientsSession:
                     elif session_str_src == "cache":
                         logger.error(f'账号 "{phone_masked}" 已被注销, 将在 3 秒后重新登录.')
                         show_exception(e)
-                        cache.delete(session_str_key)
+                        await cache.adelete(session_str_key)
                         await asyncio.sleep(3)
                         continue
                     else:
@@ -42,14 +42,18 @@ async def topper():
                 if hasattr(client, "dispatcher"):
                     try:
                         qsize = client.dispatcher.updates_queue.qsize()
+                        oldest = client.dispatcher.updates_queue.oldest()
                         tasks = client.dispatcher.handler_worker_tasks
                         active = sum(1 for t in tasks if t.get_coro().cr_await.__name__ != "get")
                         if qsize > 0 or active > 0:
-                            # 当队列超过10或handler使用率超过80%时显示红色
-                            if qsize >= 10 or (active / len(tasks) >= 0.8):
-                                queue_stats.append(f"[red][{qsize}:{active}/{len(tasks)}][/red]")
+                            stat = f"{qsize}:{active}/{len(tasks)}"
+                            if oldest >= 1:
+                                stat += f" {oldest:.0f}s"
+                            # 当队列超过10, handler使用率超过80%或更新等待超过10秒时显示红色
+                            if qsize >= 10 or (active / len(tasks) >= 0.8) or oldest >= 10:
+                                queue_stats.append(f"[red][{stat}][/red]")
                             else:
-                                queue_stats.append(f"[{qsize}:{active}/{len(tasks)}]")
+                                queue_stats.append(f"[{stat}]")
                     except:
                         queue_stats.append("[Error]")
 
@@ -0,0 +1,67 @@
+import asyncio
+
+import embykeeper.bandwidth as bandwidth_module
+from embykeeper.bandwidth import BandwidthGovernor, TokenBucket
+
+
+def test_token_bucket_reserves_against_theoretical_arrival_time(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(bandwidth_module.time, "monotonic", lambda: now[0])
+    bucket = TokenBucket(1024)
+    assert bucket.reserve(1024) == 0
+    assert bucket.reserve(1024) == 1
+    now[0] += 10
+    assert bucket.reserve(2048) == 1
+
+    paced = TokenBucket(1024, burst=0)
+    assert paced.reserve(4096) == 4
+
+
+def make_governor(monkeypatch, **limits):
+    governor = BandwidthGovernor()
+    limits = {"session": 4, "report_interval": 600, **limits}
+    monkeypatch.setattr(governor, "_limit", lambda name: limits.get(name) and limits[name] * 1024)
+    return governor
+
+
+def test_governor_splits_budgets_fairly(monkeypatch):
+    governor = make_governor(monkeypatch, server=6, proxy=4)
+
+    async def main():
+        a = governor.open("a", "https://a.example.com", "socks5://proxy")
+        b = governor.open("b", "https://a.example.com")
+        c = governor.open("c", "https://b.example.com", "socks5://proxy")
+        assert a.recv_speed == 2 * 1024
+        assert b.recv_speed == 3 * 1024
+        assert c.recv_speed == 2 * 1024
+        c.close()
+        assert a.recv_speed == 3 * 1024
+        a.close()
+        b.close()
+        assert governor._counts == {} and governor._buckets == {}
+
+    asyncio.run(main())
+
+
+def test_flow_waits_once_per_chunk_and_reports_throughput(monkeypatch):
+    governor = make_governor(monkeypatch, total=2)
+    waits = []
+    sleep = asyncio.sleep
+
+    async def fake_sleep(delay):
+        if delay != 600:
+            waits.append(delay)
+        await sleep(0)
+
+    async def main():
+        monkeypatch.setattr(bandwidth_module.asyncio, "sleep", fake_sleep)
+        async with governor.open("song", "https://a.example.com") as flow:
+            for _ in range(64):
+                await flow.consume(1024)
+            assert governor.stats()["flows"]["song"] > 0
+
+    asyncio.run(main())
+    # 每 16 KiB 等待一次, 总预算 2 KiB/s 低于单流的 4 KiB/s
+    assert len(waits) == 4
+    assert waits[-1] > 4
+    assert governor.received == 64 * 1024
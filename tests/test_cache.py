@@ -0,0 +1,440 @@
+import asyncio
+import json
+import os
+import threading
+
+import pymongo
+
+from embykeeper.cache import (
+    Cache,
+    JSONCacheBackend,
+    MongoCacheBackend,
+    SQLiteCacheBackend,
+    WriteBehindBackend,
+)
+
+
+def make_cache(tmp_path, **kw):
+    return Cache(JSONCacheBackend(tmp_path / "cache.json", **kw))
+
+
+def test_json_backend_appends_journal_instead_of_rewriting_snapshot(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("emby.env.example.tester", {"client": "Fileball"})
+    cache.set("scheduler.global", {"next_time": "2024-01-01T00:00:00"})
+
+    assert not (tmp_path / "cache.json").exists()
+    lines = (tmp_path / "cache.json.journal").read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 2
+    assert cache.get("emby.env.example.tester") == {"client": "Fileball"}
+
+
+def test_json_backend_replays_journal_on_startup(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("runinfo.AAA", "a")
+    cache.set("runinfo.BBB", "b")
+    cache.delete("runinfo.AAA")
+
+    reloaded = make_cache(tmp_path)
+    assert reloaded.get("runinfo.AAA") is None
+    assert reloaded.get("runinfo.BBB") == "b"
+    assert reloaded.find_by_prefix("runinfo") == ["runinfo.BBB"]
+
+    # 重放后日志被合并回快照
+    assert (tmp_path / "cache.json.journal").read_text(encoding="utf-8") == ""
+    assert json.loads((tmp_path / "cache.json").read_text(encoding="utf-8")) == {"runinfo": {"BBB": "b"}}
+
+
+def test_json_backend_ignores_torn_journal_record(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("a.b", 1)
+    with open(tmp_path / "cache.json.journal", "a", encoding="utf-8") as f:
+        f.write('["s", "a.c", {"unfinish')
+
+    reloaded = make_cache(tmp_path)
+    assert reloaded.get("a.b") == 1
+    assert reloaded.get("a.c") is None
+
+
+def test_json_backend_compacts_when_journal_grows(tmp_path):
+    cache = make_cache(tmp_path, compact_min_size=256)
+    for i in range(20):
+        cache.set(f"scheduler.site{i}", {"next_time": "x" * 20})
+
+    assert json.loads((tmp_path / "cache.json").read_text(encoding="utf-8"))["scheduler"]
+    assert (tmp_path / "cache.json.journal").stat().st_size < 256
+    assert len(make_cache(tmp_path).find_by_prefix("scheduler")) == 20
+
+
+def test_json_backend_writes_snapshot_outside_lock(tmp_path, monkeypatch):
+    import embykeeper.cache as cache_module
+
+    backend = JSONCacheBackend(tmp_path / "cache.json", compact_min_size=256)
+    reads = []
+    fsync = os.fsync
+
+    def slow_fsync(fd):
+        # 写入快照期间, 其他线程的读写不应被阻塞
+        t = threading.Thread(target=lambda: reads.append(backend.get("scheduler.site0")))
+        t.start()
+        t.join(timeout=2)
+        fsync(fd)
+
+    monkeypatch.setattr(cache_module.os, "fsync", slow_fsync)
+    for i in range(20):
+        backend.set(f"scheduler.site{i}", {"next_time": "x" * 20})
+
+    assert reads and reads[0] == {"next_time": "x" * 20}
+    assert not (tmp_path / "cache.json.journal.old").exists()
+    assert len(JSONCacheBackend(tmp_path / "cache.json").find_by_prefix("scheduler")) == 20
+
+
+def test_json_backend_write_succeeds_when_compaction_fails(tmp_path, monkeypatch):
+    import embykeeper.cache as cache_module
+
+    backend = JSONCacheBackend(tmp_path / "cache.json", compact_min_size=256)
+    fsync = os.fsync
+    failing = [True]
+
+    def flaky_fsync(fd):
+        if failing[0]:
+            raise OSError("disk full")
+        fsync(fd)
+
+    monkeypatch.setattr(cache_module.os, "fsync", flaky_fsync)
+    for i in range(20):
+        backend.set(f"scheduler.site{i}", {"next_time": "x" * 20})
+    assert backend._compact_due
+
+    # 下次写入时重试合并
+    failing[0] = False
+    backend.set("scheduler.site20", {"next_time": "x" * 20})
+    assert not backend._compact_due
+    assert not (tmp_path / "cache.json.journal.old").exists()
+    assert len(JSONCacheBackend(tmp_path / "cache.json").find_by_prefix("scheduler")) == 21
+
+
+def test_json_backend_replays_unfinished_compaction(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("runinfo.AAA", "a")
+    cache.set("runinfo.BBB", "b")
+    # 模拟合并时轮换了日志, 但快照写入完成前崩溃
+    os.replace(tmp_path / "cache.json.journal", tmp_path / "cache.json.journal.old")
+    with open(tmp_path / "cache.json.journal", "w", encoding="utf-8") as f:
+        f.write(json.dumps(["d", "runinfo.AAA"]) + "\n")
+
+    reloaded = make_cache(tmp_path)
+    assert reloaded.get("runinfo.AAA") is None
+    assert reloaded.get("runinfo.BBB") == "b"
+    assert not (tmp_path / "cache.json.journal.old").exists()
+
+
+def test_json_backend_delete_cleans_empty_parents(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.set("emby.credential.host.user", {"token": "t"})
+    cache.delete_many(["emby.credential.host.user"])
+    cache.compact()
+
+    assert json.loads((tmp_path / "cache.json").read_text(encoding="utf-8")) == {}
+
+
+def test_sqlite_backend_roundtrip_and_prefix_scan(tmp_path):
+    cache = Cache(SQLiteCacheBackend(tmp_path / "cache.db"))
+    cache.set("runinfo.AAA", '{"id": "AAA"}')
+    cache.set("runinfo.children.AAA", ["BBB"])
+    cache.set("runinfo-other", 1)
+    cache.set("scheduler.global", {"next_time": "2024-01-01T00:00:00"})
+
+    assert cache.get("runinfo.children.AAA") == ["BBB"]
+    assert cache.get("missing", "default") == "default"
+    assert cache.find_by_prefix("runinfo.") == ["runinfo.AAA", "runinfo.children.AAA"]
+    assert len(cache.find_by_prefix("")) == 4
+
+    cache.delete_by_prefix("runinfo.")
+    cache.delete("scheduler.global")
+    assert Cache(SQLiteCacheBackend(tmp_path / "cache.db")).find_by_prefix("") == ["runinfo-other"]
+
+
+class RecordingBackend(SQLiteCacheBackend):
+    def __init__(self, path):
+        super().__init__(path)
+        self.batches = []
+
+    def write_batch(self, sets, deletes, expires=None):
+        self.batches.append((dict(sets), list(deletes)))
+        super().write_batch(sets, deletes, expires)
+
+
+def test_write_behind_coalesces_repeated_writes(tmp_path):
+    backend = RecordingBackend(tmp_path / "cache.db")
+
+    async def main():
+        cache = Cache(WriteBehindBackend(backend, interval=0.05))
+        for i in range(100):
+            cache.set("runinfo.children.AAA", list(range(i + 1)))
+        cache.set("scheduler.global", {"next_time": "x"})
+        cache.delete("scheduler.global")
+
+        assert backend.batches == []
+        assert len(cache.get("runinfo.children.AAA")) == 100
+        assert cache.get("scheduler.global") is None
+        assert cache.find_by_prefix("runinfo") == ["runinfo.children.AAA"]
+        await asyncio.sleep(0.1)
+
+    asyncio.run(main())
+    assert len(backend.batches) == 1
+    assert backend.get("runinfo.children.AAA") == list(range(100))
+
+
+def test_write_behind_flushes_on_size_threshold_and_explicitly(tmp_path):
+    backend = RecordingBackend(tmp_path / "cache.db")
+
+    async def main():
+        cache = Cache(WriteBehindBackend(backend, interval=60, max_pending=10))
+        for i in range(25):
+            cache.set(f"scheduler.site{i}", i)
+        assert len(backend.batches) == 2
+        cache.flush()
+        assert len(backend.batches) == 3
+
+    asyncio.run(main())
+    assert len(backend.find_by_prefix("scheduler.")) == 25
+
+
+class FailingBackend(RecordingBackend):
+    def __init__(self, path):
+        super().__init__(path)
+        self.down = True
+        self.attempts = 0
+
+    def write_batch(self, sets, deletes, expires=None):
+        self.attempts += 1
+        if self.down:
+            raise ConnectionError("backend is down")
+        super().write_batch(sets, deletes, expires)
+
+
+def test_write_behind_drops_failed_batch_outside_loop(tmp_path):
+    backend = FailingBackend(tmp_path / "cache.db")
+    cache = Cache(WriteBehindBackend(backend, interval=60, max_pending=1))
+    for i in range(5):
+        cache.set(f"scheduler.site{i}", i)
+    cache.flush()
+    assert backend.attempts == 5
+    assert cache.get("scheduler.site0") is None
+
+
+def test_write_behind_retries_with_backoff_in_loop(tmp_path):
+    backend = FailingBackend(tmp_path / "cache.db")
+
+    async def main():
+        cache = Cache(WriteBehindBackend(backend, interval=0.01, max_pending=2))
+        for i in range(10):
+            cache.set(f"scheduler.site{i}", i)
+        # 失败后不再随每次写入同步重试
+        assert backend.attempts == 1
+        assert cache.get("scheduler.site9") == 9
+        backend.down = False
+        await asyncio.sleep(0.05)
+        assert backend.attempts == 2
+
+    asyncio.run(main())
+    assert len(backend.find_by_prefix("scheduler.")) == 10
+
+
+def test_write_behind_reads_in_flight_batch_from_other_threads(tmp_path):
+    started, resume = threading.Event(), threading.Event()
+
+    class SlowBackend(RecordingBackend):
+        def write_batch(self, sets, deletes, expires=None):
+            started.set()
+            resume.wait(1)
+            super().write_batch(sets, deletes, expires)
+
+    backend = SlowBackend(tmp_path / "cache.db")
+    wb = WriteBehindBackend(backend, interval=60)
+    keys = [f"scheduler.site{i}" for i in range(10)]
+
+    async def main():
+        for i, key in enumerate(keys):
+            wb.set(key, i)
+        # 在线程池中写入底层存储, 期间在事件循环中读取并继续写入
+        flushing = asyncio.get_running_loop().run_in_executor(None, wb.flush)
+        assert started.wait(1)
+        assert sorted(wb.find_by_prefix("scheduler.")) == sorted(keys)
+        assert wb.get_many(keys) == {k: i for i, k in enumerate(keys)}
+        wb.set("scheduler.site10", 10)
+        resume.set()
+        await flushing
+
+    asyncio.run(main())
+    assert wb.get("scheduler.site10") == 10
+    assert len(backend.find_by_prefix("scheduler.")) == 10
+
+
+class FakeCollection:
+    def __init__(self):
+        self.docs = {}
+        self.reads = 0
+
+    def create_index(self, *args, **kw):
+        pass
+
+    def find_one(self, query):
+        self.reads += 1
+        key = query["_id"]
+        return {"_id": key, "value": self.docs[key]} if key in self.docs else None
+
+    def update_one(self, query, update, upsert=False):
+        self.docs[query["_id"]] = update["$set"]["value"]
+
+    def delete_one(self, query):
+        self.docs.pop(query["_id"], None)
+
+
+def make_mongo_backend(monkeypatch, **kw):
+    collection = FakeCollection()
+    client = type("FakeClient", (), {"embykeeper": type("FakeDB", (), {"cache": collection})()})()
+    monkeypatch.setattr(pymongo, "MongoClient", lambda url: client)
+    return MongoCacheBackend("mongodb://localhost", **kw), collection
+
+
+def test_mongo_backend_serves_reads_from_lru(monkeypatch):
+    backend, collection = make_mongo_backend(monkeypatch, lru_ttl=3600)
+    backend.set("emby.env.host.user", {"client": "Fileball"})
+
+    for _ in range(5):
+        value = backend.get("emby.env.host.user")
+        value["client"] = "changed"
+    assert backend.get("missing") is None
+    assert backend.get("missing", "default") == "default"
+
+    assert collection.reads == 1
+    assert backend.stats() == {"hits": 6, "misses": 1, "size": 2}
+    assert backend.get("emby.env.host.user") == {"client": "Fileball"}
+
+    backend.delete("emby.env.host.user")
+    assert backend.get("emby.env.host.user") is None
+    assert collection.reads == 1
+
+
+def test_mongo_backend_lru_is_off_by_default_and_skips_shared_keys(monkeypatch):
+    backend, collection = make_mongo_backend(monkeypatch)
+    backend.set("emby.env.host.user", {"client": "Fileball"})
+    backend.get("emby.env.host.user")
+    assert collection.reads == 1
+    assert backend.stats()["size"] == 0
+
+    # 其他进程对 "config" 的写入应当立即可见
+    backend, collection = make_mongo_backend(monkeypatch, lru_ttl=3600)
+    backend.set("config", {"telegram": {}})
+    collection.docs["config"] = {"telegram": {"account": [{"session": "new"}]}}
+    assert backend.get("config") == {"telegram": {"account": [{"session": "new"}]}}
+
+
+def test_mongo_backend_lru_can_be_disabled(monkeypatch):
+    backend, collection = make_mongo_backend(monkeypatch, lru_size=0)
+    backend.set("a", 1)
+    assert backend.get("a") == 1
+    assert backend.get("a") == 1
+    assert collection.reads == 2
+
+
+def test_async_api_offloads_local_backends(tmp_path):
+    async def main():
+        for cache in (make_cache(tmp_path), Cache(SQLiteCacheBackend(tmp_path / "cache.db"))):
+            await asyncio.gather(*(cache.aset(f"scheduler.site{i}", {"n": i}) for i in range(20)))
+            assert await cache.aget("scheduler.site3") == {"n": 3}
+            await cache.adelete("scheduler.site3")
+            assert await cache.aget("scheduler.site3", "default") == "default"
+            assert len(cache.find_by_prefix("scheduler.")) == 19
+
+    asyncio.run(main())
+
+
+def test_async_api_reads_write_behind_buffer(tmp_path):
+    backend = RecordingBackend(tmp_path / "cache.db")
+
+    async def main():
+        cache = Cache(WriteBehindBackend(backend, interval=60))
+        await cache.aset("runinfo.AAA", "a")
+        assert await cache.aget("runinfo.AAA") == "a"
+        await cache.adelete("runinfo.AAA")
+        assert await cache.aget("runinfo.AAA") is None
+        assert backend.batches == []
+
+    asyncio.run(main())
+
+
+def test_ttl_expires_keys_on_local_backends(tmp_path, monkeypatch):
+    import embykeeper.cache as cache_module
+
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    for cache in (make_cache(tmp_path), Cache(SQLiteCacheBackend(tmp_path / "cache.db"))):
+        cache.set("runinfo.AAA", "a", ttl=60)
+        cache.set("runinfo.BBB", "b")
+        assert cache.get("runinfo.AAA") == "a"
+
+        now[0] += 61
+        assert cache.get("runinfo.AAA") is None
+        assert cache.find_by_prefix("runinfo.") == ["runinfo.BBB"]
+        assert asyncio.run(cache.sweep()) >= 0
+        assert cache._storage.expire() == 0
+        now[0] -= 61
+
+
+def test_sweeper_is_kept_and_stopped_on_exit(tmp_path):
+    cache = make_cache(tmp_path)
+
+    async def main():
+        task = cache.start_sweeper(3600)
+        assert cache.start_sweeper(3600) is task
+        await asyncio.sleep(0.01)
+        await cache._exit_handler()
+        assert task.cancelled()
+
+    asyncio.run(main())
+
+
+def test_json_backend_persists_expiry(tmp_path, monkeypatch):
+    import embykeeper.cache as cache_module
+
+    now = [1000.0]
+    monkeypatch.setattr(cache_module.time, "time", lambda: now[0])
+    cache = make_cache(tmp_path)
+    cache.set("runinfo.AAA", "a", ttl=60)
+    cache.set("runinfo.BBB", "b")
+
+    reloaded = make_cache(tmp_path)
+    assert json.loads((tmp_path / "cache.json").read_text(encoding="utf-8"))["_expires"] == {
+        "runinfo.AAA": 1060.0
+    }
+    assert reloaded.get("runinfo.AAA") == "a"
+
+    now[0] += 61
+    asyncio.run(reloaded.sweep())
+    assert json.loads((tmp_path / "cache.json").read_text(encoding="utf-8")) == {"runinfo": {"BBB": "b"}}
+
+
+def test_bulk_set_and_get_many(tmp_path):
+    items = {f"monitor.pornfans.answer.qa.data.q{i}": f"a{i}" for i in range(1200)}
+    for cache in (make_cache(tmp_path), Cache(SQLiteCacheBackend(tmp_path / "cache.db"))):
+        cache.set_many(items)
+        keys = list(items) + ["monitor.pornfans.answer.qa.data.missing"]
+        assert cache.get_many(keys) == items
+        cache.delete_many(list(items)[:1000])
+        assert len(cache.get_many(keys)) == 200
+
+
+def test_mongo_backend_get_many_uses_lru(monkeypatch):
+    backend, collection = make_mongo_backend(monkeypatch, lru_ttl=3600)
+    collection.docs["b"] = 2
+    collection.find = lambda query: [
+        {"_id": k, "value": collection.docs[k]} for k in query["_id"]["$in"] if k in collection.docs
+    ]
+    backend.set("a", [1])
+    assert backend.get_many(["a", "b", "c"]) == {"a": [1], "b": 2}
+    assert backend.stats()["misses"] == 2
+    assert backend.get_many(["a", "b", "c"]) == {"a": [1], "b": 2}
+    assert backend.stats()["hits"] == 4
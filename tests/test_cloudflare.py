@@ -0,0 +1,77 @@
+import asyncio
+
+import pytest
+
+import embykeeper.cloudflare as cloudflare_module
+from embykeeper.cache import Cache, JSONCacheBackend
+from embykeeper.cloudflare import ClearanceStore
+
+
+@pytest.fixture
+def solver(tmp_path, monkeypatch):
+    calls = []
+
+    async def fake_get_cf_clearance(url, proxy=None):
+        calls.append(url)
+        await asyncio.sleep(0.05)
+        return f"clearance{len(calls)}", "Mozilla/5.0"
+
+    monkeypatch.setattr(cloudflare_module, "cache", Cache(JSONCacheBackend(tmp_path / "cache.json")))
+    monkeypatch.setattr(cloudflare_module, "get_cf_clearance", fake_get_cf_clearance)
+    return calls
+
+
+def test_concurrent_solves_are_coalesced_and_persisted(solver):
+    async def main():
+        store = ClearanceStore()
+        results = await asyncio.gather(*(store.solve("https://emby.example.com:443") for _ in range(5)))
+        assert set(results) == {("clearance1", "Mozilla/5.0")}
+
+        # 新的存储实例 (如另一个账户或重启后) 直接读取已保存的结果
+        other = ClearanceStore()
+        assert await other.get("https://emby.example.com/web") == ("clearance1", "Mozilla/5.0")
+        assert await other.get("https://other.example.com") == (None, None)
+
+        await other.invalidate("https://emby.example.com")
+        assert await other.solve("https://emby.example.com") == ("clearance2", "Mozilla/5.0")
+
+    asyncio.run(main())
+    assert len(solver) == 2
+
+
+def test_used_clearance_is_refreshed_before_expiry(solver):
+    async def main():
+        store = ClearanceStore(ttl=0.3, refresh_ahead=0.2)
+        await store.solve("https://emby.example.com")
+        await asyncio.sleep(0.2)
+        assert await store.get("https://emby.example.com") == ("clearance2", "Mozilla/5.0")
+
+        # 闲置超过一个有效期后不再刷新
+        await asyncio.sleep(1.2)
+        assert await store.get("https://emby.example.com") == (None, None)
+        solved = len(solver)
+        await asyncio.sleep(0.5)
+        assert len(solver) == solved
+
+    asyncio.run(main())
+
+
+def test_concurrent_invalidations_keep_the_new_clearance(solver):
+    async def main():
+        store = ClearanceStore()
+        stale, _ = await store.solve("https://emby.example.com")
+
+        # 多个请求同时发现同一个结果失效, 仅解析一次
+        async def renew():
+            await store.invalidate("https://emby.example.com", cf_clearance=stale)
+            return await store.solve("https://emby.example.com")
+
+        results = await asyncio.gather(*(renew() for _ in range(3)))
+        assert set(results) == {("clearance2", "Mozilla/5.0")}
+
+        # 迟到的请求不会删除新的结果
+        assert not await store.invalidate("https://emby.example.com", cf_clearance=stale)
+        assert await store.solve("https://emby.example.com") == ("clearance2", "Mozilla/5.0")
+
+    asyncio.run(main())
+    assert len(solver) == 2
@@ -58,6 +58,18 @@ def fake_create_task(coro):
     return DummyTask()
 
 
+class InstantTicker:
+    def now(self):
+        return 0
+
+    async def wait_until(self, when):
+        return None
+
+    @property
+    def limiter(self):
+        return asyncio.Semaphore(1)
+
+
 def make_logger():
     return SimpleNamespace(
         info=lambda *args, **kwargs: None,
@@ -150,6 +162,7 @@ def test_watch_caps_requested_play_time(monkeypatch):
 
 def test_play_uses_stable_start_ticks_and_stopped_endpoint(monkeypatch):
     monkeypatch.setattr(emby_api_module.asyncio, "sleep", fast_sleep)
+    monkeypatch.setattr(emby_api_module, "ticker", InstantTicker())
     monkeypatch.setattr(emby_api_module.asyncio, "create_task", fake_create_task)
     monkeypatch.setattr(emby_api_module.random, "uniform", lambda a, b: a)
     monkeypatch.setattr(emby_api_module.random, "random", lambda: 0.5)
@@ -246,7 +259,7 @@ def test_watch_main_handles_emby_init_exception_without_nameerror(monkeypatch):
         async def login(self):
             return True
 
-        async def load_main_page(self):
+        async def load_library(self):
             self.items = {
                 "video-1": {
                     "Id": "video-1",
@@ -266,3 +279,150 @@ def test_watch_main_handles_emby_init_exception_without_nameerror(monkeypatch):
     result = asyncio.run(manager._watch_main([bad, good], instant=True))
 
     assert result.status == RunStatus.FAIL
+
+
+def test_session_pool_shares_sessions_per_server():
+    pool = emby_api_module.EmbySessionPool()
+
+    async def main():
+        a = pool.get("https://example.com:443")
+        b = pool.get("https://example.com:443")
+        c = pool.get("https://example.com:443", proxy="socks5://127.0.0.1:1080")
+        d = pool.get("https://example.com:443", cookies={"cf_clearance": "x"})
+        assert a is b
+        assert len({id(a), id(c), id(d)}) == 3
+        assert len(pool) == 3
+        assert pool.get("https://example.com:443", stream=True) is not a
+        await pool.close()
+        assert len(pool) == 0
+
+    asyncio.run(main())
+
+
+def test_load_main_page_fetches_concurrently_under_server_limit(monkeypatch):
+    monkeypatch.setattr(emby_api_module.random, "uniform", lambda a, b: 0)
+    monkeypatch.setattr(emby_api_module, "sessions", emby_api_module.EmbySessionPool())
+
+    emby = Emby(make_account())
+    emby._user_id = "user-1"
+    emby._token = "token-1"
+    order = []
+    active = [0, 0]
+
+    async def fake_request(method, path, params=None, **kwargs):
+        order.append(path)
+        active[0] += 1
+        active[1] = max(active[1], active[0])
+        await asyncio.sleep(0.01)
+        active[0] -= 1
+        if path.endswith("/Views"):
+            items = [{"Id": f"col{i}", "CollectionType": "movies"} for i in range(10)]
+            return FakeResponse({"Items": items})
+        if path.endswith("/Items/Latest"):
+            return FakeResponse([] if params["ParentId"] != "col3" else [{"Id": "video-1"}])
+        if path == "/Users/user-1":
+            return FakeResponse({"LastLoginDate": "2024-01-01"})
+        return FakeResponse({"Items": []})
+
+    monkeypatch.setattr(emby, "_request", fake_request)
+
+    assert asyncio.run(emby.load_main_page()) == "2024-01-01"
+    assert list(emby.items) == ["video-1"]
+    assert order[:3] == ["/Users/user-1/Views", "/Users/user-1", "/DisplayPreferences/usersettings"]
+    assert len(order) == 15
+    assert 1 < active[1] <= emby_api_module.EmbySessionPool.MAX_PAGE_REQUESTS
+
+
+def test_load_library_reuses_snapshot_and_refreshes_incrementally(tmp_path, monkeypatch):
+    from embykeeper.cache import Cache, JSONCacheBackend
+
+    monkeypatch.setattr(emby_api_module, "cache", Cache(JSONCacheBackend(tmp_path / "cache.json")))
+    library = {"count": 10}
+    requests = []
+
+    async def fake_main_page(self):
+        requests.append("main")
+        self._add_items([{"Id": "video-1", "Name": "Demo", "MediaType": "Video", "UserData": {}}])
+
+    async def fake_request(self, method, path, params=None, **kwargs):
+        if "MinDateLastSaved" in params:
+            requests.append("changes")
+            item = {"Id": "video-2", "Name": "New", "MediaSources": [{"Id": "ms-2", "Path": "/x"}]}
+            return FakeResponse({"Items": [item]})
+        requests.append("count")
+        return FakeResponse({"TotalRecordCount": library["count"]})
+
+    monkeypatch.setattr(Emby, "load_main_page", fake_main_page)
+    monkeypatch.setattr(Emby, "_request", fake_request)
+
+    def load():
+        emby = Emby(make_account())
+        emby._user_id = "user-1"
+        asyncio.run(emby.load_library())
+        return emby.items
+
+    assert load() == {"video-1": {"Id": "video-1", "Name": "Demo", "MediaType": "Video"}}
+    assert requests == ["main", "count"]
+
+    requests.clear()
+    assert list(load()) == ["video-1"]
+    assert requests == ["count"]
+
+    requests.clear()
+    library["count"] = 11
+    items = load()
+    assert items["video-2"] == {"Id": "video-2", "Name": "New", "MediaSourceIds": ["ms-2"]}
+    assert requests == ["count", "changes"]
+
+    requests.clear()
+    library["count"] = 5
+    assert list(load()) == ["video-1"]
+    assert requests == ["count", "main", "count"]
+
+
+def test_server_group_shares_probe_and_interleaves_accounts():
+    from embykeeper.emby.main import EmbyServerGroup
+
+    a = EmbyServerGroup("a.example.com", concurrency=1)
+    b = EmbyServerGroup("b.example.com", concurrency=1)
+    a.accounts = ["a1", "a2", "a3"]
+    b.accounts = ["b1"]
+    assert [acc for _, acc in EmbyServerGroup.interleave([a, b])] == ["a1", "b1", "a2", "a3"]
+
+    probes = []
+
+    class FakeEmby:
+        log = make_logger()
+
+        async def get_public_info(self):
+            probes.append(self)
+            await asyncio.sleep(0.01)
+            return {"ServerName": "Demo", "Version": "4.8"}
+
+    async def main():
+        results = await asyncio.gather(*(a.probe(FakeEmby()) for _ in range(3)))
+        assert all(r == {"ServerName": "Demo", "Version": "4.8"} for r in results)
+
+    asyncio.run(main())
+    assert len(probes) == 1
+
+
+def test_playback_ticker_batches_and_spreads_reports(monkeypatch):
+    monkeypatch.setattr(emby_api_module.PlaybackTicker, "SLOT", 0.02)
+    ticker = emby_api_module.PlaybackTicker()
+    woke = []
+
+    async def session(i):
+        await ticker.wait_until(ticker.now() + 0.01)
+        woke.append((i, round(ticker.now() / 0.02)))
+
+    async def main():
+        await asyncio.gather(*(session(i) for i in range(9)))
+        assert len(ticker) == 0
+
+    asyncio.run(main())
+    assert len(woke) == 9
+    # 9 个同时到期的会话被分散到 3 个时间槽, 每个时间槽统一唤醒
+    slots = [slot for _, slot in woke]
+    assert len(set(slots)) == 3
+    assert all(slots.count(s) == 3 for s in set(slots))
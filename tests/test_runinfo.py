@@ -0,0 +1,63 @@
+import pytest
+from loguru import logger
+
+import embykeeper.runinfo as runinfo_module
+from embykeeper.cache import Cache, JSONCacheBackend
+from embykeeper.runinfo import RunContext, RunLog, RunStatus
+
+
+@pytest.fixture(autouse=True)
+def local_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(runinfo_module, "cache", Cache(JSONCacheBackend(tmp_path / "cache.json")))
+    monkeypatch.setattr(runinfo_module, "_retention", lambda: None)
+
+
+def test_runs_share_one_log_sink():
+    runs = [RunContext.prepare(f"run {i}") for i in range(50)]
+    sink_id = runinfo_module._log_sink_id
+    assert sink_id is not None
+
+    for run in runs[:3]:
+        run.bind_logger(logger).info(f"message for {run.id}")
+    logger.bind(run_id="UNKNOWN").info("message for unknown run")
+
+    assert [r.message for r in runs[0].log] == [f"message for {runs[0].id}"]
+    assert len(runs[3].log) == 0
+
+    for run in runs:
+        run.finish(RunStatus.SUCCESS)
+    runs[0].bind_logger(logger).info("after finish")
+    assert len(runs[0].log) == 2
+    assert RunContext.prepare("another run") and runinfo_module._log_sink_id == sink_id
+
+
+def test_finished_run_is_loaded_from_cache():
+    parent = RunContext.prepare("parent")
+    child = RunContext.prepare("child", parent_ids=[parent.id])
+    child.finish(RunStatus.SUCCESS, "done")
+
+    children = parent.get_children()
+    assert [c.id for c in children] == [child.id]
+    assert children[0].status == RunStatus.SUCCESS
+    assert children[0].status_info == "done"
+
+
+def test_run_log_spills_to_file_and_streams_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(runinfo_module, "_log_dir", lambda: tmp_path / "runlogs")
+    monkeypatch.setattr(RunLog, "CAPACITY", 10)
+
+    run = RunContext.prepare("long running monitor")
+    log = run.bind_logger(logger)
+    for i in range(35):
+        log.info(f"message {i}")
+
+    assert len(run.log._buffer) < 10
+    assert len(run.log) == 35
+    assert len(list((tmp_path / "runlogs").glob("*.jsonl.gz"))) == 1
+    assert [r.message for r in run.yield_logs()] == [f"message {i}" for i in range(35)]
+
+    run.finish(RunStatus.SUCCESS)
+    loaded = RunContext.model_validate_json(run.model_dump_json())
+    messages = [r.message for r in loaded.yield_logs(reverse=True)]
+    assert messages[0] == "任务状态已设置为 SUCCESS"
+    assert messages[1:] == [f"message {i}" for i in reversed(range(35))]
@@ -0,0 +1,195 @@
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import embykeeper.schedule as schedule_module
+from embykeeper.schedule import Scheduler, TimerService
+
+
+@pytest.fixture(autouse=True)
+def fresh_timer(monkeypatch):
+    monkeypatch.setattr(schedule_module, "config", SimpleNamespace(debug_cron=False, nofail=True))
+    timer = TimerService(max_workers=2)
+    monkeypatch.setattr(schedule_module, "timer", timer)
+    return timer
+
+
+def make_scheduler(func, delay: float):
+    scheduler = Scheduler(func, days=[0, 0])
+
+    async def next_time():
+        return datetime.now() + timedelta(seconds=delay)
+
+    scheduler._aget_next_time = next_time
+    return scheduler
+
+
+def test_timer_runs_jobs_in_order_with_bounded_workers(fresh_timer):
+    fired = []
+    running = 0
+    peak = 0
+
+    def make_func(i):
+        async def job():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            fired.append(i)
+            await asyncio.sleep(0.05)
+            running -= 1
+
+        return lambda ctx: job()
+
+    async def main():
+        schedulers = [make_scheduler(make_func(i), 0.05 + 0.01 * (i % 3)) for i in range(6)]
+        await asyncio.gather(*(s.schedule() for s in schedulers))
+
+    asyncio.run(main())
+    assert sorted(fired) == list(range(6))
+    assert fired[:2] == [0, 3]
+    assert peak == 2
+    assert len(fresh_timer) == 0
+
+
+def test_timer_cancel_and_reschedule(fresh_timer):
+    fired = []
+
+    async def main():
+        a = make_scheduler(lambda ctx: asyncio.sleep(0, fired.append("a")), 60)
+        b = make_scheduler(lambda ctx: asyncio.sleep(0, fired.append("b")), 60)
+        tasks = [asyncio.create_task(s.schedule()) for s in (a, b)]
+        await asyncio.sleep(0.01)
+        assert len(fresh_timer) == 2
+
+        a.cancel()
+        b.reschedule(datetime.now() + timedelta(seconds=0.02))
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+
+    asyncio.run(main())
+    assert fired == ["b"]
+    assert len(fresh_timer) == 0
+
+
+def test_scheduler_states_load_once_and_persist_in_one_batch(tmp_path, monkeypatch):
+    import embykeeper.cache as cache_module
+    from embykeeper.cache import Cache, SQLiteCacheBackend
+
+    class CountingBackend(SQLiteCacheBackend):
+        prefix_reads = 0
+        batches = 0
+
+        def find_by_prefix(self, prefix):
+            CountingBackend.prefix_reads += 1
+            return super().find_by_prefix(prefix)
+
+        def write_batch(self, sets, deletes, expires=None):
+            CountingBackend.batches += 1
+            super().write_batch(sets, deletes, expires)
+
+    backend = CountingBackend(tmp_path / "cache.db")
+    monkeypatch.setattr(cache_module, "cache", Cache(backend))
+    states = schedule_module.SchedulerStates(flush_delay=0.01)
+    monkeypatch.setattr(schedule_module, "states", states)
+
+    schedulers = [
+        Scheduler(lambda ctx: None, days=1, start_time="9:00", end_time="18:00", sid=f"site{i}")
+        for i in range(100)
+    ]
+
+    async def main():
+        times = await asyncio.gather(*(s._aget_next_time() for s in schedulers))
+        await asyncio.sleep(0.05)
+        return times
+
+    times = asyncio.run(main())
+    assert CountingBackend.prefix_reads == 1
+    assert CountingBackend.batches == 1
+    assert len(backend.find_by_prefix("scheduler.")) == 100
+
+    # 重新启动后读取相同的执行时间
+    monkeypatch.setattr(schedule_module, "states", schedule_module.SchedulerStates())
+    assert [s._get_next_time() for s in schedulers] == times
+
+
+def test_scheduler_states_round_trip_on_json_backend(tmp_path, monkeypatch):
+    import embykeeper.cache as cache_module
+    from embykeeper.cache import Cache, JSONCacheBackend
+
+    monkeypatch.setattr(cache_module, "cache", Cache(JSONCacheBackend(tmp_path / "cache.json")))
+    monkeypatch.setattr(schedule_module, "states", schedule_module.SchedulerStates(flush_delay=0.01))
+
+    schedulers = [
+        Scheduler(lambda ctx: None, days=1, start_time="9:00", end_time="18:00", sid=sid)
+        for sid in ("site", "subsonic.watch.global")
+    ]
+    times = [s._get_next_time() for s in schedulers]
+    schedule_module.states.flush()
+
+    # 重新打开存储后读取相同的执行时间
+    monkeypatch.setattr(cache_module, "cache", Cache(JSONCacheBackend(tmp_path / "cache.json")))
+    states = schedule_module.SchedulerStates()
+    monkeypatch.setattr(schedule_module, "states", states)
+    assert [s._get_next_time() for s in schedulers] == times
+    assert set(states._states) == {"scheduler.site", "scheduler.subsonic.watch.global"}
+
+
+def test_reschedule_persists_next_time(tmp_path, monkeypatch):
+    import embykeeper.cache as cache_module
+    from embykeeper.cache import Cache, SQLiteCacheBackend
+
+    monkeypatch.setattr(cache_module, "cache", Cache(SQLiteCacheBackend(tmp_path / "cache.db")))
+    monkeypatch.setattr(schedule_module, "states", schedule_module.SchedulerStates(flush_delay=0.01))
+    scheduler = Scheduler(lambda ctx: None, days=1, start_time="9:00", end_time="18:00", sid="site")
+    when = datetime.now() + timedelta(hours=1)
+
+    async def main():
+        task = asyncio.create_task(scheduler.schedule())
+        await asyncio.sleep(0.01)
+        scheduler.reschedule(when)
+        await asyncio.sleep(0.05)
+        scheduler.cancel()
+        await task
+
+    asyncio.run(main())
+    monkeypatch.setattr(schedule_module, "states", schedule_module.SchedulerStates())
+    assert scheduler._get_next_time() == when
+
+
+def test_planner_spreads_start_times_within_window():
+    import random
+
+    def plan_peak(candidates):
+        random.seed(1)
+        planner = schedule_module.SchedulePlanner(max_concurrency=8, candidates=candidates)
+        schedulers = [
+            Scheduler(
+                lambda ctx: None,
+                days=1,
+                start_time="9:00",
+                end_time="10:00",
+                group="proxy" if i % 2 else None,
+            )
+            for i in range(40)
+        ]
+        for s in schedulers:
+            t = planner.plan(s)
+            assert t.time() >= schedulers[0].start_time and t.time() <= schedulers[0].end_time
+        (peak,) = planner.report().values()
+        return peak
+
+    assert plan_peak(8) < plan_peak(1)
+    assert plan_peak(8) <= 9
+
+
+def test_planner_counts_unlimited_concurrency_as_the_budget():
+    planner = schedule_module.SchedulePlanner()
+    assert planner.max_concurrency == schedule_module.SchedulePlanner.MAX_CONCURRENCY
+
+    unlimited = Scheduler(lambda ctx: None, days=1, start_time="9:00", end_time="9:00", weight=None)
+    heavy = Scheduler(lambda ctx: None, days=1, start_time="9:00", end_time="9:00", weight=100)
+    for scheduler in (unlimited, heavy):
+        planner.book(scheduler, datetime.now() + timedelta(hours=1))
+    (peak,) = planner.report().values()
+    assert peak == 2 * planner.max_concurrency
@@ -0,0 +1,101 @@
+import asyncio
+
+from curl_cffi.requests import RequestsError
+import pytest
+
+import embykeeper.subsonic.api as subsonic_api
+from embykeeper.subsonic.api import Subsonic, SubsonicConnectError, SubsonicSessionPool
+
+
+class FakeResponse:
+    status_code = 200
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"subsonic-response": {"status": "ok"}}
+
+
+class FakeSession:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.calls = 0
+        self.inflight = 0
+        self.max_inflight = 0
+        self.headers = []
+
+    async def get(self, url, **kw):
+        self.calls += 1
+        self.headers.append(kw.get("headers"))
+        self.inflight += 1
+        self.max_inflight = max(self.max_inflight, self.inflight)
+        try:
+            await asyncio.sleep(0.01)
+            if self.fail:
+                raise RequestsError("Failed to connect")
+            return FakeResponse()
+        finally:
+            self.inflight -= 1
+
+
+def make_client(username="tester", useragent=None):
+    return Subsonic("https://music.example.com/", username, "password", useragent=useragent)
+
+
+def test_session_pool_shares_sessions_by_server_and_proxy(monkeypatch):
+    pool = SubsonicSessionPool()
+    monkeypatch.setattr(subsonic_api, "sessions", pool)
+
+    async def main():
+        a = make_client("a")
+        b = make_client("b")
+        assert a._get_session() is b._get_session()
+        assert a._get_session(stream=True) is not a._get_session()
+        assert pool.get("https://music.example.com", "socks5://127.0.0.1:1080") is not a._get_session()
+        assert len(pool) == 3
+        await pool.close()
+
+    asyncio.run(main())
+
+
+def test_first_request_warms_connection_before_others(monkeypatch):
+    pool = SubsonicSessionPool()
+    session = FakeSession()
+    monkeypatch.setattr(subsonic_api, "sessions", pool)
+    monkeypatch.setattr(pool, "get", lambda *args, **kw: session)
+
+    async def main():
+        clients = [make_client(f"u{i}", useragent=f"UA {i}") for i in range(20)]
+        results = await asyncio.gather(*(c.ping() for c in clients))
+        assert all(r.is_ok for r in results)
+
+    asyncio.run(main())
+    assert session.calls == 20
+    assert session.max_inflight == 19
+    assert {h["User-Agent"] for h in session.headers} == {f"UA {i}" for i in range(20)}
+
+
+def test_unreachable_server_fails_fast(monkeypatch):
+    pool = SubsonicSessionPool()
+    session = FakeSession(fail=True)
+    monkeypatch.setattr(subsonic_api, "sessions", pool)
+    monkeypatch.setattr(pool, "get", lambda *args, **kw: session)
+    monkeypatch.setattr(subsonic_api.random, "random", lambda: -0.5)
+
+    async def main():
+        for _ in range(pool.FAIL_THRESHOLD):
+            with pytest.raises(SubsonicConnectError):
+                await make_client()._request("ping")
+        calls = session.calls
+        with pytest.raises(SubsonicConnectError, match="连续无法连接"):
+            await make_client()._request("ping")
+        assert session.calls == calls
+        assert pool.unavailable_for("https://music.example.com") > 0
+
+        session.fail = False
+        pool.health("https://music.example.com").down_until = 0
+        assert (await make_client().ping()).is_ok
+        assert pool.health("https://music.example.com").failures == 0
+
+    asyncio.run(main())
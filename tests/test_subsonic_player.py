@@ -0,0 +1,80 @@
+import asyncio
+
+from embykeeper.subsonic.player import SongPool
+
+
+class FakeClient:
+    def __init__(self, random_songs=50, albums=0):
+        self.random_songs = random_songs
+        self.albums = albums
+        self.calls = []
+        self.counter = 0
+
+    def make_songs(self, n):
+        songs = [{"id": f"s{self.counter + i}", "title": f"Song {i}", "duration": 180} for i in range(n)]
+        self.counter += n
+        return songs
+
+    async def get_random_songs(self, size=1):
+        self.calls.append("getRandomSongs")
+        await asyncio.sleep(0)
+        return self.make_songs(min(size, self.random_songs))
+
+    async def get_album_list2(self, type="random", size=10, offset=0):
+        self.calls.append("getAlbumList2")
+        return [{"id": f"a{i}"} for i in range(min(size, self.albums))]
+
+    async def get_album(self, album_id):
+        self.calls.append("getAlbum")
+        return {"id": album_id, "song": self.make_songs(10)}
+
+
+def test_song_pool_prefetches_and_is_shared():
+    client = FakeClient()
+    pool = SongPool("https://music.example.com")
+
+    async def main():
+        taken = [await pool.take(client) for _ in range(100)]
+        assert len({s["id"] for s in taken}) == 100
+        assert taken[0] == {"id": taken[0]["id"], "title": taken[0]["title"], "duration": 180}
+
+    asyncio.run(main())
+    # 100 首歌曲仅需少量请求, 且后台补充不会重复进行
+    assert client.calls.count("getRandomSongs") <= 4
+    assert SongPool.of("https://music.example.com") is SongPool.of("https://music.example.com")
+
+
+def test_song_pool_falls_back_to_album_list_and_invalidates():
+    client = FakeClient(random_songs=5, albums=2)
+    pool = SongPool("https://music.example.com")
+
+    async def main():
+        assert await pool.take(client)
+        assert client.calls == ["getRandomSongs", "getAlbumList2", "getAlbum", "getAlbum"]
+        assert len(pool) == 24
+        pool.invalidate()
+        assert len(pool) == 0
+
+    asyncio.run(main())
+
+
+def test_song_pool_returns_none_when_server_is_empty():
+    client = FakeClient(random_songs=0)
+    assert asyncio.run(SongPool("https://music.example.com").take(client)) is None
+
+
+def test_song_pool_invalidate_does_not_cancel_waiting_accounts():
+    client = FakeClient()
+    pool = SongPool("https://music.example.com")
+
+    async def main():
+        waiting = asyncio.gather(*(pool.take(client) for _ in range(3)))
+        await asyncio.sleep(0)
+        pool.invalidate()
+        taken = await waiting
+        assert all(taken)
+        # 清空前开始的补充结果被丢弃
+        assert all(int(s["id"][1:]) >= 50 for s in taken)
+
+    asyncio.run(main())
+    assert client.calls.count("getRandomSongs") == 2
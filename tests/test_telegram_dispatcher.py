@@ -0,0 +1,236 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from pyrogram import filters, raw
+from pyrogram.handlers import EditedMessageHandler, MessageHandler, RawUpdateHandler
+
+from embykeeper.telegram.pyrogram import Dispatcher, HandlerIndex, chat_scope
+
+
+async def noop(client, update):
+    pass
+
+
+def make_message(chat_id, username=None, outgoing=False):
+    return SimpleNamespace(chat=SimpleNamespace(id=chat_id, username=username), outgoing=outgoing)
+
+
+def test_chat_scope_of_composed_filters():
+    assert chat_scope(filters.all & filters.chat(["@Foo", 1]) & ~filters.outgoing) == {"foo", 1}
+    assert chat_scope(filters.chat(1) | filters.chat(2)) == {1, 2}
+    assert chat_scope(filters.chat(1) | filters.private) is None
+    assert chat_scope(~filters.chat(1)) is None
+    assert chat_scope(filters.chat("me")) is None
+    assert chat_scope(None) is None
+
+
+def test_handler_index_routes_by_chat_and_type():
+    h1 = MessageHandler(noop, filters.chat(1))
+    h2 = MessageHandler(noop, filters.all & filters.chat("foo") & ~filters.outgoing)
+    h3 = MessageHandler(noop)
+    h4 = EditedMessageHandler(noop, filters.chat(2))
+    raw = RawUpdateHandler(noop)
+    index = HandlerIndex({0: [h1, h2, h3], 1: [raw, h4]})
+
+    assert index.candidates(MessageHandler, make_message(1)) == [[h1, h3], [raw]]
+    assert index.candidates(MessageHandler, make_message(5, "Foo")) == [[h2, h3], [raw]]
+    assert index.candidates(MessageHandler, make_message(9)) == [[h3], [raw]]
+    assert index.candidates(EditedMessageHandler, make_message(2)) == [[raw, h4]]
+    assert index.candidates(type(None), None) == [[raw]]
+
+
+def test_worker_only_checks_handlers_for_the_chat():
+    checked = []
+    called = []
+
+    def counting(name):
+        async def func(flt, client, update):
+            checked.append(name)
+            return True
+
+        return filters.create(func)
+
+    async def callback(client, message):
+        called.append(message.chat.id)
+
+    class FakeUpdate:
+        pass
+
+    async def main():
+        dispatcher = Dispatcher(SimpleNamespace(loop=asyncio.get_running_loop(), workers=1))
+        message = make_message(2)
+
+        async def parser(update, users, chats):
+            return message, MessageHandler
+
+        dispatcher.update_parsers = {FakeUpdate: parser}
+        for i in range(50):
+            await dispatcher.add_handler(MessageHandler(callback, counting(i) & filters.chat(100 + i)), 0)
+        await dispatcher.add_handler(MessageHandler(callback, counting("target") & filters.chat(2)), 0)
+
+        dispatcher.updates_queue.put_nowait((FakeUpdate(), {}, {}))
+        dispatcher.updates_queue.close()
+        await dispatcher.handler_worker(dispatcher.updates_queue.shards[0])
+
+    asyncio.run(main())
+    assert checked == ["target"]
+    assert called == [2]
+
+
+def test_handler_table_is_replaced_on_change():
+    async def main():
+        dispatcher = Dispatcher(SimpleNamespace(loop=asyncio.get_running_loop(), workers=1))
+        h1 = MessageHandler(noop, filters.chat(1))
+        h2 = MessageHandler(noop)
+        before = dispatcher.index
+
+        future = dispatcher.add_handler(h1, 1)
+        assert future.done()
+        await dispatcher.add_handler(h2, 0)
+        assert before.candidates(MessageHandler, make_message(1)) == []
+        snapshot = dispatcher.index
+        assert snapshot.candidates(MessageHandler, make_message(1)) == [[h2], [h1]]
+
+        await dispatcher.remove_handler(h1, 1)
+        assert snapshot.candidates(MessageHandler, make_message(1)) == [[h2], [h1]]
+        assert dispatcher.index.candidates(MessageHandler, make_message(1)) == [[h2]]
+        with pytest.raises(ValueError):
+            await dispatcher.remove_handler(h1, 1)
+        with pytest.raises(ValueError):
+            await dispatcher.remove_handler(h1, 5)
+
+    asyncio.run(main())
+
+
+def make_update(chat_id, seq):
+    peer = raw.types.PeerUser(user_id=chat_id)
+    return SimpleNamespace(message=SimpleNamespace(peer_id=peer), seq=seq)
+
+
+async def start_dispatcher(callback, workers=4):
+    dispatcher = Dispatcher(SimpleNamespace(loop=asyncio.get_running_loop(), workers=workers))
+
+    async def parser(update, users, chats):
+        chat_id = update.message.peer_id.user_id
+        return (
+            SimpleNamespace(chat=SimpleNamespace(id=chat_id, username=None), seq=update.seq),
+            MessageHandler,
+        )
+
+    dispatcher.update_parsers = {SimpleNamespace: parser}
+    await dispatcher.add_handler(MessageHandler(callback), 0)
+    for shard in dispatcher.updates_queue.shards:
+        dispatcher.handler_worker_tasks.append(asyncio.create_task(dispatcher.handler_worker(shard)))
+    return dispatcher
+
+
+async def stop_dispatcher(dispatcher):
+    dispatcher.updates_queue.close()
+    await asyncio.gather(*dispatcher.handler_worker_tasks)
+
+
+def test_updates_are_ordered_per_chat_and_parallel_across_chats():
+    events = []
+
+    async def callback(client, message):
+        await asyncio.sleep(0.05 if message.chat.id == 1 else 0)
+        events.append((message.chat.id, message.seq))
+
+    async def main():
+        dispatcher = await start_dispatcher(callback)
+        queue = dispatcher.updates_queue
+        assert queue.shard_of((make_update(1, 0),)) != queue.shard_of((make_update(2, 0),))
+        for seq in range(3):
+            queue.put_nowait((make_update(1, seq), {}, {}))
+            queue.put_nowait((make_update(2, seq), {}, {}))
+        await stop_dispatcher(dispatcher)
+        return dispatcher.stats()
+
+    stats = asyncio.run(main())
+    assert [s for c, s in events if c == 1] == [0, 1, 2]
+    assert [s for c, s in events if c == 2] == [0, 1, 2]
+    # 会话 2 的更新无需等待会话 1 中较慢的回调
+    assert events.index((2, 2)) < events.index((1, 0))
+    assert sum(s["processed"] for s in stats["shards"]) == 6
+    assert max(s["wait_max"] for s in stats["shards"]) >= 0.05
+    assert all(s["depth"] == 0 for s in stats["shards"])
+
+
+def test_slow_callback_is_handed_off(monkeypatch):
+    events = []
+    release = []
+
+    async def callback(client, message):
+        if message.seq == 0 and message.chat.id == 1:
+            event = asyncio.Event()
+            release.append(event)
+            await event.wait()
+        events.append((message.chat.id, message.seq))
+
+    monkeypatch.setattr(Dispatcher, "HANDOFF_AFTER", 0.01)
+
+    async def main():
+        dispatcher = await start_dispatcher(callback, workers=1)
+        for chat_id, seq in ((1, 0), (1, 1), (2, 0)):
+            dispatcher.updates_queue.put_nowait((make_update(chat_id, seq), {}, {}))
+        await asyncio.sleep(0.1)
+        assert events == [(1, 1), (2, 0)]
+        assert dispatcher.stats()["handoff"] == 1
+        release[0].set()
+        await asyncio.sleep(0)
+        await stop_dispatcher(dispatcher)
+        assert dispatcher.stats()["handoff"] == 0
+
+    asyncio.run(main())
+    assert events == [(1, 1), (2, 0), (1, 0)]
+
+
+def test_handed_off_callback_can_wait_for_same_chat_update(monkeypatch):
+    # 如签到中等待验证码键盘或回复: 回调函数等待同一会话的后续消息
+    followup = None
+    results = []
+
+    async def callback(client, message):
+        nonlocal followup
+        if message.seq == 0:
+            followup = asyncio.get_running_loop().create_future()
+            results.append(await asyncio.wait_for(followup, 1))
+        elif followup and not followup.done():
+            followup.set_result(message.seq)
+
+    monkeypatch.setattr(Dispatcher, "HANDOFF_AFTER", 0.01)
+
+    async def main():
+        dispatcher = await start_dispatcher(callback, workers=1)
+        for seq in range(2):
+            dispatcher.updates_queue.put_nowait((make_update(1, seq), {}, {}))
+        await asyncio.sleep(0.1)
+        await stop_dispatcher(dispatcher)
+
+    asyncio.run(main())
+    assert results == [1]
+
+
+def test_handed_off_update_is_not_passed_to_later_groups(monkeypatch):
+    events = []
+
+    async def slow(client, message):
+        await asyncio.sleep(0.05)
+        events.append(("slow", message.seq))
+
+    async def later(client, message):
+        events.append(("later", message.seq))
+
+    monkeypatch.setattr(Dispatcher, "HANDOFF_AFTER", 0.01)
+
+    async def main():
+        dispatcher = await start_dispatcher(slow, workers=1)
+        await dispatcher.add_handler(MessageHandler(later), 1)
+        for seq in range(2):
+            dispatcher.updates_queue.put_nowait((make_update(1, seq), {}, {}))
+        await asyncio.sleep(0.2)
+        await stop_dispatcher(dispatcher)
+
+    asyncio.run(main())
+    assert events == [("slow", 0), ("slow", 1)]
@@ -0,0 +1,281 @@
+"""Emby 保活性能基准测试.
+
+在本地子进程中启动一个模拟的 Emby 服务器, 以不同的账户数运行 EmbyManager._watch_main,
+并记录运行时间, 峰值内存, 每秒请求数与事件循环延迟, 以便在发布前发现性能退化.
+
+python utils/emby_benchmark.py --counts 10,100,1000 --time 20
+"""
+
+import asyncio
+import json
+import multiprocessing
+import socket
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+from loguru import logger
+import psutil
+from rich.table import Table
+import typer
+
+from embykeeper.cli import AsyncTyper
+from embykeeper.config import config
+from embykeeper.var import console
+
+app = AsyncTyper()
+
+# 模拟服务器中每个合集的影片数, 以及每个影片的时长 (秒)
+ITEMS_PER_VIEW = 16
+ITEM_SECONDS = 600
+
+
+def create_server_app():
+    from fastapi import FastAPI, Request
+    from fastapi.responses import StreamingResponse
+
+    server = FastAPI()
+    stats = {"requests": 0, "streams": 0}
+    views = [{"Id": f"view{i}", "Name": f"合集 {i}", "CollectionType": "movies"} for i in range(2)]
+
+    def make_item(view: str, i: int):
+        return {
+            "Id": f"{view}-item{i}",
+            "Name": f"影片 {view}-{i}",
+            "Type": "Movie",
+            "MediaType": "Video",
+            "RunTimeTicks": ITEM_SECONDS * 10000000,
+            "UserData": {"PlayCount": 0},
+        }
+
+    @server.middleware("http")
+    async def count_requests(request: Request, call_next):
+        if not request.url.path.startswith("/_bench"):
+            stats["requests"] += 1
+        return await call_next(request)
+
+    @server.get("/_bench/stats")
+    async def bench_stats():
+        return stats
+
+    @server.get("/System/Info/Public")
+    async def public_info():
+        return {"ServerName": "Benchmark", "Version": "4.8.0.0", "Id": "benchmark"}
+
+    @server.post("/Users/AuthenticateByName")
+    async def authenticate(request: Request):
+        # 客户端可能发送 h2c 升级请求, uvicorn 不支持时将丢弃请求体
+        body = await request.body()
+        username = json.loads(body).get("Username") if body else uuid.uuid4().hex
+        return {"AccessToken": uuid.uuid4().hex, "User": {"Id": f"user-{username}"}}
+
+    @server.get("/Users/{uid}")
+    async def user(uid: str):
+        return {"Id": uid, "LastLoginDate": "2024-01-01T00:00:00.0000000Z"}
+
+    @server.get("/Users/{uid}/Views")
+    async def user_views(uid: str):
+        return {"Items": views, "TotalRecordCount": len(views)}
+
+    @server.get("/DisplayPreferences/usersettings")
+    async def display_preferences():
+        return {"Id": "usersettings", "CustomPrefs": {}}
+
+    @server.get("/Users/{uid}/Items/Resume")
+    async def resume_items(uid: str):
+        return {"Items": [], "TotalRecordCount": 0}
+
+    @server.get("/Users/{uid}/Items/Latest")
+    async def latest_items(uid: str, ParentId: str = "view0", Limit: int = 16):
+        return [make_item(ParentId, i) for i in range(min(Limit, ITEMS_PER_VIEW))]
+
+    @server.get("/Users/{uid}/Items")
+    async def items(uid: str, ParentId: str = None, Limit: int = 50):
+        total = ITEMS_PER_VIEW * len(views)
+        if ParentId:
+            return {"Items": [make_item(ParentId, i) for i in range(min(Limit, ITEMS_PER_VIEW))]}
+        return {"Items": [], "TotalRecordCount": total}
+
+    @server.get("/Users/{uid}/Items/{iid}")
+    async def item(uid: str, iid: str):
+        view, _, i = iid.partition("-item")
+        return make_item(view, int(i or 0))
+
+    @server.get("/Videos/{iid}/AdditionalParts")
+    async def additional_parts(iid: str):
+        return {"Items": [], "TotalRecordCount": 0}
+
+    @server.post("/Items/{iid}/PlaybackInfo")
+    async def playback_info(iid: str):
+        return {
+            "PlaySessionId": uuid.uuid4().hex,
+            "MediaSources": [{"Id": f"source-{iid}", "DirectStreamUrl": f"/Videos/{iid}/stream"}],
+        }
+
+    @server.get("/Videos/{iid}/stream")
+    async def stream(iid: str):
+        async def body():
+            stats["streams"] += 1
+            try:
+                while True:
+                    yield b"\0" * 16384
+                    await asyncio.sleep(1)
+            finally:
+                stats["streams"] -= 1
+
+        return StreamingResponse(body(), media_type="video/mp4")
+
+    @server.post("/Sessions/Playing")
+    @server.post("/Sessions/Playing/Progress")
+    @server.post("/Sessions/Playing/Stopped")
+    async def sessions_playing():
+        return None
+
+    return server
+
+
+def serve(port: int):
+    import uvicorn
+
+    uvicorn.run(create_server_app(), host="127.0.0.1", port=port, log_level="error", access_log=False)
+
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def get_server_stats(base_url: str) -> dict:
+    from curl_cffi.requests import AsyncSession
+
+    async with AsyncSession() as session:
+        resp = await session.get(f"{base_url}/_bench/stats")
+        return resp.json()
+
+
+async def wait_server(base_url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return await get_server_stats(base_url)
+        except Exception:
+            if time.monotonic() > deadline:
+                raise RuntimeError("模拟 Emby 服务器启动超时")
+            await asyncio.sleep(0.2)
+
+
+async def sample(stop: asyncio.Event, result: dict, interval: float = 0.05):
+    """采样事件循环延迟与进程内存."""
+    loop = asyncio.get_running_loop()
+    proc = psutil.Process()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        result["lags"].append(max(0.0, loop.time() - start - interval))
+        result["rss"] = max(result["rss"], proc.memory_info().rss)
+
+
+async def run_once(manager, base_url: str, count: int, play_time: int) -> dict:
+    from embykeeper.schema import EmbyAccount
+
+    accounts = [
+        EmbyAccount(
+            url=base_url,
+            username=f"bench{count}-{i}",
+            password="password",
+            time=play_time,
+            use_proxy=False,
+        )
+        for i in range(count)
+    ]
+    sampled = {"lags": [], "rss": psutil.Process().memory_info().rss}
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample(stop, sampled))
+    before = (await get_server_stats(base_url))["requests"]
+    start = time.perf_counter()
+    try:
+        ctx = await manager._watch_main(accounts, instant=True)
+    finally:
+        wall = time.perf_counter() - start
+        stop.set()
+        await sampler
+    requests = (await get_server_stats(base_url))["requests"] - before
+    lags = sorted(sampled["lags"]) or [0.0]
+    return {
+        "accounts": count,
+        "status": ctx.status.name if ctx else None,
+        "wall": wall,
+        "peak_rss_mb": sampled["rss"] / 1024 / 1024,
+        "requests": requests,
+        "rps": requests / wall,
+        "lag_mean_ms": statistics.mean(lags) * 1000,
+        "lag_p99_ms": lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000,
+        "lag_max_ms": lags[-1] * 1000,
+    }
+
+
+def show_results(results: list):
+    table = Table(title="Emby 保活基准测试")
+    table.add_column("账户数", justify="right")
+    table.add_column("结果")
+    table.add_column("用时 (秒)", justify="right")
+    table.add_column("峰值内存 (MiB)", justify="right")
+    table.add_column("请求数", justify="right")
+    table.add_column("请求/秒", justify="right")
+    table.add_column("循环延迟 (毫秒)\n平均 / P99 / 最大", justify="right")
+    for r in results:
+        table.add_row(
+            str(r["accounts"]),
+            str(r["status"]),
+            f"{r['wall']:.1f}",
+            f"{r['peak_rss_mb']:.1f}",
+            str(r["requests"]),
+            f"{r['rps']:.1f}",
+            f"{r['lag_mean_ms']:.1f} / {r['lag_p99_ms']:.1f} / {r['lag_max_ms']:.0f}",
+        )
+    console.print(table)
+
+
+@app.async_command()
+async def main(
+    counts: str = typer.Option("10,100,1000", help="逗号分隔的账户数"),
+    play_time: int = typer.Option(20, "--time", help="每个账户的播放时长 (秒)"),
+    output: Path = typer.Option(None, help="将结果以 JSON 格式写入该文件"),
+    verbose: bool = typer.Option(False, help="输出保活过程日志"),
+):
+    logger.remove()
+    logger.add(sys.stderr, level="DEBUG" if verbose else "WARNING")
+
+    sizes = [int(c) for c in counts.split(",") if c.strip()]
+    with tempfile.TemporaryDirectory() as basedir:
+        config.basedir = basedir
+        config.set({"emby": {"concurrency": max(sizes), "server_concurrency": max(sizes), "retries": 1}})
+
+        from embykeeper.emby.main import EmbyManager
+
+        port = get_free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = multiprocessing.get_context("spawn").Process(target=serve, args=(port,), daemon=True)
+        server.start()
+        try:
+            await wait_server(base_url)
+            manager = EmbyManager()
+            results = []
+            for size in sizes:
+                console.print(f"正在以 {size} 个账户运行基准测试...")
+                results.append(await run_once(manager, base_url, size, play_time))
+        finally:
+            server.terminate()
+            server.join()
+
+    show_results(results)
+    if output:
+        output.write_text(json.dumps(results, indent=2, ensure_ascii=False), encoding="utf-8")
+
+
+if __name__ == "__main__":
+    app()